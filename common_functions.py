@@ -1,8 +1,9 @@
 import sys
+import json
 
-def print_error(err, line=None, severity="ERROR"):
+def format_error(err, line=None, severity="ERROR"):
     """
-    Prints informative errors (with sevirity and line number) to the stderr.
+    Formats an informative error (with sevirity and line number)
     """
 
     error_message = f"{severity}: {err}"
@@ -10,4 +11,131 @@ def print_error(err, line=None, severity="ERROR"):
     if line:
         error_message += f" at line {line}"
 
-    print(error_message, file=sys.stderr)
+    return error_message
+
+
+def print_error(err, line=None, severity="ERROR"):
+    """
+    Prints informative errors (with sevirity and line number) to the stderr.
+    """
+
+    print(format_error(err, line, severity), file=sys.stderr)
+
+
+class TooManyErrors(Exception):
+    """
+    Raised by Diagnostics once the maximal number of errors was reported, to abort the compilation early
+    """
+
+    pass
+
+
+class Diagnostics():
+    """
+    A buffered collector of diagnostics (errors and warnings)
+
+    Every diagnostic is stored as a structured record (severity, message, line and column),
+    And all the records are written at once by the flush function, either as text or as JSON.
+    Batch and service callers can use the records directly instead of flushing them.
+
+    If max_errors is given, TooManyErrors is raised once that many errors (of ERROR severity) were reported.
+    """
+
+    def __init__(self, max_errors=None, source=None):
+        self.max_errors = max_errors
+        self.records = list()
+        self.error_count = 0
+
+        # The source code being compiled, used for calculating columns out of token indexes
+        self.source = source
+
+
+    def get_column(self, index):
+        """
+        Returns the (1 based) column of the given index in the source code, or None if it can not be calculated
+        """
+
+        if index is None or self.source is None:
+            return None
+
+        return index - self.source.rfind('\n', 0, index)
+
+
+    def report(self, err, line=None, index=None, severity="ERROR"):
+        """
+        Adds a diagnostic record
+        Raises TooManyErrors if the error cap was reached
+        """
+
+        self.records.append({
+            'severity': severity,
+            'message': err,
+            'line': line,
+            'column': self.get_column(index),
+        })
+
+        if severity == "ERROR":
+            self.error_count += 1
+
+            if self.max_errors and self.error_count >= self.max_errors:
+                raise TooManyErrors(f"too many errors ({self.error_count})")
+
+
+    def add_records(self, records):
+        """
+        Adds diagnostic records which were collected elsewhere (such as by a compile server)
+        The error cap is not applied, as the records were already capped when they were collected
+        """
+
+        self.records.extend(records)
+        self.error_count += sum(1 for record in records if record['severity'] == "ERROR")
+
+
+    def format_text(self):
+        """
+        Returns the diagnostics in the same format print_error uses
+        """
+
+        return '\n'.join(format_error(record['message'], record['line'], record['severity']) for record in self.records)
+
+
+    def format_json(self):
+        """
+        Returns the diagnostics as a JSON document
+        """
+
+        return json.dumps({'errors': self.error_count, 'diagnostics': self.records})
+
+
+    def flush(self, format_='text', file=None):
+        """
+        Writes all the buffered diagnostics at once (to the stderr by default) and clears the buffer
+        """
+
+        if format_ == 'json':
+            output = self.format_json()
+        elif self.records:
+            output = self.format_text()
+        else:
+            output = None
+
+        if output is not None:
+            (file or sys.stderr).write(output + '\n')
+
+        self.records = list()
+
+
+class ImmediateDiagnostics(Diagnostics):
+    """
+    Diagnostics which are printed to the stderr (as print_error does) as soon as they are reported,
+    The default of the lexer and the parser, so errors are never lost when the caller gives them no Diagnostics object
+    The records are still kept, but flush doesn't write them again
+    """
+
+    def report(self, err, line=None, index=None, severity="ERROR"):
+        print_error(err, line, severity)
+        super().report(err, line, index, severity)
+
+
+    def flush(self, format_='text', file=None):
+        self.records = list()
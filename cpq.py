@@ -1,98 +1,399 @@
 import sys
 import os
-from cpq_lexer import CPQLexer
-from cpq_parser import CPQParser
-from common_functions import print_error
+import argparse
+from cpq_compiler import compile_source, CompileResult
+from cpq_watch import Watcher, DEFAULT_INTERVAL
+from cpq_quad import Program, QuadError, SIGNATURE
+from cpq_binary import dump, BINARY_FILE_SUFFIX
+from cpq_sourcemap import SourceMap, SOURCE_MAP_SUFFIX
+from cpq_slots import SlotLayout, SLOTS_SUFFIX
+from cpq_cost import CostModel, load_costs
+from cpq_cfg import FlowGraph
+from cpq_cbackend import CTranslator, C_FILE_SUFFIX
+from cpq_optimizer import LEVELS
+from common_functions import Diagnostics
 
 INPUT_FILE_SUFFIX = '.ou'
 OUTPUT_FILE_SUFFIX = '.qud'
 
 
-def notifiy_critical_error(error):
+def notifiy_critical_error(diagnostics, error):
     """
-    Notifies of a critical error using the print_error function
+    Notifies of a critical error using the given diagnostics
     """
-    
-    print_error(f"{error}, not creating {OUTPUT_FILE_SUFFIX} file", severity="CRITICAL")
+
+    diagnostics.report(f"{error}, not creating {OUTPUT_FILE_SUFFIX} file", severity="CRITICAL")
 
 
 def get_output_file_name(input_file_name):
     """
     Get the desired output file name based on a given input file name
-    
+
     Assums the input file is valid and ends with INPUT_FILE_SUFFIX, as this is checked before calling this function
     """
-    
+
     return OUTPUT_FILE_SUFFIX.join(input_file_name.rsplit(INPUT_FILE_SUFFIX, 1))
 
-def ensure_input():
+
+def get_output_file_names(input_file_name, output_format, source_map=False, backend='quad', slots=False):
+    """
+    Get the names of all the output files generated for a given input file name in the given output format
+    The source map and slot layout files (if requested) are the last ones
+    The C backend generates a single C file instead
+    """
+
+    ouput_file_name = get_output_file_name(input_file_name)
+
+    if backend == 'c':
+        return [C_FILE_SUFFIX.join(ouput_file_name.rsplit(OUTPUT_FILE_SUFFIX, 1))]
+    binary_file_name = BINARY_FILE_SUFFIX.join(ouput_file_name.rsplit(OUTPUT_FILE_SUFFIX, 1))
+
+    output_file_names = {
+        'text': [ouput_file_name],
+        'binary': [binary_file_name],
+        'both': [ouput_file_name, binary_file_name],
+    }[output_format]
+
+    if source_map:
+        output_file_names.append(SOURCE_MAP_SUFFIX.join(ouput_file_name.rsplit(OUTPUT_FILE_SUFFIX, 1)))
+
+    if slots:
+        output_file_names.append(SLOTS_SUFFIX.join(ouput_file_name.rsplit(OUTPUT_FILE_SUFFIX, 1)))
+
+    return output_file_names
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments
+    The number of input files is checked by ensure_input, to keep its informative errors
+    """
+
+    argument_parser = argparse.ArgumentParser(description='CPL to QUAD compiler')
+    argument_parser.add_argument('input_files', nargs='*', metavar='input-file.ou')
+    argument_parser.add_argument('--check', action='store_true',
+                                 help='only check the input file for errors, without generating code or files')
+    argument_parser.add_argument('--format', choices=['text', 'binary', 'both'], default='text',
+                                 help=f'write the QUAD code as text ({OUTPUT_FILE_SUFFIX}, default), '
+                                      f'as binary ({BINARY_FILE_SUFFIX}) or both')
+    argument_parser.add_argument('--backend', choices=['quad', 'c'], default='quad',
+                                 help=f'generate QUAD code (default), or a C translation unit ({C_FILE_SUFFIX}) '
+                                      f'to build with the system C compiler')
+    argument_parser.add_argument('-O', '--optimize', type=int, choices=sorted(LEVELS), default=0, metavar='LEVEL',
+                                 help=f'optimization level of the generated code (0 - {max(LEVELS)}, default 0)')
+    argument_parser.add_argument('--fast-math', action='store_true',
+                                 help='let the optimizer reassociate float arithmetic, which may change its rounding')
+    argument_parser.add_argument('--source-map', action='store_true',
+                                 help=f'also write a source map ({SOURCE_MAP_SUFFIX}) of the QUAD instructions '
+                                      f'back to their source lines')
+    argument_parser.add_argument('--slots', action='store_true',
+                                 help=f'also write a slot layout ({SLOTS_SUFFIX}), numbering the variables and temps '
+                                      f'densely per type, for executors which keep them in flat arrays')
+    argument_parser.add_argument('--cost-report', action='store_true',
+                                 help='print the estimated runtime cost of the generated code, by loop and '
+                                      'source line')
+    argument_parser.add_argument('--costs', metavar='FILE',
+                                 help='JSON file of the opcode costs (opcode -> cost) of the cost report and of the '
+                                      'cost model ordering loop unrolling')
+    argument_parser.add_argument('--watch', action='store_true',
+                                 help='watch the given input files and directories, and recompile the changed files')
+    argument_parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, metavar='SECONDS',
+                                 help=f'polling interval of the watch mode (default {DEFAULT_INTERVAL})')
+    argument_parser.add_argument('--server', metavar='ADDRESS',
+                                 help='compile using a running compile server (unix:/path/to/socket, host:port or port)')
+    argument_parser.add_argument('--max-errors', type=int, metavar='N',
+                                 help='abort the compilation after N errors')
+    argument_parser.add_argument('--fail-fast', action='store_true',
+                                 help='abort the compilation on the first error (same as --max-errors 1)')
+    argument_parser.add_argument('--diagnostics-format', choices=['text', 'json'], default='text',
+                                 help='format of the errors and warnings written to the stderr')
+
+    return argument_parser.parse_args()
+
+
+def ensure_watch_input(arguments, diagnostics):
+    """
+    Ensures that the inputs of the watch mode are existing directories or input files
+    Returns None if the input is problematic and True if the input is as expected
+    """
+
+    if len(arguments.input_files) == 0:
+        notifiy_critical_error(diagnostics, "no file was given")
+        return
+
+    for path in arguments.input_files:
+        if not os.path.isdir(path) and not path.endswith(INPUT_FILE_SUFFIX):
+            notifiy_critical_error(diagnostics, f"wrong file type ({path})")
+            return
+
+        if not os.path.exists(path):
+            notifiy_critical_error(diagnostics, f"input file doesn't exist ({path})")
+            return
+
+    if arguments.source_map and arguments.optimize:
+        notifiy_critical_error(diagnostics, "optimized code has no source map")
+        return
+
+    if arguments.backend == 'c' and (arguments.source_map or arguments.slots):
+        notifiy_critical_error(diagnostics, "the C backend writes no source map or slot layout")
+        return
+
+    if arguments.cost_report and arguments.check:
+        notifiy_critical_error(diagnostics, "the cost report needs generated code, it can't be used with --check")
+        return
+
+    return True
+
+
+def ensure_input(arguments, diagnostics):
     """
     Ensures that exactly one parameter was given, with the correct format and that the file exists
     Returns None if the input is problematic and True if the input is as expected
     """
 
-    if len(sys.argv) == 1:
-        notifiy_critical_error("no file was given")
+    if len(arguments.input_files) == 0:
+        notifiy_critical_error(diagnostics, "no file was given")
+        return
+
+    if len(arguments.input_files) > 1:
+        notifiy_critical_error(diagnostics, "too many arguments")
+        return
+
+    if not arguments.input_files[0].endswith(INPUT_FILE_SUFFIX):
+        notifiy_critical_error(diagnostics, "wrong file type")
+        return
+
+    if arguments.source_map and arguments.optimize:
+        notifiy_critical_error(diagnostics, "optimized code has no source map")
+        return
+
+    if arguments.backend == 'c' and (arguments.source_map or arguments.slots):
+        notifiy_critical_error(diagnostics, "the C backend writes no source map or slot layout")
+        return
+
+    if arguments.cost_report and arguments.check:
+        notifiy_critical_error(diagnostics, "the cost report needs generated code, it can't be used with --check")
+        return
+
+    output_file_names = get_output_file_names(arguments.input_files[0], arguments.format, arguments.source_map,
+                                              arguments.backend, arguments.slots)
+
+    if not arguments.check and any(os.path.exists(file_name) for file_name in output_file_names):
+        notifiy_critical_error(diagnostics, "output file already exists")
+        return
+
+    if not os.path.exists(arguments.input_files[0]):
+        notifiy_critical_error(diagnostics, "input file doesn't exist")
+        return
+
+    return True
+
+
+def compile_remotely(arguments, diagnostics, code_to_translate, costs=None):
+    """
+    Compiles the given code using the compile server given in the arguments (and the given opcode costs)
+
+    Returns a CompileResult object, or None if the server could not be used
+    """
+
+    # The server module (and asyncio with it) is only imported in client mode, so compiling a file doesn't pay for it
+    from cpq_server import CompileClient
+
+    try:
+        client = CompileClient(arguments.server)
+
+        try:
+            response = client.compile(code_to_translate, check=arguments.check, max_errors=diagnostics.max_errors,
+                                      optimize=arguments.optimize, fast_math=arguments.fast_math, costs=costs)
+        finally:
+            client.close()
+    except (OSError, ValueError) as error:
+        notifiy_critical_error(diagnostics, f"can't use the compile server ({error})")
         return
 
-    if len(sys.argv) > 2:
-        notifiy_critical_error("too many arguments")
+    if 'error' in response:
+        notifiy_critical_error(diagnostics, f"compile server error ({response['error']})")
         return
 
-    if not sys.argv[1].endswith(INPUT_FILE_SUFFIX):
-        notifiy_critical_error("wrong file type")
+    diagnostics.add_records(response['diagnostics'])
+
+    return CompileResult(response['instructions'], response['diagnostics'], response['statistics'], response['aborted'],
+                         response.get('source_lines'))
+
+
+def write_atomically(file_name, data):
+    """
+    Writes the given data (text or bytes) to the given file
+    The data is written to a temporary file which then replaces the file, so the file is replaced atomically
+    """
+
+    temporary_file_name = f'{file_name}.{os.getpid()}.tmp'
+
+    try:
+        with open(temporary_file_name, 'wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+
+        os.replace(temporary_file_name, file_name)
+    finally:
+        if os.path.exists(temporary_file_name):
+            os.unlink(temporary_file_name)
+
+
+def write_output(input_file_name, translated_code, output_format, source_lines=None, slots=False):
+    """
+    Writes the given QUAD code to the output files of the given input file, based on the output format
+    The text output has the signature at its end, the binary output is the linked program
+    If the source line numbers of the code are given, a source map is written as well
+    If slots is True, the slot layout of the code is written as well
+
+    The contents of all the files are built before any of them is written, so a QuadError raised while building them
+    (such as by an int constant the binary format can't hold) leaves no partial output
+    """
+
+    outputs = list()
+
+    for file_name in get_output_file_names(input_file_name, output_format, source_lines is not None, slots=slots):
+        if file_name.endswith(SOURCE_MAP_SUFFIX):
+            source_map = SourceMap.from_code(translated_code, source_lines, os.path.basename(input_file_name))
+            outputs.append((file_name, source_map.dumps()))
+        elif file_name.endswith(SLOTS_SUFFIX):
+            outputs.append((file_name, SlotLayout.from_program(Program.from_lines(translated_code)).dumps()))
+        elif file_name.endswith(BINARY_FILE_SUFFIX):
+            outputs.append((file_name, dump(Program.from_lines(translated_code).link())))
+        else:
+            outputs.append((file_name, '\n'.join(translated_code + [SIGNATURE])))
+
+    for file_name, data in outputs:
+        write_atomically(file_name, data)
+
+
+def report_cost(source, result, costs=None):
+    """
+    Prints the report of the estimated runtime cost of the compiled code (see cpq_cost.CostEstimate.report)
+    The costs are attributed to source lines, unless the code was optimized (and has no source lines)
+    """
+
+    estimate = CostModel(costs).estimate(FlowGraph.from_program(Program.from_lines(result.instructions)))
+    lines = SourceMap.from_code(result.instructions, result.source_lines).lines if result.source_lines else None
+
+    print('\n'.join(estimate.report(lines, source)))
+
+
+def compile_file(arguments, diagnostics, input_file_name):
+    """
+    Compiles the given input file, and generates the .qud file if no errors were encountered
+    In check mode, code emission is disabled and no file is generated
+
+    Returns True if no errors were encountered
+    """
+
+    # Read the contents of the input file
+    with open(input_file_name, 'r') as file:
+        code_to_translate = file.read()
+
+    # Load the opcode costs of the cost model, used by the optimizer and the cost report
+    try:
+        costs = load_costs(arguments.costs) if arguments.costs else None
+    except (OSError, ValueError) as error:
+        notifiy_critical_error(diagnostics, f"can't load the opcode costs ({error})")
+        return
+
+    # Compile the code in memory, or using the compile server
+    if arguments.server:
+        result = compile_remotely(arguments, diagnostics, code_to_translate, costs)
+
+        if result is None:
+            return
+    else:
+        result = compile_source(code_to_translate, check=arguments.check, diagnostics=diagnostics,
+                                optimize=arguments.optimize, fast_math=arguments.fast_math, costs=costs)
+
+    if result.aborted:
+        notifiy_critical_error(diagnostics, result.aborted)
         return
 
-    if os.path.exists(get_output_file_name(sys.argv[1])):
-        notifiy_critical_error("output file already exists")
+    # Check for compilation errors before generating .qod file
+    if not result.succeeded:
+        notifiy_critical_error(diagnostics, 'Encountered errors during complication')
         return
-    
-    if not os.path.exists(sys.argv[1]):
-        notifiy_critical_error("input file doesn't exist")
+
+    if arguments.check:
+        return True
+
+    # Report the estimated cost of the code, if requested
+    if arguments.cost_report:
+        report_cost(code_to_translate, result, costs)
+
+    # Generate the C file, for the C backend
+    if arguments.backend == 'c':
+        c_file_name = get_output_file_names(input_file_name, arguments.format, backend='c')[0]
+        write_atomically(c_file_name, CTranslator(Program.from_lines(result.instructions).link()).source())
+        return True
+
+    # Generate .qod file (and/or binary file) with the QUAD code, and the source map and slot layout if requested
+    try:
+        write_output(input_file_name, result.instructions, arguments.format,
+                     result.source_lines if arguments.source_map else None, arguments.slots)
+    except QuadError as error:
+        notifiy_critical_error(diagnostics, f"can't write the output files ({error})")
         return
-    
+
     return True
 
 
+def watch(arguments):
+    """
+    Watch mode - recompiles the watched input files whenever their content changes
+    The compiler is kept warm between rebuilds, and the diagnostics of every rebuild are flushed once it is done
+    """
+
+    def build(input_file_name):
+        diagnostics = Diagnostics(max_errors=1 if arguments.fail_fast else arguments.max_errors)
+
+        # The file may be gone (or not be text) by the time it is built, such as while an editor replaces it
+        try:
+            succeeded = compile_file(arguments, diagnostics, input_file_name)
+        except (OSError, UnicodeDecodeError) as error:
+            notifiy_critical_error(diagnostics, f"can't build {input_file_name} ({error})")
+            succeeded = False
+
+        diagnostics.flush(arguments.diagnostics_format)
+        return succeeded
+
+    Watcher(arguments.input_files, build, INPUT_FILE_SUFFIX, arguments.interval).run()
+
+
 def main():
     """
     CPL to QUAD compiler main function
+
+    Returns the exit status - 0 if the compilation succeeded and 1 otherwise
     """
-    
+
     # Print signature to stderr
     print("Efrat Elisha :)", file=sys.stderr)
-    
+
+    arguments = parse_arguments()
+
+    # Errors and warnings are buffered, and written to the stderr once the compilation is done
+    diagnostics = Diagnostics(max_errors=1 if arguments.fail_fast else arguments.max_errors)
+
+    succeeded = False
+
+    if arguments.watch:
+        if ensure_watch_input(arguments, diagnostics):
+            diagnostics.flush(arguments.diagnostics_format)
+            watch(arguments)
+            return 0
+
     # Check input before proceeding to compilation
-    if not ensure_input():
-        return
-    
-    input_file_name = sys.argv[1]
-    ouput_file_name = get_output_file_name(input_file_name)
-    
-    # Read the contents of the input file
-    with open(input_file_name, 'r') as file:    
-        code_to_translate = file.read()
-    
-    # Run the lexer
-    lexer = CPQLexer()
-    tokens = lexer.tokenize(code_to_translate)
-    
-    # Run the parser
-    parser = CPQParser()
-    translated_code = parser.parse(tokens)
-    
-    # Check for compilation errors before generating .qod file
-    if lexer.found_errors or parser.found_errors:
-        notifiy_critical_error('Encountered errors during complication')
-        return
-    
-    # Add signature at the end of the QUAD code
-    translated_code.append('Efrat Elisha :)')
-    
-    # Generate .qod file with the QUAD code
-    with open(ouput_file_name, 'w') as file:
-        file.write('\n'.join(translated_code))
-    
+    elif ensure_input(arguments, diagnostics):
+        succeeded = compile_file(arguments, diagnostics, arguments.input_files[0])
+
+    diagnostics.flush(arguments.diagnostics_format)
+
+    return 0 if succeeded else 1
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,1102 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+import random
+import gc
+import tracemalloc
+from time import perf_counter
+from cpq_lexer import CPQLexer
+from cpq_parser import CPQParser
+from cpq_compiler import Compiler, compile_source
+from cpq_workload import generate_program
+from cpq_server import CompileClient
+from cpq_quad import Program, Instruction, JUMP_OPCODES, OPCODES
+from cpq_binary import dump, load, write_file
+from cpq_vm import Machine, interpret, ClosureCompiler
+from cpq_vectorized import BatchExecutor, np
+from cpq_exec_profiler import ProfilingCompiler, Profile, profile
+from cpq_superinstructions import ThreadedEngine, mine, select
+from cpq_runner import run_batch, OUTPUT_SUFFIX
+from cpq_cbackend import CTranslator, CBackendError, build
+from cpq_optimizer import optimize_code, MAX_LEVEL, PASSES, LEVELS
+from cpq_cfg import FlowGraph
+from cpq_ssa import SSAForm, ConstantPropagation, DenseConstantPropagation
+from cpq_slots import SlotLayout, INT_SLOT, REAL_SLOT
+from cpq_cost import CostModel
+from cpq_sourcemap import SourceMap
+
+# Workload sizes (number of top level statements) the benchmarks run on
+SIZES = {
+    'small': 20,
+    'medium': 100,
+    'large': 500,
+}
+
+# Programs with more instructions than this skip the dense constant propagation of the ssa benchmark,
+# Which takes minutes on them
+DENSE_LIMIT = 20000
+
+# Directory of the sample programs the runtime benchmarks run on
+# Every sample program (name.ou) has an input file (name.in) holding its input stream
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+
+# Number of instructions of the QUAD programs the QUAD loading benchmark runs on, per workload size
+QUAD_LOAD_INSTRUCTIONS = {
+    'small': 10_000,
+    'medium': 100_000,
+    'large': 1_000_000,
+}
+
+# Number of input sets the batch execution benchmark runs every sample program on
+BATCH_LANES = 256
+
+# Number of input files the parallel runner benchmark runs every sample program on
+RUNNER_INPUTS = 32
+
+# Default number of repetitions of every timed benchmark (the best run is reported)
+DEFAULT_REPEAT = 3
+
+
+def get_commit():
+    """
+    Returns the current git commit hash, or None if it can not be determined
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_samples():
+    """
+    Returns the sorted list of the names of the sample programs
+    """
+
+    return sorted(file_name[:-len('.ou')] for file_name in os.listdir(SAMPLES_DIRECTORY) if file_name.endswith('.ou'))
+
+
+def load_sample(name):
+    """
+    Compiles the sample program of the given name
+
+    Returns a dictionary of its source code, its compiled instructions, its Executable and its input tokens
+    """
+
+    with open(os.path.join(SAMPLES_DIRECTORY, f'{name}.ou'), 'r') as file:
+        source = file.read()
+
+    with open(os.path.join(SAMPLES_DIRECTORY, f'{name}.in'), 'r') as file:
+        inputs = file.read().split()
+
+    instructions = compile_source(source).instructions
+
+    return {
+        'name': name,
+        'source': source,
+        'instructions': instructions,
+        'executable': Program.from_lines(instructions).link(),
+        'inputs': inputs,
+    }
+
+
+def get_workload(size):
+    """
+    Returns the source code of the synthetic workload of the given size name
+    """
+
+    return generate_program(variables=50, statements=SIZES[size], seed=0)
+
+
+def time_best(func, repeat):
+    """
+    Runs the given function repeat times
+    Returns the best (lowest) running time in seconds and the result of the last run
+    """
+
+    best = None
+
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def percentile(samples, fraction):
+    """
+    Returns the given percentile (as a fraction between 0 and 1) of the given samples
+    """
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(samples):
+    """
+    Returns a summary of the given latency samples (in seconds), in milliseconds
+    """
+
+    return {
+        'calls': len(samples),
+        'mean_ms': sum(samples) * 1e3 / len(samples),
+        'p50_ms': percentile(samples, 0.5) * 1e3,
+        'p99_ms': percentile(samples, 0.99) * 1e3,
+    }
+
+
+def tokenize(source):
+    """
+    Runs the lexer on the given source code and returns the list of tokens
+    """
+
+    return list(CPQLexer().tokenize(source))
+
+
+def parse(tokens, emit_code=True):
+    """
+    Runs a fresh parser on the given list of tokens and returns the generated QUAD code
+    """
+
+    return CPQParser(emit_code=emit_code).parse(iter(tokens))
+
+
+def bench_tokenize(source, repeat, size):
+    """
+    Measures the throughput of CPQLexer.tokenize on the given source code
+    """
+
+    seconds, tokens = time_best(lambda: tokenize(source), repeat)
+
+    return {
+        'seconds': seconds,
+        'tokens': len(tokens),
+        'tokens_per_second': len(tokens) / seconds,
+        'bytes_per_second': len(source) / seconds,
+    }
+
+
+def bench_parse(source, repeat, size):
+    """
+    Measures the throughput of CPQParser.parse on the (pre-tokenized) given source code,
+    And counts the int/real conversions in the generated code
+    """
+
+    tokens = tokenize(source)
+    seconds, quad_code = time_best(lambda: parse(tokens), repeat)
+
+    return {
+        'seconds': seconds,
+        'tokens_per_second': len(tokens) / seconds,
+        'instructions': len(quad_code),
+        'instructions_per_second': len(quad_code) / seconds,
+        'conversions': sum(line.split()[0] in ('ITOR', 'RTOI') for line in quad_code),
+    }
+
+
+def bench_check(source, repeat, size):
+    """
+    Measures the throughput of CPQParser.parse with code emission disabled (as done by cpq.py --check),
+    Compared to a full parse of the same (pre-tokenized) source code
+    """
+
+    tokens = tokenize(source)
+    seconds = time_best(lambda: parse(tokens, emit_code=False), repeat)[0]
+    full_seconds = time_best(lambda: parse(tokens), repeat)[0]
+
+    return {
+        'seconds': seconds,
+        'tokens_per_second': len(tokens) / seconds,
+        'speedup': full_seconds / seconds,
+    }
+
+
+def bench_api(source, repeat, size):
+    """
+    Measures the per call latency of compile_source (which reuses a warm compiler),
+    Compared to creating a new Compiler for every call
+    """
+
+    calls = repeat * 10
+
+    warm = list()
+    for _ in range(calls):
+        start = perf_counter()
+        compile_source(source)
+        warm.append(perf_counter() - start)
+
+    fresh = list()
+    for _ in range(calls):
+        start = perf_counter()
+        Compiler().compile(source)
+        fresh.append(perf_counter() - start)
+
+    return {
+        'warm': latency_summary(warm),
+        'fresh_compiler': latency_summary(fresh),
+    }
+
+
+def bench_ssa(source, repeat, size):
+    """
+    Measures the analysis time of sparse conditional constant propagation (including the SSA construction),
+    Compared to dense constant propagation over the blocks (which runs once, and is skipped past DENSE_LIMIT),
+    And the constants each of them finds in the code the sparse one finds reachable
+    """
+
+    program = Program.from_lines(compile_source(source).instructions)
+
+    def sparse():
+        form = SSAForm(FlowGraph.from_program(program))
+        propagation = ConstantPropagation(form)
+        propagation.run()
+        return form, propagation
+
+    def dense():
+        propagation = DenseConstantPropagation(FlowGraph.from_program(program))
+        propagation.run()
+        return propagation
+
+    seconds, (form, propagation) = time_best(sparse, repeat)
+    reachable = sum(1 for instructions in form.blocks if instructions is not None)
+
+    results = {
+        'seconds': seconds,
+        'instructions': len(program.instructions),
+        'variables': len(form.counts),
+        'phis': sum(len(phis) for phis in form.phis),
+        'constants': propagation.constant_uses(),
+        'unreachable_blocks': reachable - len(propagation.executable),
+    }
+
+    if len(program.instructions) <= DENSE_LIMIT:
+        dense_seconds, dense_propagation = time_best(dense, 1)
+        results['dense_seconds'] = dense_seconds
+        results['speedup'] = dense_seconds / seconds
+        results['dense_constants'] = dense_propagation.constant_uses(propagation.executable)
+
+    return results
+
+
+def bench_passes(source, repeat, size):
+    """
+    Measures the time every optimization pass of the highest optimization level takes on the compiled source code,
+    Every pass running on the output of the passes before it (as optimize runs them)
+    """
+
+    lines = compile_source(source).instructions
+    results = { 'instructions': len(lines) }
+
+    for name in LEVELS[MAX_LEVEL]:
+        best = None
+
+        # The passes edit the instructions of the program they get, so every run gets a fresh copy
+        for _ in range(repeat):
+            program = Program.from_lines(lines)
+            start = perf_counter()
+            optimized = PASSES[name](program, dict())
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        results[f'{name}_seconds'] = best
+        lines = optimized.to_lines()
+
+    results['optimized_instructions'] = len(lines)
+
+    return results
+
+
+def bench_slots(source, repeat, size):
+    """
+    Measures the time to build the slot layout of the compiled source code,
+    And the number of slots its variables and temps share
+    """
+
+    program = Program.from_lines(compile_source(source).instructions)
+    seconds, layout = time_best(lambda: SlotLayout.from_program(program), repeat)
+    slots = layout.counts[INT_SLOT] + layout.counts[REAL_SLOT]
+
+    return {
+        'seconds': seconds,
+        'symbols': len(layout.slots),
+        'int_slots': layout.counts[INT_SLOT],
+        'real_slots': layout.counts[REAL_SLOT],
+        'symbols_per_slot': len(layout.slots) / slots if slots else 0,
+    }
+
+
+def start_server(address, workers):
+    """
+    Starts a compile server in a subprocess, and waits until it accepts connections
+
+    Returns the server process and a client connected to it
+    """
+
+    server = subprocess.Popen([sys.executable, 'cpq_server.py', '--listen', address, '--workers', str(workers)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL)
+
+    deadline = perf_counter() + 30
+
+    while True:
+        try:
+            return server, CompileClient(address)
+        except OSError:
+            if perf_counter() > deadline or server.poll() is not None:
+                server.kill()
+                raise
+            time.sleep(0.05)
+
+
+def bench_server(source, repeat, size):
+    """
+    Measures the latency of compiling through a running compile server (using the cpq.py client mode protocol),
+    Compared to a cold invocation of cpq.py in a new process
+    """
+
+    calls = repeat * 10
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_file_name = os.path.join(directory, 'workload.ou')
+        output_file_name = os.path.join(directory, 'workload.qud')
+
+        with open(input_file_name, 'w') as file:
+            file.write(source)
+
+        server, client = start_server(f'unix:{os.path.join(directory, "cpq.sock")}', workers=1)
+
+        try:
+            warm = list()
+            for _ in range(calls):
+                start = perf_counter()
+                client.compile(source)
+                warm.append(perf_counter() - start)
+        finally:
+            client.close()
+            server.terminate()
+            server.wait()
+
+        cold = list()
+        for _ in range(max(1, calls // 5)):
+            start = perf_counter()
+            subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cpq.py'),
+                            input_file_name], stderr=subprocess.DEVNULL)
+            cold.append(perf_counter() - start)
+            os.unlink(output_file_name)
+
+    warm_summary = latency_summary(warm)
+    cold_summary = latency_summary(cold)
+
+    return {
+        'server': warm_summary,
+        'cold': cold_summary,
+        'p50_speedup': cold_summary['p50_ms'] / warm_summary['p50_ms'],
+    }
+
+
+def replicate(program, instructions):
+    """
+    Returns a program consisting of copies of the given program (with renamed labels),
+    With at least the given number of instructions
+    The HALT at the end of every copy but the last one is dropped, so the copies run one after the other
+    """
+
+    body = program.instructions[:-1]
+    replicated = Program()
+    copy_number = 0
+
+    while len(replicated.instructions) < instructions:
+        offset = len(replicated.instructions)
+
+        for label, index in program.labels.items():
+            replicated.labels[f'{label}_{copy_number}'] = offset + index
+
+        for instruction in body:
+            operands = list(instruction.operands)
+
+            if instruction.opcode in JUMP_OPCODES:
+                operands[0] = f'{operands[0]}_{copy_number}'
+
+            replicated.instructions.append(Instruction(instruction.opcode, operands))
+
+        copy_number += 1
+
+    replicated.instructions.append(program.instructions[-1])
+    return replicated
+
+
+def bench_quad_load(source, repeat, size):
+    """
+    Measures the time it takes to load a (replicated) compiled program into an Executable,
+    From the text QUAD format (parsing and linking) and from the binary QUAD format
+    Also verifies the binary format round trip against the text format
+    """
+
+    program = replicate(Program.from_lines(compile_source(source).instructions), QUAD_LOAD_INSTRUCTIONS[size])
+    text = '\n'.join(program.to_lines())
+    data = dump(program.link())
+
+    text_seconds, from_text = time_best(lambda: Program.from_text(text).link(), repeat)
+    binary_seconds, from_binary = time_best(lambda: load(data), repeat)
+
+    if not from_text.equals(from_binary):
+        raise AssertionError('the binary QUAD round trip does not match the text QUAD format')
+
+    return {
+        'instructions': len(from_text),
+        'text_bytes': len(text),
+        'binary_bytes': len(data),
+        'text_seconds': text_seconds,
+        'binary_seconds': binary_seconds,
+        'speedup': text_seconds / binary_seconds,
+    }
+
+
+def collections():
+    """
+    Returns the number of garbage collections run so far (of all generations)
+    """
+
+    return sum(generation['collections'] for generation in gc.get_stats())
+
+
+def bench_memory(source, repeat, size):
+    """
+    Measures the peak memory allocated while tokenizing and parsing the given source code,
+    The number of memory blocks the tokens and the generated code hold on to,
+    And the number of garbage collections triggered by the objects the parser allocates
+    """
+
+    tracemalloc.start()
+
+    try:
+        tokens = tokenize(source)
+        tokenize_peak = tracemalloc.get_traced_memory()[1]
+        tokenize_blocks = len(tracemalloc.take_snapshot().traces)
+
+        tracemalloc.reset_peak()
+        collections_before = collections()
+        # The generated code is kept until the snapshot, so its blocks are counted
+        code = parse(tokens)
+        parse_collections = collections() - collections_before
+        parse_peak = tracemalloc.get_traced_memory()[1]
+        parse_blocks = len(tracemalloc.take_snapshot().traces) - tokenize_blocks
+        del code
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'tokenize_peak_bytes': tokenize_peak,
+        'tokenize_blocks': tokenize_blocks,
+        'parse_peak_bytes': parse_peak,
+        'parse_blocks': parse_blocks,
+        'parse_collections': parse_collections,
+    }
+
+
+# Dictionary of all benchmarks, each one is called with the source code of a workload, the number of repetitions
+# and the name of the workload size
+BENCHMARKS = {
+    'tokenize': bench_tokenize,
+    'parse': bench_parse,
+    'check': bench_check,
+    'api': bench_api,
+    'server': bench_server,
+    'quad_load': bench_quad_load,
+    'memory': bench_memory,
+    'ssa': bench_ssa,
+    'passes': bench_passes,
+    'slots': bench_slots,
+}
+
+
+def run_engine(engine, sample):
+    """
+    Runs the given engine (a function getting a Machine) on the input stream of the given sample
+
+    Returns the outputs of the run
+    """
+
+    machine = Machine(sample['inputs'])
+    engine(machine)
+    return machine.outputs
+
+
+def bench_engines(sample, repeat):
+    """
+    Measures the execution time of the closure compiled engine compared to instruction by instruction interpretation
+    Also verifies that both engines produce the same outputs
+    """
+
+    executable = sample['executable']
+
+    executed = interpret(executable, Machine(sample['inputs']))
+    interpret_seconds, expected = time_best(lambda: run_engine(lambda machine: interpret(executable, machine), sample),
+                                            repeat)
+
+    translate_seconds, run = time_best(lambda: ClosureCompiler(executable).compile(), repeat)
+    closure_seconds, outputs = time_best(lambda: run_engine(run, sample), repeat)
+
+    if outputs != expected:
+        raise AssertionError(f'the closure engine outputs of {sample["name"]} do not match the interpreter')
+
+    return {
+        'executed_instructions': executed,
+        'interpret_seconds': interpret_seconds,
+        'translate_seconds': translate_seconds,
+        'closure_seconds': closure_seconds,
+        'speedup': interpret_seconds / closure_seconds,
+    }
+
+
+def get_input_sets(sample, lanes):
+    """
+    Returns the given number of input sets for the given sample, derived from its input stream
+    Every int input n is replaced by a random int between n / 20 and n / 10, so the runs take different paths
+    (and the benchmark takes about as long as a single run of the sample on its own input)
+    """
+
+    generator = random.Random(0)
+    input_sets = list()
+
+    for _ in range(lanes):
+        input_sets.append([ str(generator.randint(int(token) // 20, int(token) // 10)) if token.isdigit() else token
+                            for token in sample['inputs'] ])
+
+    return input_sets
+
+
+def bench_batch(sample, repeat):
+    """
+    Measures the execution time of running the sample on many input sets with the vectorized batch executor,
+    Compared to running the closure compiled engine once per input set
+    Also verifies that both produce the same outputs for every input set
+    Skipped (returns None) if NumPy is not installed
+    """
+
+    if np is None:
+        return None
+
+    executable = sample['executable']
+    input_sets = get_input_sets(sample, BATCH_LANES)
+    run = ClosureCompiler(executable).compile()
+
+    def run_each():
+        return [ run_engine(run, { 'inputs': inputs }) for inputs in input_sets ]
+
+    closure_seconds, expected = time_best(run_each, repeat)
+    batch_seconds, results = time_best(lambda: BatchExecutor(executable).run(input_sets), repeat)
+
+    for inputs, outputs, (batch_outputs, error) in zip(input_sets, expected, results):
+        if error is not None or batch_outputs != outputs:
+            raise AssertionError(f'the batch outputs of {sample["name"]} on {inputs} do not match the closure engine')
+
+    return {
+        'lanes': BATCH_LANES,
+        'closure_seconds': closure_seconds,
+        'batch_seconds': batch_seconds,
+        'speedup': closure_seconds / batch_seconds,
+    }
+
+
+def bench_profile(sample, repeat):
+    """
+    Measures the overhead of running the sample with execution profiling, compared to the closure compiled engine
+    Also verifies that the profiled instruction counts match the ones of the interpreter
+    """
+
+    executable = sample['executable']
+
+    expected = [0] * len(executable)
+    interpret(executable, Machine(sample['inputs']), expected)
+
+    run = ClosureCompiler(executable).compile()
+    closure_seconds, _ = time_best(lambda: run_engine(run, sample), repeat)
+
+    def run_profiled():
+        compiler = ProfilingCompiler(executable)
+        run_engine(compiler.compile(), sample)
+        return compiler
+
+    profile_seconds, compiler = time_best(run_profiled, repeat)
+    counts = Profile(executable, compiler.block_counts, compiler.taken_counts).instruction_counts()
+
+    if counts != expected:
+        raise AssertionError(f'the profiled instruction counts of {sample["name"]} do not match the interpreter')
+
+    return {
+        'closure_seconds': closure_seconds,
+        'profile_seconds': profile_seconds,
+        'overhead': profile_seconds / closure_seconds - 1,
+    }
+
+
+def get_superinstructions():
+    """
+    Returns the superinstructions selected from the instruction sequences executed by all the sample programs
+    """
+
+    executables = list()
+    counts = list()
+
+    for name in get_samples():
+        sample = load_sample(name)
+        executables.append(sample['executable'])
+        counts.append([0] * len(sample['executable']))
+        interpret(sample['executable'], Machine(sample['inputs']), counts[-1])
+
+    return select(mine(executables, counts))
+
+
+def bench_superinstructions(sample, repeat):
+    """
+    Measures the dispatch count and the execution time of the threaded engine with superinstructions (mined from
+    All the samples), compared to the threaded engine without them
+    Also verifies that both produce the same outputs as the interpreter
+    """
+
+    global superinstructions
+
+    if superinstructions is None:
+        superinstructions = get_superinstructions()
+
+    executable = sample['executable']
+    expected = run_engine(lambda machine: interpret(executable, machine), sample)
+
+    results = dict()
+
+    for name, selected in (('plain', ()), ('fused', superinstructions)):
+        run = ThreadedEngine(executable, selected).compile()
+        machine = Machine(sample['inputs'])
+        results[f'{name}_dispatches'] = run(machine)
+        results[f'{name}_seconds'], outputs = time_best(lambda: run_engine(run, sample), repeat)
+
+        if outputs != expected:
+            raise AssertionError(f'the {name} threaded engine outputs of {sample["name"]} do not match the interpreter')
+
+    results['dispatch_reduction'] = 1 - results['fused_dispatches'] / results['plain_dispatches']
+    results['speedup'] = results['plain_seconds'] / results['fused_seconds']
+
+    return results
+
+
+def bench_runner(sample, repeat):
+    """
+    Measures the throughput of the parallel batch runner (with a worker per core) on many input files,
+    Compared to running the closure compiled engine on them one after the other in a single process
+    Also verifies that the outputs the runner writes match the ones of the single process runs
+    """
+
+    executable = sample['executable']
+    input_sets = get_input_sets(sample, RUNNER_INPUTS)
+    run = ClosureCompiler(executable).compile()
+
+    serial_seconds, expected = time_best(lambda: [ run_engine(run, { 'inputs': inputs }) for inputs in input_sets ],
+                                         repeat)
+
+    with tempfile.TemporaryDirectory() as directory:
+        program_file_name = os.path.join(directory, f'{sample["name"]}.qbin')
+        write_file(program_file_name, executable)
+
+        input_file_names = list()
+
+        for number, inputs in enumerate(input_sets):
+            input_file_names.append(os.path.join(directory, f'{number}.in'))
+
+            with open(input_file_names[-1], 'w') as file:
+                file.write(' '.join(inputs))
+
+        output_directory = os.path.join(directory, 'outputs')
+        runner_seconds, summary = time_best(lambda: run_batch(program_file_name, input_file_names, output_directory),
+                                            repeat)
+
+        for number, outputs in enumerate(expected):
+            with open(os.path.join(output_directory, f'{number}{OUTPUT_SUFFIX}'), 'r') as file:
+                if file.read().split() != outputs:
+                    raise AssertionError(f'the runner outputs of {sample["name"]} do not match the closure engine')
+
+    return {
+        'runs': RUNNER_INPUTS,
+        'workers': summary['workers'],
+        'serial_seconds': serial_seconds,
+        'runner_seconds': runner_seconds,
+        'speedup': serial_seconds / runner_seconds,
+    }
+
+
+def bench_native(sample, repeat):
+    """
+    Measures the execution time of the sample built by the C backend, compared to the closure compiled engine
+    The native time includes the process startup, as the program runs as its own executable
+    Also verifies that the native outputs match the ones of the interpreter
+    Skipped (returns None) if there is no working C compiler
+    """
+
+    executable = sample['executable']
+    expected = run_engine(lambda machine: interpret(executable, machine), sample)
+
+    run = ClosureCompiler(executable).compile()
+    closure_seconds, _ = time_best(lambda: run_engine(run, sample), repeat)
+
+    with tempfile.TemporaryDirectory() as directory:
+        c_file_name = os.path.join(directory, f'{sample["name"]}.c')
+        executable_file_name = os.path.join(directory, sample['name'])
+
+        with open(c_file_name, 'w') as file:
+            file.write(CTranslator(executable).source())
+
+        try:
+            build_seconds, _ = time_best(lambda: build(c_file_name, executable_file_name), 1)
+        except CBackendError:
+            return None
+
+        stdin = ' '.join(sample['inputs'])
+        native_seconds, result = time_best(lambda: subprocess.run([executable_file_name], input=stdin,
+                                                                  capture_output=True, text=True), repeat)
+
+    if result.stdout.split() != expected:
+        raise AssertionError(f'the native outputs of {sample["name"]} do not match the interpreter')
+
+    return {
+        'build_seconds': build_seconds,
+        'closure_seconds': closure_seconds,
+        'native_seconds': native_seconds,
+        'speedup': closure_seconds / native_seconds,
+    }
+
+
+def executed_opcodes(executable, sample):
+    """
+    Runs the given executable on the input stream of the given sample, counting its executed instructions
+
+    Returns the outputs of the run and a dictionary of opcode -> number of executions
+    """
+
+    counters = [0] * len(executable)
+    machine = Machine(sample['inputs'])
+    interpret(executable, machine, counters)
+
+    executions = dict()
+
+    for opcode, count in zip(executable.opcodes, counters):
+        executions[OPCODES[opcode]] = executions.get(OPCODES[opcode], 0) + count
+
+    return machine.outputs, executions
+
+
+def count_temps(executable):
+    """
+    Returns the number of distinct temps of the given executable - the symbols the compiler (tX)
+    Or the optimizer (starting with an underscore) generated
+    """
+
+    return sum(1 for symbol in executable.symbols if symbol[0] == '_' or (symbol[0] == 't' and symbol[1:].isdigit()))
+
+
+def bench_optimizer(sample, repeat):
+    """
+    Measures the instructions the optimizer saves - executed instructions, multiplications, jumps and conversions,
+    And the number of instructions and temps of the program - at the highest optimization level,
+    And the executed instructions every pass saves on its own
+    Also verifies that the optimized programs produce the same outputs
+    """
+
+    optimize_seconds, instructions = time_best(lambda: optimize_code(sample['instructions'], MAX_LEVEL), repeat)
+    optimized = Program.from_lines(instructions).link()
+
+    expected, before = executed_opcodes(sample['executable'], sample)
+    outputs, after = executed_opcodes(optimized, sample)
+
+    if outputs != expected:
+        raise AssertionError(f'the optimized outputs of {sample["name"]} do not match the original program')
+
+    def total(executions, opcodes=None):
+        return sum(count for opcode, count in executions.items() if opcodes is None or opcode in opcodes)
+
+    results = { 'optimize_seconds': optimize_seconds }
+
+    for name, opcodes in (('executed', None), ('multiplications', ('IMLT', 'RMLT')),
+                          ('jumps', ('JUMP', 'JMPZ')), ('conversions', ('ITOR', 'RTOI'))):
+        results[f'{name}_before'] = total(before, opcodes)
+        results[f'{name}_after'] = total(after, opcodes)
+
+    results['instructions_before'] = len(sample['executable'])
+    results['instructions_after'] = len(optimized)
+    results['temps_before'] = count_temps(sample['executable'])
+    results['temps_after'] = count_temps(optimized)
+    results['saved'] = 1 - results['executed_after'] / results['executed_before']
+
+    # The executed instructions each pass saves on its own
+    for name in PASSES:
+        executable = Program.from_lines(optimize_code(sample['instructions'], passes=[name])).link()
+        outputs, executions = executed_opcodes(executable, sample)
+
+        if outputs != expected:
+            raise AssertionError(f'the outputs of {sample["name"]} after {name} do not match the original program')
+
+        results[f'{name}_saved'] = 1 - total(executions) / results['executed_before']
+
+    return results
+
+
+def bench_layout(sample, repeat):
+    """
+    Measures the jumps the jump threading and block layout pass saves, with the taken counts estimated statically
+    And with the ones of a profiled run of the sample (on its own input stream)
+    Also verifies that the laid out programs produce the same outputs
+    """
+
+    expected, before = executed_opcodes(sample['executable'], sample)
+    sample_profile = profile(sample['executable'], sample['inputs'])[0]
+
+    def jumps(executions):
+        return executions.get('JUMP', 0) + executions.get('JMPZ', 0)
+
+    results = {
+        'jumps_before': jumps(before),
+        'executed_before': sum(before.values()),
+    }
+
+    for name, options in (('static', {}), ('profile', { 'profile': sample_profile })):
+        seconds, instructions = time_best(lambda: optimize_code(sample['instructions'], passes=['layout'], **options),
+                                          repeat)
+        outputs, executions = executed_opcodes(Program.from_lines(instructions).link(), sample)
+
+        if outputs != expected:
+            raise AssertionError(f'the {name} layout outputs of {sample["name"]} do not match the original program')
+
+        results[f'{name}_seconds'] = seconds
+        results[f'jumps_{name}'] = jumps(executions)
+        results[f'executed_{name}'] = sum(executions.values())
+        saved = results['jumps_before'] - results[f'jumps_{name}']
+        results[f'{name}_saved'] = saved / (results['jumps_before'] or 1)
+
+    return results
+
+
+def bench_executed(sample, repeat):
+    """
+    Counts the instructions the sample has and executes at every optimization level (on its own input stream)
+    The counts don't change between runs, so the sample runs once per level (using the profiling engine)
+    Also verifies that the optimized programs produce the same outputs
+    """
+
+    results = dict()
+    expected = None
+
+    for level in sorted(LEVELS):
+        executable = Program.from_lines(optimize_code(sample['instructions'], level)).link()
+        run_profile, machine, _ = profile(executable, sample['inputs'])
+
+        if expected is None:
+            expected = machine.outputs
+        elif machine.outputs != expected:
+            raise AssertionError(f'the level {level} outputs of {sample["name"]} do not match the original program')
+
+        results[f'level{level}_instructions'] = len(executable)
+        results[f'level{level}_executed'] = sum(run_profile.instruction_counts())
+
+    return results
+
+
+def rank_correlation(first, second):
+    """
+    Returns the Spearman rank correlation of two lists of values (tied values get the average of their ranks)
+    """
+
+    def ranks(values):
+        order = sorted(range(len(values)), key=lambda index: values[index])
+        result = [0] * len(values)
+        start = 0
+
+        while start < len(order):
+            end = start
+            while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+                end += 1
+
+            for position in range(start, end + 1):
+                result[order[position]] = (start + end) / 2
+
+            start = end + 1
+
+        return result
+
+    first_ranks, second_ranks = ranks(first), ranks(second)
+    first_mean, second_mean = sum(first_ranks) / len(first), sum(second_ranks) / len(second)
+    covariance = sum((a - first_mean) * (b - second_mean) for a, b in zip(first_ranks, second_ranks))
+    first_spread = sum((a - first_mean) ** 2 for a in first_ranks)
+    second_spread = sum((b - second_mean) ** 2 for b in second_ranks)
+    spread = (first_spread * second_spread) ** 0.5
+
+    return covariance / spread if spread else 0
+
+
+def bench_cost(sample, repeat):
+    """
+    Measures the time to estimate the cost of the sample (see cpq_cost.CostModel),
+    And compares the estimated cost with the cost of the instructions a run of the sample executes
+    (which depends on its input, while the estimate assumes every loop runs LOOP_ITERATIONS iterations)
+    The source lines are compared by the rank correlation of their estimated and measured costs,
+    And by whether the estimated most expensive line is the one that cost the most in the run
+    """
+
+    program = Program.from_lines(sample['instructions'])
+    model = CostModel()
+    seconds, estimate = time_best(lambda: model.estimate(FlowGraph.from_program(program)), repeat)
+
+    _, executions = executed_opcodes(sample['executable'], sample)
+    measured = sum(model.costs[opcode] * count for opcode, count in executions.items())
+
+    lines = SourceMap.from_code(sample['instructions'], compile_source(sample['source']).source_lines).lines
+    counts = profile(sample['executable'], sample['inputs'])[0].instruction_counts()
+    measured_lines = dict()
+
+    for line, instruction, count in zip(lines, program.instructions, counts):
+        measured_lines[line] = measured_lines.get(line, 0) + model.costs[instruction.opcode] * count
+
+    estimated_lines = estimate.line_costs(lines)
+    common = [ line for line in estimated_lines if measured_lines.get(line) ]
+
+    return {
+        'seconds': seconds,
+        'estimated_cost': estimate.total(),
+        'measured_cost': measured,
+        'line_rank_correlation': rank_correlation([ estimated_lines[line] for line in common ],
+                                                  [ measured_lines[line] for line in common ]),
+        'top_line_match': int(max(estimated_lines, key=estimated_lines.get) ==
+                              max(measured_lines, key=measured_lines.get)),
+    }
+
+
+# The superinstructions of the superinstructions benchmark, mined once per process
+superinstructions = None
+
+
+# Dictionary of all runtime benchmarks, each one is called with a loaded sample program (see load_sample)
+# and the number of repetitions
+RUNTIME_BENCHMARKS = {
+    'engines': bench_engines,
+    'batch': bench_batch,
+    'profile': bench_profile,
+    'superinstructions': bench_superinstructions,
+    'runner': bench_runner,
+    'native': bench_native,
+    'optimizer': bench_optimizer,
+    'layout': bench_layout,
+    'cost': bench_cost,
+    'executed': bench_executed,
+}
+
+
+def run_suite(benchmarks, sizes, repeat, samples=()):
+    """
+    Runs the given benchmarks - compile time benchmarks on the workloads of the given sizes,
+    And runtime benchmarks on the given sample programs
+
+    Returns a dictionary of the results, along with the information needed to compare results between commits
+    """
+
+    results = { name: dict() for name in benchmarks }
+
+    for size in sizes:
+        source = get_workload(size)
+
+        for name in benchmarks:
+            if name in BENCHMARKS:
+                results[name][size] = BENCHMARKS[name](source, repeat, size)
+
+    for sample_name in samples:
+        sample = load_sample(sample_name)
+
+        for name in benchmarks:
+            if name in RUNTIME_BENCHMARKS:
+                results[name][sample_name] = RUNTIME_BENCHMARKS[name](sample, repeat)
+
+    return {
+        'commit': get_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def flatten(results):
+    """
+    Flattens the results of a suite run into a dictionary of benchmark/size/metric -> value
+    """
+
+    flat = dict()
+
+    def add(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                add(f'{prefix}/{key}', item)
+        else:
+            flat[prefix] = value
+
+    for name, sizes in results['results'].items():
+        add(name, sizes)
+
+    return flat
+
+
+def compare(old, new):
+    """
+    Returns a human readable comparison of the metrics common to two suite runs
+    """
+
+    old_metrics = flatten(old)
+    new_metrics = flatten(new)
+
+    lines = [f'comparing {old.get("commit")} -> {new.get("commit")}']
+
+    for key, new_value in new_metrics.items():
+        old_value = old_metrics.get(key)
+
+        if not old_value:
+            continue
+
+        lines.append(f'{key:<45} {old_value:>14.6g} -> {new_value:>14.6g} ({(new_value / old_value - 1) * 100:+.1f}%)')
+
+    return '\n'.join(lines)
+
+
+def main():
+    """
+    Runs the benchmark suite and stores the results as JSON
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Benchmark the CPQ compiler')
+    all_benchmarks = list(BENCHMARKS) + list(RUNTIME_BENCHMARKS)
+
+    argument_parser.add_argument('--benchmarks', nargs='+', choices=all_benchmarks, default=all_benchmarks)
+    argument_parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    argument_parser.add_argument('--samples', nargs='+', choices=get_samples(), default=get_samples())
+    argument_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    argument_parser.add_argument('--output', help='JSON file to store the results in (printed to stdout by default)')
+    argument_parser.add_argument('--compare', help='JSON file of a previous run to compare the results against')
+    arguments = argument_parser.parse_args()
+
+    results = run_suite(arguments.benchmarks, arguments.sizes, arguments.repeat, arguments.samples)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if arguments.compare:
+        with open(arguments.compare, 'r') as file:
+            print(compare(json.load(file), results), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
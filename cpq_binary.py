@@ -0,0 +1,146 @@
+import sys
+import struct
+from array import array
+from cpq_quad import Executable, QuadError, MAX_OPERANDS
+
+# Suffix of binary QUAD files
+BINARY_FILE_SUFFIX = '.qbin'
+
+# Binary QUAD files start with this magic, followed by the format version
+MAGIC = b'CPQB'
+VERSION = 1
+
+# Header - magic, version, reserved, number of instructions, number of constants, size of the symbol pool
+HEADER = struct.Struct('<4sHHIII')
+
+# Type tags of the constants in the constant pool
+INT_TAG = 0
+FLOAT_TAG = 1
+
+# A constant value in the constant pool, packed according to its tag
+INT_VALUE = struct.Struct('<q')
+
+# The range of the int constants the format can hold
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+FLOAT_VALUE = struct.Struct('<d')
+
+# The binary format is little endian, arrays have to be swapped on big endian machines
+SWAP_BYTES = sys.byteorder == 'big'
+
+
+def dump(executable):
+    """
+    Serializes the given Executable into the binary QUAD format
+
+    The format consists of:
+        A header (see HEADER)
+        The constant pool - a type tag byte per constant, followed by an 8 byte value per constant
+        The symbol pool - the names of the symbols, separated by new lines
+        The opcodes array and the operand kinds array (a byte per instruction each)
+        The operand arrays (a 4 byte unsigned int per instruction each), where jump targets are already resolved
+
+    Raises a QuadError if an int constant doesn't fit in 64 bit
+    Returns the serialized bytes
+    """
+
+    for value in executable.constants:
+        if not isinstance(value, float) and not INT_MIN <= value <= INT_MAX:
+            raise QuadError(f'the int constant {value} does not fit in 64 bit')
+
+    symbol_pool = '\n'.join(executable.symbols).encode()
+
+    parts = [HEADER.pack(MAGIC, VERSION, 0, len(executable), len(executable.constants), len(symbol_pool))]
+
+    parts.append(bytes(FLOAT_TAG if isinstance(value, float) else INT_TAG for value in executable.constants))
+    parts.extend(FLOAT_VALUE.pack(value) if isinstance(value, float) else INT_VALUE.pack(value)
+                 for value in executable.constants)
+
+    parts.append(symbol_pool)
+    parts.append(executable.opcodes.tobytes())
+    parts.append(executable.kinds.tobytes())
+
+    for operands in executable.operands:
+        if SWAP_BYTES:
+            operands = array('I', operands)
+            operands.byteswap()
+        parts.append(operands.tobytes())
+
+    return b''.join(parts)
+
+
+def load(data):
+    """
+    Loads the given binary QUAD bytes straight into the arrays of an Executable
+
+    Returns the Executable
+    """
+
+    data = memoryview(data)
+
+    if len(data) < HEADER.size:
+        raise QuadError('truncated binary QUAD file')
+
+    magic, version, _, instructions, constants, symbol_pool_size = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise QuadError('not a binary QUAD file')
+
+    if version != VERSION:
+        raise QuadError(f'unsupported binary QUAD version {version}')
+
+    if len(data) != HEADER.size + constants * 9 + symbol_pool_size + instructions * (2 + 4 * MAX_OPERANDS):
+        raise QuadError('truncated binary QUAD file')
+
+    executable = Executable()
+    offset = HEADER.size
+
+    # The constant pool
+    tags = data[offset:offset + constants]
+    offset += constants
+
+    for tag in tags:
+        value_format = FLOAT_VALUE if tag == FLOAT_TAG else INT_VALUE
+        executable.constants.append(value_format.unpack_from(data, offset)[0])
+        offset += 8
+
+    # The symbol pool
+    if symbol_pool_size:
+        executable.symbols = bytes(data[offset:offset + symbol_pool_size]).decode().split('\n')
+    offset += symbol_pool_size
+
+    # The instruction arrays
+    executable.opcodes.frombytes(data[offset:offset + instructions])
+    offset += instructions
+
+    executable.kinds.frombytes(data[offset:offset + instructions])
+    offset += instructions
+
+    for operands in executable.operands:
+        operands.frombytes(data[offset:offset + 4 * instructions])
+        offset += 4 * instructions
+
+        if SWAP_BYTES:
+            operands.byteswap()
+
+    return executable
+
+
+def write_file(file_name, executable):
+    """
+    Writes the given Executable to a binary QUAD file
+    """
+
+    with open(file_name, 'wb') as file:
+        file.write(dump(executable))
+
+
+def load_file(file_name):
+    """
+    Loads a binary QUAD file
+
+    Returns the Executable
+    """
+
+    with open(file_name, 'rb') as file:
+        return load(file.read())
@@ -0,0 +1,275 @@
+import os
+import sys
+import argparse
+import subprocess
+from cpq_compiler import compile_source
+from cpq_quad import Program, OPCODES, SYMBOL, CONSTANT, MAX_OPERANDS, infer_real_symbols
+from cpq_vm import ARITHMETIC_OPERATORS, RELATIONAL_OPERATORS, load_executable
+
+# Suffix of the generated C files
+C_FILE_SUFFIX = '.c'
+
+# Flags the C files are compiled with - signed overflow wraps around instead of being undefined
+C_FLAGS = ['-O2', '-fwrapv']
+
+# The runtime of the generated C code
+# Its input and output functions behave like the ones of the Machine of the VM (see cpq_vm), including
+# The format of real numbers and the runtime error messages
+RUNTIME = r'''#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+
+static void runtime_error(const char *error, const char *token)
+{
+    fflush(stdout);
+    fprintf(stderr, "runtime error - %s%s%s\n", error, token ? " " : "", token ? token : "");
+    exit(1);
+}
+
+static void read_token(char *token)
+{
+    if (scanf("%255s", token) != 1)
+        runtime_error("end of input", NULL);
+}
+
+static long long read_int(void)
+{
+    char token[256], *end;
+    long long value;
+
+    read_token(token);
+    errno = 0;
+    value = strtoll(token, &end, 10);
+
+    if (*end || errno)
+        runtime_error("bad int input", token);
+
+    return value;
+}
+
+static double read_real(void)
+{
+    char token[256], *end;
+    double value;
+
+    read_token(token);
+    value = strtod(token, &end);
+
+    if (*end)
+        runtime_error("bad real input", token);
+
+    return value;
+}
+
+static void write_int(long long value)
+{
+    printf("%lld\n", value);
+}
+
+static void write_real(double value)
+{
+    char text[32];
+
+    /* The shortest of 15, 16 or 17 significant digits which represents the value exactly */
+    for (int precision = 15; precision <= 16; precision++) {
+        snprintf(text, sizeof text, "%.*g", precision, value);
+
+        if (strtod(text, NULL) == value) {
+            puts(text);
+            return;
+        }
+    }
+
+    printf("%.17g\n", value);
+}
+
+static long long int_division(long long first, long long second)
+{
+    if (second == 0)
+        runtime_error("division by zero", NULL);
+
+    return first / second;
+}
+
+static double real_division(double first, double second)
+{
+    if (second == 0)
+        runtime_error("division by zero", NULL);
+
+    return first / second;
+}
+'''
+
+
+class CBackendError(Exception):
+    """
+    Raised when the generated C code can not be compiled
+    """
+
+    pass
+
+
+class CTranslator():
+    """
+    Translates an Executable into a C translation unit
+
+    Every variable and temp becomes a local of main - a double if it holds real numbers and a long long otherwise
+    (the types follow the typed opcodes, so they are the ones of the symbol table and of the conversions the compiler
+    Generated). Every jump target becomes a C label, and jumps become gotos.
+
+    Ints are 64 bit, so unlike the QUAD engines (which use Python ints), int arithmetic wraps around past 2 ** 63
+    """
+
+    def __init__(self, executable):
+        self.executable = executable
+
+
+    def operand(self, kind, value):
+        """
+        Returns the C expression of an operand
+        """
+
+        if kind == SYMBOL:
+            return f'v{value}'
+
+        if kind == CONSTANT:
+            constant = self.executable.constants[value]
+            return repr(constant) if isinstance(constant, float) else f'{constant}LL'
+
+        return f'L{value}'
+
+
+    def statement(self, index):
+        """
+        Returns the C statement of a single instruction
+        """
+
+        executable = self.executable
+        opcode = OPCODES[executable.opcodes[index]]
+        kinds = executable.kinds[index]
+
+        operands = [ self.operand((kinds >> (2 * position)) & 3, executable.operands[position][index])
+                     for position in range(MAX_OPERANDS) if (kinds >> (2 * position)) & 3 ]
+
+        operation = opcode[1:]
+
+        if opcode == 'HALT':
+            return 'goto end;'
+        if opcode == 'JUMP':
+            return f'goto {operands[0]};'
+        if opcode == 'JMPZ':
+            return f'if ({operands[1]} == 0) goto {operands[0]};'
+        if operation == 'ASN':
+            return f'{operands[0]} = {operands[1]};'
+        if operation == 'PRT':
+            return f'write_{"int" if opcode[0] == "I" else "real"}({operands[0]});'
+        if operation == 'INP':
+            return f'{operands[0]} = read_{"int" if opcode[0] == "I" else "real"}();'
+        if opcode == 'ITOR':
+            return f'{operands[0]} = (double) {operands[1]};'
+        if opcode == 'RTOI':
+            return f'{operands[0]} = (long long) {operands[1]};'
+        if operation == 'DIV':
+            division = 'int_division' if opcode[0] == 'I' else 'real_division'
+            return f'{operands[0]} = {division}({operands[1]}, {operands[2]});'
+        if operation in ARITHMETIC_OPERATORS:
+            return f'{operands[0]} = {operands[1]} {ARITHMETIC_OPERATORS[operation]} {operands[2]};'
+        return f'{operands[0]} = {operands[1]} {RELATIONAL_OPERATORS[operation]} {operands[2]};'
+
+
+    def source(self):
+        """
+        Returns the C source code of the translated program
+        """
+
+        executable = self.executable
+        real_symbols = infer_real_symbols(executable)
+        targets = { executable.operands[0][index] for index, opcode in enumerate(executable.opcodes)
+                    if OPCODES[opcode] in ('JUMP', 'JMPZ') }
+
+        lines = [RUNTIME, 'int main(void)', '{']
+
+        for number, (name, real) in enumerate(zip(executable.symbols, real_symbols)):
+            lines.append(f'    {"double" if real else "long long"} v{number} = 0; /* {name} */')
+
+        lines.append('')
+
+        for index in range(len(executable)):
+            if index in targets:
+                lines.append(f'L{index}:')
+
+            lines.append(f'    {self.statement(index)}')
+
+        # Jumps past the last instruction end the program as well
+        if len(executable) in targets:
+            lines.append(f'L{len(executable)}:')
+
+        lines.extend(['end:', '    return 0;', '}'])
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_c_compiler():
+    """
+    Returns the command of the system C compiler (the CC environment variable, or cc)
+    """
+
+    return os.environ.get('CC', 'cc')
+
+
+def build(c_file_name, executable_file_name):
+    """
+    Compiles the given C file into a native executable, using the system C compiler
+    """
+
+    command = [get_c_compiler(), *C_FLAGS, '-o', executable_file_name, c_file_name]
+
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as error:
+        raise CBackendError(f"can't run the C compiler ({error})")
+
+    if result.returncode:
+        raise CBackendError(f'the C compiler failed:\n{result.stderr}')
+
+
+def main():
+    """
+    Translates a CPL program (or a compiled QUAD program) into C, and builds it into a native executable
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Build a CPL or QUAD program into a native executable')
+    argument_parser.add_argument('program', help='CPL source (.ou) or compiled program (.qud or .qbin)')
+    argument_parser.add_argument('-o', '--output', help='executable to build (default: the program name)')
+    arguments = argument_parser.parse_args()
+
+    if arguments.program.endswith('.ou'):
+        with open(arguments.program, 'r') as file:
+            result = compile_source(file.read())
+
+        if not result.succeeded:
+            print(f'{arguments.program} has compilation errors', file=sys.stderr)
+            return 1
+
+        executable = Program.from_lines(result.instructions).link()
+    else:
+        executable = load_executable(arguments.program)
+
+    base_name = os.path.splitext(arguments.program)[0]
+    c_file_name = base_name + C_FILE_SUFFIX
+
+    with open(c_file_name, 'w') as file:
+        file.write(CTranslator(executable).source())
+
+    try:
+        build(c_file_name, arguments.output or base_name)
+    except CBackendError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,464 @@
+from cpq_quad import Program, OPCODE_NUMBERS
+
+# Opcode numbers of the instructions that end a basic block
+JUMP = OPCODE_NUMBERS['JUMP']
+JMPZ = OPCODE_NUMBERS['JMPZ']
+HALT = OPCODE_NUMBERS['HALT']
+
+# Opcodes of the instructions that end a basic block
+BLOCK_ENDING_OPCODES = { 'JUMP', 'JMPZ', 'HALT' }
+
+
+def find_block_starts(executable):
+    """
+    Returns the sorted list of the indexes of the instructions that start a basic block of the given Executable
+    A block starts at the first instruction, at every jump target and right after every jump or HALT
+    """
+
+    starts = { 0 }
+    targets = executable.operands[0]
+
+    for index, opcode in enumerate(executable.opcodes):
+        if opcode == JUMP or opcode == JMPZ:
+            starts.add(targets[index])
+            starts.add(index + 1)
+        elif opcode == HALT:
+            starts.add(index + 1)
+
+    return sorted(start for start in starts if start < len(executable))
+
+
+def split_blocks(executable):
+    """
+    Splits the given Executable into basic blocks
+
+    Returns a list of (start, end) tuples, where end is the index right after the last instruction of the block
+    """
+
+    starts = find_block_starts(executable)
+    return list(zip(starts, starts[1:] + [len(executable)]))
+
+
+class Block():
+    """
+    A basic block of a Program, as used by the optimization passes
+
+    labels       - list of the names of the labels anchoring the block
+    instructions - list of the Instructions of the block
+    successors   - list of the numbers of the blocks that may run next (set by FlowGraph.link)
+    predecessors - list of the numbers of the blocks that may run right before (set by FlowGraph.link)
+    """
+
+    def __init__(self, labels=None, instructions=None):
+        self.labels = labels or list()
+        self.instructions = instructions or list()
+        self.successors = list()
+        self.predecessors = list()
+
+
+    def terminator(self):
+        """
+        Returns the opcode of the jump or HALT instruction that ends the block, or None if the block falls through
+        """
+
+        if self.instructions and self.instructions[-1].opcode in BLOCK_ENDING_OPCODES:
+            return self.instructions[-1].opcode
+
+        return None
+
+
+class Loop():
+    """
+    A natural loop of a FlowGraph
+
+    header - the number of the block every iteration starts at (the condition of a while loop)
+    blocks - set of the numbers of the blocks of the loop, including the blocks of its inner loops
+    """
+
+    def __init__(self, header, blocks):
+        self.header = header
+        self.blocks = blocks
+
+
+class FlowGraph():
+    """
+    The control flow graph of a Program, as a list of basic blocks in their layout order
+    A block that doesn't end with a jump or HALT falls through to the block after it,
+    And falling through (or jumping) past the last block ends the program.
+
+    Passes edit the blocks and their instructions in place, then call link to update the edges
+    And to_program to lay the blocks out again
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.link()
+
+
+    @classmethod
+    def from_program(cls, program):
+        """
+        Splits the given Program into basic blocks
+        """
+
+        labels_at = dict()
+        for label, index in program.labels.items():
+            labels_at.setdefault(index, list()).append(label)
+
+        blocks = [Block()]
+
+        for index, instruction in enumerate(program.instructions):
+            if index in labels_at:
+                if blocks[-1].instructions or blocks[-1].labels:
+                    blocks.append(Block())
+                blocks[-1].labels.extend(labels_at[index])
+
+            blocks[-1].instructions.append(instruction)
+
+            if instruction.opcode in BLOCK_ENDING_OPCODES:
+                blocks.append(Block())
+
+        blocks[-1].labels.extend(labels_at.get(len(program.instructions), []))
+
+        # Drop the empty block the last jump or HALT started, if no label anchors it
+        if len(blocks) > 1 and not blocks[-1].instructions and not blocks[-1].labels:
+            blocks.pop()
+
+        return cls(blocks)
+
+
+    def to_program(self):
+        """
+        Lays the blocks out into a Program
+        """
+
+        program = Program()
+
+        for block in self.blocks:
+            for label in block.labels:
+                program.labels[label] = len(program.instructions)
+
+            program.instructions.extend(block.instructions)
+
+        return program
+
+
+    def link(self):
+        """
+        Computes the successors and the predecessors of every block, based on their jumps and their layout order
+        """
+
+        self.label_blocks = { label: number for number, block in enumerate(self.blocks) for label in block.labels }
+
+        for block in self.blocks:
+            block.successors = list()
+            block.predecessors = list()
+
+        for number, block in enumerate(self.blocks):
+            terminator = block.terminator()
+
+            if terminator == 'HALT':
+                continue
+
+            if terminator in ('JUMP', 'JMPZ'):
+                block.successors.append(self.label_blocks[block.instructions[-1].operands[0]])
+
+            if terminator != 'JUMP' and number + 1 < len(self.blocks):
+                if number + 1 not in block.successors:
+                    block.successors.append(number + 1)
+
+        for number, block in enumerate(self.blocks):
+            for successor in block.successors:
+                self.blocks[successor].predecessors.append(number)
+
+
+    def entered_by_fall_through(self, loop):
+        """
+        Returns True if the only way into the given loop is falling through into its header, from the block right
+        Before it (as while loops are entered)
+        """
+
+        header = loop.header
+        entries = [ predecessor for predecessor in self.blocks[header].predecessors if predecessor not in loop.blocks ]
+
+        if entries != [header - 1] or self.blocks[header - 1].terminator() == 'JUMP':
+            return False
+
+        # A conditional jump straight into the header
+        if (self.blocks[header - 1].terminator() == 'JMPZ' and
+                self.label_blocks[self.blocks[header - 1].instructions[-1].operands[0]] == header):
+            return False
+
+        return True
+
+
+    def insert_preheader(self, loop):
+        """
+        Inserts an empty block right before the header of the given loop, which runs once every time the loop is entered
+        This is only possible if the loop is entered by falling through into its header (as while loops are)
+        The numbers of the blocks from the header on are shifted by one
+
+        Returns the preheader Block, or None if the loop has other entries
+        """
+
+        header = loop.header
+
+        if not self.entered_by_fall_through(loop):
+            return None
+
+        preheader = Block()
+        self.blocks.insert(header, preheader)
+        self.link()
+
+        return preheader
+
+
+    def reverse_postorder(self):
+        """
+        Returns the numbers of the blocks reachable from the entry, in reverse postorder
+        """
+
+        order = list()
+        visited = set()
+
+        if not self.blocks:
+            return order
+
+        # Iterative depth first search, as programs may be too deep for recursion
+        visited.add(0)
+        stack = [(0, iter(self.blocks[0].successors))]
+
+        while stack:
+            number, successors = stack[-1]
+            successor = next(successors, None)
+
+            if successor is None:
+                stack.pop()
+                order.append(number)
+            elif successor not in visited:
+                visited.add(successor)
+                stack.append((successor, iter(self.blocks[successor].successors)))
+
+        order.reverse()
+        return order
+
+
+    def dominators(self):
+        """
+        Computes the immediate dominator of every block (using the algorithm of Cooper, Harvey and Kennedy)
+
+        Returns a list with the immediate dominator of every block - the entry is its own immediate dominator,
+        And unreachable blocks have None
+        """
+
+        order = self.reverse_postorder()
+        position = { number: index for index, number in enumerate(order) }
+        dominators = [None] * len(self.blocks)
+
+        if not order:
+            return dominators
+
+        dominators[0] = 0
+
+        def intersect(first, second):
+            while first != second:
+                while position[first] > position[second]:
+                    first = dominators[first]
+                while position[second] > position[first]:
+                    second = dominators[second]
+            return first
+
+        changed = True
+
+        while changed:
+            changed = False
+
+            for number in order[1:]:
+                processed = [ predecessor for predecessor in self.blocks[number].predecessors
+                              if dominators[predecessor] is not None ]
+                dominator = processed[0]
+
+                for predecessor in processed[1:]:
+                    dominator = intersect(predecessor, dominator)
+
+                if dominators[number] != dominator:
+                    dominators[number] = dominator
+                    changed = True
+
+        return dominators
+
+
+    def dominance_frontiers(self, dominators=None):
+        """
+        Computes the dominance frontier of every block - the blocks where the dominance of the block ends:
+        Blocks that have a predecessor the block dominates, while not being strictly dominated by it themselves
+        (using the algorithm of Cooper, Harvey and Kennedy). The start of the program counts as one more
+        Predecessor of the entry.
+
+        Returns a list with the set of the numbers of the blocks in the frontier of every block
+        """
+
+        if dominators is None:
+            dominators = self.dominators()
+
+        # The entry has no dominator above it, so the walk up from its predecessors ends past it
+        parents = [ None if number == 0 else dominator for number, dominator in enumerate(dominators) ]
+        frontiers = [ set() for _ in self.blocks ]
+
+        for number, block in enumerate(self.blocks):
+            predecessors = [ predecessor for predecessor in block.predecessors if dominators[predecessor] is not None ]
+
+            if dominators[number] is None or len(predecessors) + (number == 0) < 2:
+                continue
+
+            for predecessor in predecessors:
+                runner = predecessor
+
+                while runner is not None and runner != parents[number]:
+                    frontiers[runner].add(number)
+                    runner = parents[runner]
+
+        return frontiers
+
+
+    @staticmethod
+    def dominates(dominators, first, second):
+        """
+        Returns True if the first block dominates the second one, given the immediate dominators
+        """
+
+        while second is not None:
+            if second == first:
+                return True
+            if dominators[second] == second:
+                return False
+            second = dominators[second]
+
+        return False
+
+
+    def loops(self):
+        """
+        Finds the natural loops of the graph - the loops whose header dominates the blocks that jump back to it
+
+        Returns a list of Loops, inner loops first
+        """
+
+        dominators = self.dominators()
+        bodies = dict()
+
+        for number, block in enumerate(self.blocks):
+            if dominators[number] is None:
+                continue
+
+            for successor in block.successors:
+                if not self.dominates(dominators, successor, number):
+                    continue
+
+                # The body is the header and every block that reaches the back edge without passing the header
+                body = bodies.setdefault(successor, { successor })
+                stack = [number]
+
+                while stack:
+                    current = stack.pop()
+
+                    if current not in body:
+                        body.add(current)
+                        stack.extend(self.blocks[current].predecessors)
+
+        loops = [ Loop(header, body) for header, body in bodies.items() ]
+        loops.sort(key=lambda loop: len(loop.blocks))
+
+        return loops
+
+
+    def loop_nesting(self, loops=None):
+        """
+        Computes how deep every block is nested in loops, and the innermost loop of every block
+        loops - the loops of the graph (see loops), found if not given
+
+        Returns a list of the loop depth of every block, and a list of the innermost Loop of every block (or None)
+        """
+
+        depths = [0] * len(self.blocks)
+        innermost = [None] * len(self.blocks)
+
+        # The loops come inner loops first, so the first loop of a block is its innermost one
+        for loop in (self.loops() if loops is None else loops):
+            for number in loop.blocks:
+                depths[number] += 1
+
+                if innermost[number] is None:
+                    innermost[number] = loop
+
+        return depths, innermost
+
+
+    def liveness(self):
+        """
+        Computes the symbols that are live at the end of every block - the symbols which some path from the end
+        Of the block reads before assigning them
+
+        Returns a list with the set of the live symbols at the end of every block
+        """
+
+        uses = list()
+        definitions = list()
+
+        for block in self.blocks:
+            used = set()
+            defined = set()
+
+            for instruction in block.instructions:
+                used.update(symbol for symbol in instruction.used() if symbol not in defined)
+
+                if instruction.defined() is not None:
+                    defined.add(instruction.defined())
+
+            uses.append(used)
+            definitions.append(defined)
+
+        live_in = [ set() for _ in self.blocks ]
+        live_out = [ set() for _ in self.blocks ]
+        changed = True
+
+        while changed:
+            changed = False
+
+            for number in reversed(range(len(self.blocks))):
+                out = set().union(*(live_in[successor] for successor in self.blocks[number].successors))
+                into = uses[number] | (out - definitions[number])
+
+                if out != live_out[number] or into != live_in[number]:
+                    live_out[number] = out
+                    live_in[number] = into
+                    changed = True
+
+        return live_out
+
+
+class NameGenerator():
+    """
+    Generates names for the variables the optimization passes introduce
+    The names start with an underscore, so they never clash with CPL identifiers or with the compiler temps
+    """
+
+    def __init__(self, graph):
+        self.names = { operand for block in graph.blocks for instruction in block.instructions
+                       for operand in instruction.operands }
+        self.names.update(label for block in graph.blocks for label in block.labels)
+        self.counts = dict()
+
+
+    def fresh(self, prefix):
+        """
+        Returns a new unused name starting with an underscore and the given prefix
+        """
+
+        while True:
+            self.counts[prefix] = self.counts.get(prefix, 0) + 1
+            name = f'_{prefix}{self.counts[prefix]}'
+
+            if name not in self.names:
+                self.names.add(name)
+                return name
@@ -0,0 +1,148 @@
+import threading
+from time import perf_counter
+from cpq_lexer import CPQLexer
+from cpq_parser import CPQParser
+from cpq_optimizer import optimize_code
+from common_functions import Diagnostics, TooManyErrors
+
+
+class CompileResult():
+    """
+    The result of compiling a CPL source code
+
+    instructions - list of the QUAD instructions (None if compilation failed or code emission was disabled)
+    diagnostics  - list of the diagnostic records (see the Diagnostics class) reported during the compilation
+    statistics   - dictionary of statistics about the compilation
+    aborted      - the reason the compilation was aborted early (such as too many errors), or None
+    source_lines - list of the source line numbers the QUAD code lines originate from, one per line of instructions
+                   (None whenever instructions is None, or the code was optimized)
+    """
+
+    def __init__(self, instructions, diagnostics, statistics, aborted=None, source_lines=None):
+        self.instructions = instructions
+        self.diagnostics = diagnostics
+        self.statistics = statistics
+        self.aborted = aborted
+        self.source_lines = source_lines
+
+
+    @property
+    def succeeded(self):
+        """
+        Returns True if the compilation ended without errors
+        """
+
+        return self.statistics['errors'] == 0 and self.aborted is None
+
+
+class Compiler():
+    """
+    An embeddable CPL to QUAD compiler, which compiles source code in memory without any file I/O
+
+    The lexer and parser tables are built once per process (when their classes are created),
+    And the compiler reuses its lexer between calls, so only the state of a single compilation is created per call.
+    A Compiler is not thread safe, so every thread should use its own Compiler (as compile_source does).
+    """
+
+    def __init__(self):
+        self.lexer = CPQLexer()
+
+
+    def count_tokens(self, tokens, statistics):
+        """
+        Passes the given tokens on, while counting them into the given statistics dictionary
+        """
+
+        for token in tokens:
+            statistics['tokens'] += 1
+            yield token
+
+
+    def compile(self, source, check=False, max_errors=None, diagnostics=None, optimize=0, fast_math=False, costs=None):
+        """
+        Compiles the given source code
+
+        check       - only check the source code for errors, without generating the QUAD code
+        max_errors  - abort the compilation after that many errors
+        diagnostics - a Diagnostics object to report to, instead of creating a new one
+        optimize    - the optimization level of the generated code (see cpq_optimizer.LEVELS)
+        fast_math   - let the optimizer reassociate real arithmetic, which may change its rounding
+        costs       - dictionary of opcode -> cost of the cost model the optimizer uses (see cpq_cost.CostModel)
+
+        Returns a CompileResult object
+        """
+
+        if diagnostics is None:
+            diagnostics = Diagnostics(max_errors=max_errors)
+
+        # Let the diagnostics calculate error columns
+        diagnostics.source = source
+
+        statistics = {
+            'bytes': len(source),
+            'tokens': 0,
+            'instructions': 0,
+            'symbols': 0,
+            'errors': 0,
+            'warnings': 0,
+            'seconds': 0.0,
+        }
+
+        # Prepare the warm lexer for a new compilation
+        self.lexer.diagnostics = diagnostics
+        self.lexer.found_errors = False
+
+        parser = CPQParser(diagnostics, emit_code=not check)
+        instructions = None
+        source_lines = None
+        aborted = None
+
+        start = perf_counter()
+
+        try:
+            instructions = parser.parse(self.count_tokens(self.lexer.tokenize(source), statistics))
+        except TooManyErrors as error:
+            aborted = str(error)
+
+        statistics['seconds'] = perf_counter() - start
+
+        statistics['symbols'] = len(parser.symbol_table)
+        statistics['errors'] = diagnostics.error_count
+        statistics['warnings'] = sum(1 for record in diagnostics.records if record['severity'] == 'WARNING')
+
+        # The found_errors flags also catch syntax errors which were not recovered by the error handling rules
+        if self.lexer.found_errors or parser.found_errors:
+            statistics['errors'] = max(statistics['errors'], 1)
+
+        if check or not instructions or statistics['errors'] or aborted:
+            instructions = None
+        else:
+            # The optimized code can't be mapped back to the source lines
+            if optimize:
+                instructions = optimize_code(instructions, optimize, fast_math=fast_math, costs=costs)
+            else:
+                source_lines = parser.source_lines
+
+            statistics['instructions'] = len(instructions)
+
+        return CompileResult(instructions, list(diagnostics.records), statistics, aborted, source_lines)
+
+
+# Compilers of the threads that called compile_source
+_compilers = threading.local()
+
+
+def compile_source(source, **options):
+    """
+    Compiles the given CPL source code in memory, using a warm Compiler of the current thread
+    The options are the ones of Compiler.compile
+
+    Returns a CompileResult object
+    """
+
+    compiler = getattr(_compilers, 'compiler', None)
+
+    if compiler is None:
+        compiler = _compilers.compiler = Compiler()
+
+    return compiler.compile(source, **options)
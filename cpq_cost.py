@@ -0,0 +1,234 @@
+import json
+from cpq_quad import OPCODES
+from cpq_layout import LOOP_ITERATIONS
+
+# Default cost of every opcode, in units of a simple int operation
+# Real arithmetic, divisions and conversions cost more than int arithmetic, and input and output cost the most
+OPCODE_COSTS = {
+    'IASN': 1, 'IADD': 1, 'ISUB': 1, 'IMLT': 3, 'IDIV': 20,
+    'IEQL': 1, 'INQL': 1, 'ILSS': 1, 'IGRT': 1,
+    'RASN': 1, 'RADD': 4, 'RSUB': 4, 'RMLT': 5, 'RDIV': 20,
+    'REQL': 2, 'RNQL': 2, 'RLSS': 2, 'RGRT': 2,
+    'ITOR': 3, 'RTOI': 3,
+    'IINP': 50, 'RINP': 50, 'IPRT': 50, 'RPRT': 50,
+    'JUMP': 1, 'JMPZ': 2, 'HALT': 0,
+}
+
+# Default number of regions in a cost report
+DEFAULT_TOP = 10
+
+
+def load_costs(file_name):
+    """
+    Loads opcode costs from a JSON file of an object of opcode -> cost (the opcodes it leaves out keep their default)
+
+    Returns the dictionary of the costs of all the opcodes
+    """
+
+    with open(file_name, 'r') as file:
+        costs = json.load(file)
+
+    if not isinstance(costs, dict):
+        raise ValueError(f'{file_name} is not an object of opcode costs')
+
+    for opcode, cost in costs.items():
+        if opcode not in OPCODES:
+            raise ValueError(f'unknown opcode {opcode} in {file_name}')
+
+        if not isinstance(cost, (int, float)) or cost < 0:
+            raise ValueError(f'bad cost of {opcode} in {file_name}')
+
+    return dict(OPCODE_COSTS, **costs)
+
+
+class CostModel():
+    """
+    Estimates the runtime cost of a program without running it
+
+    Every instruction costs the cost of its opcode, and every block is estimated to run once per iteration of each
+    Loop it is nested in (so a block nested in two loops runs iterations ** 2 times)
+
+    costs      - dictionary of opcode -> cost, overriding the default OPCODE_COSTS
+    iterations - the number of iterations every loop is assumed to run
+    """
+
+    def __init__(self, costs=None, iterations=LOOP_ITERATIONS):
+        self.costs = dict(OPCODE_COSTS, **(costs or dict()))
+        self.iterations = iterations
+
+
+    def block_cost(self, block):
+        """
+        Returns the cost of a single run of the given Block
+        """
+
+        return sum(self.costs[instruction.opcode] for instruction in block.instructions)
+
+
+    def estimate(self, graph):
+        """
+        Estimates the cost of the program of the given FlowGraph
+
+        Returns a CostEstimate
+        """
+
+        loops = graph.loops()
+        depths, _ = graph.loop_nesting(loops)
+        runs = [ self.iterations ** depth for depth in depths ]
+
+        return CostEstimate(graph, self, loops, depths, runs)
+
+
+class CostEstimate():
+    """
+    The estimated cost of a program (see CostModel)
+
+    graph  - the FlowGraph of the program
+    loops  - list of the Loops of the graph, inner loops first
+    depths - the loop depth of every block
+    runs   - the estimated number of runs of every block
+    costs  - the estimated cost of every block, over all of its runs
+    """
+
+    def __init__(self, graph, model, loops, depths, runs):
+        self.graph = graph
+        self.model = model
+        self.loops = loops
+        self.depths = depths
+        self.runs = runs
+        self.costs = [ model.block_cost(block) * count for block, count in zip(graph.blocks, runs) ]
+
+
+    def total(self):
+        """
+        Returns the estimated cost of the whole program
+        """
+
+        return sum(self.costs)
+
+
+    def loop_cost(self, loop):
+        """
+        Returns the estimated cost of the given Loop, including its inner loops
+        """
+
+        return sum(self.costs[number] for number in loop.blocks)
+
+
+    def by_instruction(self, values):
+        """
+        Gets a value per block, and returns the value of its block for every instruction, by its index in the program
+        """
+
+        expanded = list()
+
+        for block, value in zip(self.graph.blocks, values):
+            expanded.extend([value] * len(block.instructions))
+
+        return expanded
+
+
+    def instruction_costs(self):
+        """
+        Returns the estimated cost of every instruction over all of its runs, by its index in the program
+        """
+
+        instructions = [ instruction for block in self.graph.blocks for instruction in block.instructions ]
+
+        return [ self.model.costs[instruction.opcode] * count
+                 for instruction, count in zip(instructions, self.by_instruction(self.runs)) ]
+
+
+    def first_indexes(self):
+        """
+        Returns the index in the program of the first instruction of every block
+        """
+
+        indexes = list()
+        index = 0
+
+        for block in self.graph.blocks:
+            indexes.append(index)
+            index += len(block.instructions)
+
+        return indexes
+
+
+    def line_costs(self, lines):
+        """
+        Gets the source line number of every instruction (as the lines of a SourceMap)
+
+        Returns a dictionary of source line number -> the estimated cost of the instructions of that line
+        """
+
+        costs = dict()
+
+        for line, cost in zip(lines, self.instruction_costs()):
+            if line is not None and cost:
+                costs[line] = costs.get(line, 0) + cost
+
+        return costs
+
+
+    def report(self, lines=None, source=None, top=DEFAULT_TOP):
+        """
+        Returns the lines of a report of the estimated cost of the program - its most expensive loops, and its
+        Most expensive source lines if the source line number of every instruction is given (see line_costs),
+        Or its most expensive blocks otherwise
+
+        lines  - the source line number of every instruction (optional)
+        source - the source code, to quote the source lines (optional)
+        top    - the number of loops and of lines (or blocks) in the report
+        """
+
+        source_lines = source.splitlines() if source is not None else list()
+        total = self.total() or 1
+        first_indexes = self.first_indexes()
+
+        def describe(number):
+            # A block is described by the source line of its first instruction, or by its label
+            line = lines[first_indexes[number]] if lines and first_indexes[number] < len(lines) else None
+
+            if line is None:
+                labels = self.graph.blocks[number].labels
+                return f'block {number}' + (f' ({labels[0]})' if labels else '')
+
+            if 0 < line <= len(source_lines):
+                return f'line {line}: {source_lines[line - 1].strip()}'
+
+            return f'line {line}'
+
+        report = [f'estimated cost {self.total():g} ({len(self.loops)} loops, '
+                  f'{self.model.iterations} iterations assumed per loop)']
+
+        loops = sorted(self.loops, key=self.loop_cost, reverse=True)[:top]
+
+        if loops:
+            report.append(f'{"cost":>14} {"share":>7}  depth  loop')
+
+        for loop in loops:
+            cost = self.loop_cost(loop)
+            report.append(f'{cost:>14g} {100 * cost / total:6.2f}%  {self.depths[loop.header]:>5}  '
+                          f'{describe(loop.header)}')
+
+        if lines:
+            costs = sorted(self.line_costs(lines).items(), key=lambda item: item[1], reverse=True)[:top]
+            report.append(f'{"cost":>14} {"share":>7}  depth  line')
+
+            # The depth of a line is the deepest loop depth of its instructions
+            line_depths = dict()
+            for line, depth in zip(lines, self.by_instruction(self.depths)):
+                line_depths[line] = max(line_depths.get(line, 0), depth)
+
+            for line, cost in costs:
+                quoted = f': {source_lines[line - 1].strip()}' if 0 < line <= len(source_lines) else ''
+                report.append(f'{cost:>14g} {100 * cost / total:6.2f}%  {line_depths[line]:>5}  line {line}{quoted}')
+        else:
+            numbers = sorted(range(len(self.costs)), key=lambda number: self.costs[number], reverse=True)[:top]
+            report.append(f'{"cost":>14} {"share":>7}  depth  block')
+
+            for number in numbers:
+                report.append(f'{self.costs[number]:>14g} {100 * self.costs[number] / total:6.2f}%  '
+                              f'{self.depths[number]:>5}  {describe(number)}')
+
+        return report
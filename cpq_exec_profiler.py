@@ -0,0 +1,290 @@
+import os
+import sys
+import argparse
+from cpq_compiler import compile_source
+from cpq_quad import Program, OPCODES
+from cpq_cfg import split_blocks
+from cpq_vm import Machine, VMError, ClosureCompiler, load_executable
+from cpq_sourcemap import SourceMap, SOURCE_MAP_SUFFIX
+
+# Default number of lines in the hottest lines report
+DEFAULT_TOP = 10
+
+
+class ProfilingCompiler(ClosureCompiler):
+    """
+    A closure compiler whose generated code counts how many times every basic block ran,
+    And how many times every JMPZ took its jump
+
+    Counting blocks instead of instructions keeps the overhead to a single list increment per block (and one more
+    per taken jump), the counts of the instructions and of the not taken jumps are derived from them afterwards.
+    """
+
+    runtime = ClosureCompiler.runtime + ('block_counts', 'taken_counts')
+
+    def __init__(self, executable):
+        super().__init__(executable)
+
+        # Number of runs of every block, by the index of its first instruction
+        self.block_counts = [0] * len(executable)
+
+        # Number of taken jumps of every JMPZ, by its index
+        self.taken_counts = [0] * len(executable)
+
+
+    def runtime_values(self, machine):
+        return super().runtime_values(machine) + (self.block_counts, self.taken_counts)
+
+
+    def block_entry(self, start):
+        return [f'        block_counts[{start}] += 1']
+
+
+    def conditional_exit(self, index, condition):
+        return [f'        if {condition} == 0:',
+                f'            taken_counts[{index}] += 1',
+                f'            return b{self.executable.operands[0][index]}',
+                f'        return b{index + 1}']
+
+
+class Profile():
+    """
+    The execution counts of a profiled run of an Executable
+
+    block_counts - number of runs of every block, by the index of its first instruction
+    taken_counts - number of taken jumps of every JMPZ, by its index
+    source_map   - the SourceMap of the executable, used to fold the counts onto source lines (optional)
+    source       - the source code of the executable (optional)
+    """
+
+    def __init__(self, executable, block_counts, taken_counts, source_map=None, source=None):
+        self.executable = executable
+        self.blocks = split_blocks(executable)
+        self.block_counts = block_counts
+        self.taken_counts = taken_counts
+        self.source_map = source_map
+        self.source_lines = source.splitlines() if source is not None else list()
+
+
+    def instruction_counts(self):
+        """
+        Returns the number of executions of every instruction
+        Every instruction of a block is counted as many times as its block ran
+        (so the instructions after a runtime error are counted once more than they actually ran)
+        """
+
+        counts = [0] * len(self.executable)
+
+        for start, end in self.blocks:
+            counts[start:end] = [self.block_counts[start]] * (end - start)
+
+        return counts
+
+
+    def branches(self):
+        """
+        Returns a list of (index, executions, taken, not taken) tuples, one per JMPZ instruction
+        """
+
+        counts = self.instruction_counts()
+
+        return [ (index, counts[index], self.taken_counts[index], counts[index] - self.taken_counts[index])
+                 for index, opcode in enumerate(self.executable.opcodes) if OPCODES[opcode] == 'JMPZ' ]
+
+
+    def line_of(self, index):
+        """
+        Returns the source line number of the instruction at the given index, or None if it is unknown
+        """
+
+        if self.source_map is None or index >= len(self.source_map.lines):
+            return None
+
+        return self.source_map.lines[index]
+
+
+    def describe(self, line):
+        """
+        Returns a description of the given source line number - the number and the text of the line
+        """
+
+        if line is None:
+            return 'unknown line'
+
+        if 0 < line <= len(self.source_lines):
+            return f'line {line}: {self.source_lines[line - 1].strip()}'
+
+        return f'line {line}'
+
+
+    def line_costs(self):
+        """
+        Returns a dictionary of source line number -> the number of instructions executed for that line
+        """
+
+        if self.source_map is None:
+            return dict()
+
+        return self.source_map.line_costs(self.instruction_counts())
+
+
+    def hottest_lines(self, top=DEFAULT_TOP):
+        """
+        Returns the lines of a report of the given number of source lines which executed the most instructions
+        Along with the taken and not taken counts of the branches of those lines
+        """
+
+        costs = self.line_costs()
+        total = sum(costs.values()) or 1
+
+        branches = dict()
+        for index, executions, taken, not_taken in self.branches():
+            branches.setdefault(self.line_of(index), list()).append((executions, taken, not_taken))
+
+        report = [f'{"instructions":>14} {"share":>7}  line']
+
+        for line, cost in sorted(costs.items(), key=lambda item: item[1], reverse=True)[:top]:
+            report.append(f'{cost:>14} {100 * cost / total:6.2f}%  {self.describe(line)}')
+
+            for executions, taken, not_taken in branches.get(line, []):
+                report.append(f'{"":>24}branch - {executions} executions, {taken} jumped, {not_taken} fell through')
+
+        return report
+
+
+    def loops(self):
+        """
+        Returns a list of (start, end) tuples of the instruction ranges of the loops of the executable
+        A loop is the range between a backward JUMP and its target, which is the loop condition
+        """
+
+        targets = self.executable.operands[0]
+
+        return [ (targets[index], index) for index, opcode in enumerate(self.executable.opcodes)
+                 if OPCODES[opcode] == 'JUMP' and targets[index] <= index ]
+
+
+    def folded_stacks(self, root='program'):
+        """
+        Returns the lines of a folded stack file (as used by flamegraph tools) of the executed instructions
+        Every stack is made of the loops enclosing a source line, from the outermost one, and the line itself
+        """
+
+        loops = sorted(self.loops(), key=lambda loop: (loop[0], -loop[1]))
+        counts = self.instruction_counts()
+        stacks = dict()
+
+        for index, count in enumerate(counts):
+            if not count:
+                continue
+
+            frames = [root]
+            frames.extend(f'loop at line {self.line_of(start)}' for start, end in loops if start <= index <= end)
+            frames.append(self.describe(self.line_of(index)))
+
+            # Semicolons separate the frames of the folded format
+            stack = ';'.join(frame.replace(';', '') for frame in frames)
+            stacks[stack] = stacks.get(stack, 0) + count
+
+        return [ f'{stack} {count}' for stack, count in stacks.items() ]
+
+
+def profile(executable, inputs, source_map=None, source=None):
+    """
+    Runs the given Executable on the given input tokens with profiling
+
+    Returns the Profile, the Machine the program ran on and the VMError that stopped it (or None)
+    """
+
+    compiler = ProfilingCompiler(executable)
+    machine = Machine(inputs)
+    error = None
+
+    try:
+        compiler.compile()(machine)
+    except VMError as vm_error:
+        error = vm_error
+
+    return Profile(executable, compiler.block_counts, compiler.taken_counts, source_map, source), machine, error
+
+
+def load_program(file_name):
+    """
+    Loads a program to profile - a CPL source file, which is compiled in memory,
+    Or a compiled program (.qud or .qbin), along with its source map and source file if they exist
+
+    Returns the Executable, the SourceMap (or None) and the source code (or None)
+    """
+
+    if file_name.endswith('.ou'):
+        with open(file_name, 'r') as file:
+            source = file.read()
+
+        result = compile_source(source)
+
+        if not result.succeeded:
+            raise ValueError(f'{file_name} has compilation errors')
+
+        return (Program.from_lines(result.instructions).link(),
+                SourceMap.from_code(result.instructions, result.source_lines, file_name), source)
+
+    executable = load_executable(file_name)
+    source_map_file_name = os.path.splitext(file_name)[0] + SOURCE_MAP_SUFFIX
+
+    if not os.path.exists(source_map_file_name):
+        return executable, None, None
+
+    source_map = SourceMap.load_file(source_map_file_name)
+    source_file_name = os.path.join(os.path.dirname(file_name), source_map.source or '')
+
+    if not source_map.source or not os.path.exists(source_file_name):
+        return executable, source_map, None
+
+    with open(source_file_name, 'r') as file:
+        return executable, source_map, file.read()
+
+
+def main():
+    """
+    Runs a program with profiling, and reports its hottest source lines
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Profile the execution of a CPL or QUAD program')
+    argument_parser.add_argument('program', help='CPL source (.ou) or compiled program (.qud or .qbin, with its .qmap)')
+    argument_parser.add_argument('--input', help='file to read the program input from (default: stdin)')
+    argument_parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='number of lines in the report')
+    argument_parser.add_argument('--folded', help='file to write the folded stacks to (for flamegraph tools)')
+    arguments = argument_parser.parse_args()
+
+    try:
+        executable, source_map, source = load_program(arguments.program)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    if arguments.input:
+        with open(arguments.input, 'r') as file:
+            inputs = file.read().split()
+    else:
+        inputs = sys.stdin.read().split()
+
+    result, _, error = profile(executable, inputs, source_map, source)
+
+    if source_map is None:
+        print('no source map found, run the compiler with --source-map to profile by source line', file=sys.stderr)
+    else:
+        print('\n'.join(result.hottest_lines(arguments.top)))
+
+    if arguments.folded:
+        with open(arguments.folded, 'w') as file:
+            file.write('\n'.join(result.folded_stacks(os.path.basename(arguments.program))) + '\n')
+
+    if error is not None:
+        print(f'runtime error - {error}', file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
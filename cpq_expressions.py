@@ -0,0 +1,555 @@
+import math
+from cpq_quad import Instruction, REAL_TARGET_OPCODES, is_constant, parse_constant
+from cpq_cfg import FlowGraph, NameGenerator
+from cpq_loops import INT_OPERATIONS, is_int_constant
+from cpq_vm import int_division
+
+# Opcodes of the instructions that compute a value out of their operands, which become expression tree nodes
+EXPRESSION_OPCODES = {
+    'IASN', 'IEQL', 'INQL', 'ILSS', 'IGRT', 'IADD', 'ISUB', 'IMLT', 'IDIV',
+    'RASN', 'REQL', 'RNQL', 'RLSS', 'RGRT', 'RADD', 'RSUB', 'RMLT', 'RDIV',
+    'ITOR', 'RTOI',
+}
+
+# Opcodes which may take an expression tree as an operand (the rest never read a symbol)
+TREE_READING_OPCODES = EXPRESSION_OPCODES | { 'IPRT', 'RPRT', 'JMPZ' }
+
+# Opcodes with side effects, which expressions that may fail (divisions) are never moved across
+SIDE_EFFECT_OPCODES = { 'IPRT', 'RPRT', 'IINP', 'RINP' }
+
+# Folded int constants must stay within 64 bit (as cpq_ssa.literal requires), so the binary format and the C backend
+# Can hold them - the magnitude of negative ones as well, as they are emitted as a subtraction from 0
+INT_LIMIT = 1 << 63
+
+# Addition and multiplication chains that are reassociated, by the opcode of their nodes
+# (the opcode of the chain, the opcode of its inverse if it has one, and the identity constant)
+CHAINS = {
+    'IADD': ('IADD', 'ISUB', 0),
+    'ISUB': ('IADD', 'ISUB', 0),
+    'IMLT': ('IMLT', None, 1),
+    'RADD': ('RADD', 'RSUB', 0.0),
+    'RSUB': ('RADD', 'RSUB', 0.0),
+    'RMLT': ('RMLT', None, 1.0),
+}
+
+
+class Node():
+    """
+    A node of an expression tree - an operation and its operands
+    Operands are nodes, symbols, or constants (ints, or floats when they may be folded)
+    """
+
+    def __init__(self, opcode, operands):
+        self.opcode = opcode
+        self.operands = operands
+        self.cost = None
+
+
+    def real(self):
+        """
+        Returns True if the node computes a real number
+        """
+
+        return self.opcode in REAL_TARGET_OPCODES
+
+
+    def divides(self):
+        """
+        Returns True if evaluating the node divides (and so may fail)
+        """
+
+        return self.opcode[1:] == 'DIV' or any(isinstance(operand, Node) and operand.divides()
+                                               for operand in self.operands)
+
+
+def is_held(operand):
+    """
+    Returns True if the value of the given operand is held in a temp while the rest of the tree is evaluated
+    (nodes, and negative constants which have no literal)
+    """
+
+    return isinstance(operand, Node) or (not isinstance(operand, str) and operand < 0)
+
+
+def need(operand):
+    """
+    Returns the number of temps evaluating the given operand takes (its Sethi-Ullman number)
+    """
+
+    if not isinstance(operand, Node):
+        return 1 if is_held(operand) else 0
+
+    if operand.cost is None:
+        operand.cost = max(1, min(order_need(operand.operands, order) for order in orders(operand)))
+
+    return operand.cost
+
+
+def order_need(operands, order):
+    """
+    Returns the number of temps evaluating the given operands in the given order takes
+    Every operand evaluated before another one holds its temp meanwhile
+    """
+
+    held = 0
+    total = 0
+
+    for position in order:
+        total = max(total, held + need(operands[position]))
+        held += is_held(operands[position])
+
+    return total
+
+
+def orders(node):
+    """
+    Returns the orders (lists of operand positions) the operands of the given node may be evaluated in
+    """
+
+    if len(node.operands) == 2:
+        return [[0, 1], [1, 0]]
+
+    return [list(range(len(node.operands)))]
+
+
+def evaluation_order(node):
+    """
+    Returns the order to evaluate the operands of the given node in - the one that takes the fewest temps,
+    Left to right if both take the same
+    """
+
+    return min(orders(node), key=lambda order: order_need(node.operands, order))
+
+
+def fits(value):
+    """
+    Returns True if the given folded constant can be emitted - an int within 64 bit (see INT_LIMIT), or a finite real
+    """
+
+    if isinstance(value, float):
+        return math.isfinite(value)
+
+    return -INT_LIMIT < value < INT_LIMIT
+
+
+def fold(opcode, operands):
+    """
+    Computes an int operation (or a real operation, under fast math) of constant operands
+
+    Returns the constant result, or None if the operation can't be folded (or its result doesn't fit, see fits)
+    """
+
+    if opcode == 'IDIV':
+        result = int_division(*operands) if operands[1] != 0 else None
+    elif opcode in INT_OPERATIONS:
+        result = INT_OPERATIONS[opcode](*operands)
+    else:
+        result = None
+
+    return result if result is not None and fits(result) else None
+
+
+class Reassociator():
+    """
+    Normalizes expression trees - folds constant operations, and reassociates addition and multiplication chains
+    So their constants are grouped and folded together.
+    Int chains are always reassociated (int arithmetic is exact, and wraps around the same in any order
+    In the C backend). Real chains are only reassociated under fast math, as it changes the rounding.
+    """
+
+    def __init__(self, fast_math=False):
+        self.fast_math = fast_math
+
+
+    def constant(self, operand, real):
+        """
+        Returns the value of the given operand if it is a constant that may be folded, or None
+        """
+
+        if isinstance(operand, str):
+            if not is_constant(operand) or (real and not self.fast_math):
+                return None
+            return parse_constant(operand)
+
+        if isinstance(operand, Node):
+            return None
+
+        return operand
+
+
+    def normalize(self, operand):
+        """
+        Returns the normalized form of the given operand
+        """
+
+        if not isinstance(operand, Node):
+            return operand
+
+        if operand.opcode in CHAINS and (operand.opcode[0] == 'I' or self.fast_math):
+            return self.reassociate(operand)
+
+        node = Node(operand.opcode, [ self.normalize(child) for child in operand.operands ])
+        values = [ self.constant(child, False) for child in node.operands ]
+
+        if node.opcode[0] == 'I' and node.opcode != 'ITOR' and all(isinstance(value, int) for value in values):
+            result = fold(node.opcode, values)
+
+            if result is not None:
+                return result
+
+        return node
+
+
+    def terms(self, node):
+        """
+        Flattens the chain the given node heads into its terms - a list of (operand, inverted) pairs,
+        Where inverted terms are subtracted (or divided)
+        """
+
+        chain, inverse, _ = CHAINS[node.opcode]
+        terms = list()
+        stack = [(node, False)]
+
+        while stack:
+            operand, inverted = stack.pop()
+
+            if isinstance(operand, Node) and operand.opcode in (chain, inverse):
+                first, second = operand.operands
+                stack.append((second, inverted != (operand.opcode == inverse)))
+                stack.append((first, inverted))
+            else:
+                terms.append((operand, inverted))
+
+        return terms
+
+
+    def reassociate(self, node):
+        """
+        Returns the normalized form of an addition or multiplication chain
+        The constants of the chain are folded into one, and the rest of its terms are ordered by the number of
+        Temps they take, so the chain is evaluated with as few temps as possible
+        """
+
+        chain, inverse, identity = CHAINS[node.opcode]
+        real = chain[0] == 'R'
+        constant = identity
+        positive = list()
+        negative = list()
+
+        for operand, inverted in self.terms(node):
+            operand = self.normalize(operand)
+            value = self.constant(operand, real)
+
+            if value is None:
+                (negative if inverted else positive).append(operand)
+            elif chain[1:] == 'MLT':
+                constant *= value
+            else:
+                constant = constant - value if inverted else constant + value
+
+        # Constants that don't fit are left unfolded
+        if not fits(constant):
+            return node
+
+        positive.sort(key=need, reverse=True)
+        negative.sort(key=need, reverse=True)
+
+        # A product by zero is zero, unless evaluating its terms may fail
+        if chain == 'IMLT' and constant == 0 and not any(isinstance(term, Node) and term.divides() for term in positive):
+            return 0
+
+        if positive:
+            result = positive[0]
+            rest = positive[1:]
+        elif constant >= 0 or chain[1:] == 'MLT':
+            result, constant = constant, identity
+            rest = list()
+        else:
+            result = identity
+            rest = list()
+
+        for term in rest:
+            result = Node(chain, [result, term])
+
+        for term in negative:
+            result = Node(inverse, [result, term])
+
+        if constant != identity:
+            if chain[1:] == 'MLT':
+                result = Node(chain, [result, constant])
+            elif constant > 0:
+                result = Node(chain, [result, constant])
+            else:
+                result = Node(inverse, [result, -constant])
+
+        return result
+
+
+class Emitter():
+    """
+    Emits normalized expression trees as QUAD instructions, in Sethi-Ullman order
+    Intermediate results go to temps taken from a pool (one for ints and one for reals, so every temp keeps a single
+    Type), which are returned to the pool as soon as their value is read
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.free = { False: list(), True: list() }
+        self.temps = set()
+        self.instructions = list()
+
+
+    def allocate(self, real):
+        """
+        Returns a free temp of the given type
+        """
+
+        if self.free[real]:
+            return self.free[real].pop()
+
+        temp = self.names.fresh('r' if real else 't')
+        self.temps.add(temp)
+        return temp
+
+
+    def release(self, operand, real):
+        """
+        Returns the given operand to its pool, if it is a pool temp
+        """
+
+        if operand in self.temps:
+            self.free[real].append(operand)
+
+
+    def constant(self, value, real, target=None):
+        """
+        Returns the operand of a constant - its literal, or a temp (or the given target) assigned its value
+        If it is negative
+        """
+
+        text = repr(value) if isinstance(value, float) else str(value)
+
+        if value >= 0:
+            return text
+
+        result = target or self.allocate(real)
+        zero = '0.0' if real else '0'
+        self.instructions.append(Instruction('RSUB' if real else 'ISUB', [result, zero, text[1:]]))
+        return result
+
+
+    def operand(self, operand, real):
+        """
+        Emits the evaluation of an operand of the given type into a pool temp
+
+        Returns the operand to read its value from, and True if it is a pool temp
+        """
+
+        if isinstance(operand, Node):
+            return self.node(operand), True
+
+        if isinstance(operand, str):
+            return operand, False
+
+        result = self.constant(operand, real)
+        return result, result in self.temps
+
+
+    def node(self, node, target=None):
+        """
+        Emits the evaluation of the given node into the given target (or a new pool temp)
+
+        Returns the target
+        """
+
+        # The type of the operands of the node - conversions read the other type
+        real = node.opcode[0] == 'R' if node.opcode not in ('ITOR', 'RTOI') else node.opcode == 'RTOI'
+
+        operands = [None] * len(node.operands)
+        temps = list()
+
+        for position in evaluation_order(node):
+            operands[position], temp = self.operand(node.operands[position], real)
+
+            if temp:
+                temps.append(operands[position])
+
+        for temp in temps:
+            self.release(temp, real)
+
+        result = target or self.allocate(node.real())
+        self.instructions.append(Instruction(node.opcode, [result] + operands))
+        return result
+
+
+    def assign(self, target, operand, real):
+        """
+        Emits the assignment of an expression (a normalized operand) to the given symbol
+        """
+
+        if isinstance(operand, Node):
+            self.node(operand, target)
+        elif isinstance(operand, str):
+            self.instructions.append(Instruction('RASN' if real else 'IASN', [target, operand]))
+        elif operand < 0:
+            self.constant(operand, real, target)
+        else:
+            self.instructions.append(Instruction('RASN' if real else 'IASN', [target, self.constant(operand, real)]))
+
+
+def find_absorbed(block, live_out):
+    """
+    Finds the instructions of a block whose value can be evaluated as part of the instruction that reads it -
+    Expressions assigned to a symbol that only the next instruction reading it reads, once
+
+    Returns a dictionary of the position of such an instruction -> the position of its reader
+    """
+
+    instructions = block.instructions
+    absorbed = dict()
+
+    # Symbol -> (position of the next instruction that reads it, the number of times it reads it, True if nothing
+    # Reads the symbol after that instruction until it is assigned again), or None if the symbol isn't read again
+    # Before it is assigned. The instructions are scanned backwards, and the symbols live at the end of the block
+    # Are read after it.
+    following = { symbol: (len(instructions), 1, False) for symbol in live_out }
+
+    for position in reversed(range(len(instructions))):
+        instruction = instructions[position]
+        symbol = instruction.defined()
+
+        if symbol is not None:
+            reader = following.get(symbol)
+
+            if (instruction.opcode in EXPRESSION_OPCODES and reader is not None and reader[1] == 1 and reader[2] and
+                    instructions[reader[0]].opcode in TREE_READING_OPCODES):
+                absorbed[position] = reader[0]
+
+            following[symbol] = None
+
+        used = instruction.used()
+
+        for read in set(used):
+            following[read] = (position, used.count(read), following.get(read) is None)
+
+    return absorbed
+
+
+def rebuild_block(block, live_out, reassociator, emitter):
+    """
+    Rebuilds the expression trees of a block and emits them again (see reorder_expressions)
+    """
+
+    absorbed = find_absorbed(block, live_out)
+
+    # Symbol -> (tree, position of its reader, set of the symbols it reads, its position, side effects so far,
+    # True if it divides, its position in roots) of the trees waiting for their reader
+    pending = dict()
+    effects = 0
+
+    # The instructions to emit, in order - (instruction, operand trees, position of the first read operand),
+    # Or (symbol, tree, real) for an assignment of an expression
+    roots = list()
+
+    for position, instruction in enumerate(block.instructions):
+        first = 0 if instruction.opcode in ('IPRT', 'RPRT') else 1
+        operands = list()
+
+        # The symbols the tree of the instruction reads
+        leaves = None
+        divides = instruction.opcode[1:] == 'DIV'
+
+        for operand in instruction.operands[first:]:
+            entry = pending.get(operand) if instruction.opcode in TREE_READING_OPCODES else None
+
+            if entry is not None and entry[1] == position:
+                tree, _, tree_leaves, built, built_effects, tree_divides, slot = entry
+                del pending[operand]
+
+                # The tree moves down to its reader - unless a leaf was assigned, or a division would move
+                # Past a side effect, in between
+                assigned = any(block.instructions[between].defined() in tree_leaves
+                               for between in range(built + 1, position))
+
+                if not assigned and (effects == built_effects or not tree_divides):
+                    roots[slot] = None
+                    operands.append(tree)
+                    divides = divides or tree_divides
+
+                    if leaves is None or len(tree_leaves) > len(leaves):
+                        leaves, tree_leaves = tree_leaves, leaves or set()
+                    leaves.update(tree_leaves)
+                    continue
+
+            if is_int_constant(operand):
+                operands.append(int(operand))
+            else:
+                operands.append(operand)
+
+                if not is_constant(operand):
+                    leaves = leaves if leaves is not None else set()
+                    leaves.add(operand)
+
+        if instruction.opcode in EXPRESSION_OPCODES:
+            symbol = instruction.operands[0]
+
+            if instruction.opcode[1:] == 'ASN':
+                tree = operands[0]
+            else:
+                tree = Node(instruction.opcode, operands)
+
+            roots.append((symbol, tree, instruction.opcode in REAL_TARGET_OPCODES))
+
+            if position in absorbed:
+                pending[symbol] = (tree, absorbed[position], leaves or set(), position, effects, divides, len(roots) - 1)
+        else:
+            roots.append((instruction, operands, first))
+
+        if instruction.opcode in SIDE_EFFECT_OPCODES:
+            effects += 1
+
+    emitter.instructions = list()
+
+    for root in roots:
+        if root is None:
+            continue
+
+        if isinstance(root[0], Instruction):
+            instruction, operands, first = root
+            real = instruction.opcode[0] == 'R'
+            values = [ emitter.operand(reassociator.normalize(operand), real) for operand in operands ]
+
+            for value, temp in values:
+                if temp:
+                    emitter.release(value, real)
+
+            emitter.instructions.append(Instruction(instruction.opcode, instruction.operands[:first] +
+                                                    [ value for value, _ in values ]))
+        else:
+            symbol, tree, real = root
+            emitter.assign(symbol, reassociator.normalize(tree), real)
+
+    block.instructions = emitter.instructions
+
+
+def reorder_expressions(program, options):
+    """
+    Expression reordering pass
+    The expressions of every basic block are rebuilt into trees - an expression whose value is only read once,
+    By a later instruction of the block, becomes an operand of that instruction's tree.
+    The trees are then normalized (constants folded, and addition and multiplication chains reassociated)
+    And emitted again in Sethi-Ullman order, evaluating the operand that takes the most temps first,
+    So fewer temps are live at once and temps are reused.
+
+    fast_math - also reassociate real additions and multiplications (which may change their rounding)
+    """
+
+    graph = FlowGraph.from_program(program)
+    live_out = graph.liveness()
+    reassociator = Reassociator(options.get('fast_math', False))
+    emitter = Emitter(NameGenerator(graph))
+
+    for number, block in enumerate(graph.blocks):
+        rebuild_block(block, live_out[number], reassociator, emitter)
+
+    return graph.to_program()
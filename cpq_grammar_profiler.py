@@ -0,0 +1,147 @@
+import sys
+import copy
+from time import perf_counter
+from cpq_lexer import CPQLexer
+from cpq_parser import CPQParser
+
+# Marker of the error recovery productions in the grammar
+ERROR_SYMBOL = 'error'
+
+
+class GrammarProfiler():
+    """
+    A profiler of the grammar rule actions of a CPQParser
+
+    Records the number of calls and the cumulative time of every production action,
+    as well as how many times each of the error recovery productions fired.
+
+    The profiler is attached to a single parser instance, the class level grammar of CPQParser is never modified,
+    so parsers without an attached profiler run without any overhead.
+    """
+
+    def __init__(self):
+        # Dictionary of production description -> [number of calls, cumulative time in seconds]
+        self.stats = dict()
+
+        # Set of the productions which are error recovery productions
+        self.error_productions = set()
+
+
+    def attach(self, parser):
+        """
+        Attaches the profiler to the given parser instance
+        The parser gets its own copy of the grammar, where every production action is wrapped with a timer
+
+        Returns the given parser, for convenience
+        """
+
+        grammar = copy.copy(parser._grammar)
+        grammar.Productions = [ self.wrap_production(production) for production in grammar.Productions ]
+
+        # Shadow the class level grammar for this instance only
+        parser._grammar = grammar
+
+        return parser
+
+
+    def wrap_production(self, production):
+        """
+        Returns a copy of the given production whose action is wrapped with a timer
+        Productions without an action (such as the augmented start production) are returned as they are
+        """
+
+        if production.func is None:
+            return production
+
+        name = str(production)
+        record = self.stats.setdefault(name, [0, 0.0])
+
+        if ERROR_SYMBOL in production.prod:
+            self.error_productions.add(name)
+
+        func = production.func
+
+        def timed_action(parser, p):
+            start = perf_counter()
+            try:
+                return func(parser, p)
+            finally:
+                record[1] += perf_counter() - start
+                record[0] += 1
+
+        wrapped = copy.copy(production)
+        wrapped.func = timed_action
+        return wrapped
+
+
+    def results(self):
+        """
+        Returns a list of dictionaries, one per production that was called at least once, sorted by cumulative time
+        """
+
+        results = [
+            {
+                'production': name,
+                'calls': calls,
+                'total_time': total_time,
+                'error_recovery': name in self.error_productions,
+            }
+            for name, (calls, total_time) in self.stats.items() if calls
+        ]
+
+        results.sort(key=lambda result: result['total_time'], reverse=True)
+        return results
+
+
+    def error_recoveries(self):
+        """
+        Returns the total number of times error recovery productions were reduced
+        """
+
+        return sum(self.stats[name][0] for name in self.error_productions)
+
+
+    def report(self):
+        """
+        Returns a human readable report of the results, sorted by cost
+        """
+
+        results = self.results()
+        total_time = sum(result['total_time'] for result in results) or 1
+
+        lines = [f'{"calls":>10} {"total ms":>10} {"us/call":>9} {"share":>7}  production']
+
+        for result in results:
+            lines.append(' '.join([
+                f'{result["calls"]:>10}',
+                f'{result["total_time"] * 1e3:>10.3f}',
+                f'{result["total_time"] * 1e6 / result["calls"]:>9.3f}',
+                f'{result["total_time"] * 100 / total_time:>6.1f}% ',
+                result['production'] + ('  [error recovery]' if result['error_recovery'] else ''),
+            ]))
+
+        lines.append(f'error recovery productions fired {self.error_recoveries()} times')
+        return '\n'.join(lines)
+
+
+def main():
+    """
+    Profiles the grammar rule actions while parsing the given input file, and prints the report to the stdout
+    """
+
+    if len(sys.argv) != 2:
+        print(f'usage: {sys.argv[0]} input-file.ou', file=sys.stderr)
+        return
+
+    with open(sys.argv[1], 'r') as file:
+        code_to_profile = file.read()
+
+    profiler = GrammarProfiler()
+    parser = profiler.attach(CPQParser())
+    parser.parse(CPQLexer().tokenize(code_to_profile))
+
+    print(profiler.report())
+
+
+if __name__ == "__main__":
+    main()
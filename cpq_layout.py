@@ -0,0 +1,357 @@
+from cpq_quad import Instruction
+from cpq_cfg import Block, FlowGraph, NameGenerator
+
+# Comparisons which are inverted by swapping their opcode,
+# So a conditional jump testing their result can swap its target and its fall through block for free
+INVERTED_COMPARISONS = { 'IEQL': 'INQL', 'INQL': 'IEQL', 'REQL': 'RNQL', 'RNQL': 'REQL' }
+
+# The static estimation of the execution counts, used when no profile is given:
+# Every loop is assumed to run this many iterations
+LOOP_ITERATIONS = 10
+
+# And a conditional jump with one successor inside its innermost loop and one outside, to stay in the loop
+# With this probability (other conditional jumps go either way with the same probability)
+STAY_PROBABILITY = 0.9
+
+
+def add_weight(weights, block, successor, weight):
+    """
+    Adds the given weight to the edge between the given blocks
+    """
+
+    weights[(block, successor)] = weights.get((block, successor), 0) + weight
+
+
+def static_weights(graph):
+    """
+    Estimates how many times every edge of the graph is taken, based on the loops of the graph
+    (see LOOP_ITERATIONS and STAY_PROBABILITY)
+
+    Returns a dictionary of (Block, successor Block) -> the estimated count
+    """
+
+    blocks = graph.blocks
+    depths, innermost = graph.loop_nesting()
+    weights = dict()
+
+    for number, block in enumerate(blocks):
+        count = LOOP_ITERATIONS ** depths[number]
+        successors = block.successors
+
+        if len(successors) == 1:
+            add_weight(weights, block, blocks[successors[0]], count)
+            continue
+
+        loop = innermost[number]
+        inside = [ loop is not None and successor in loop.blocks for successor in successors ]
+
+        for successor, stays in zip(successors, inside):
+            if inside.count(True) == 1:
+                probability = STAY_PROBABILITY if stays else 1 - STAY_PROBABILITY
+            else:
+                probability = 1 / len(successors)
+
+            add_weight(weights, block, blocks[successor], count * probability)
+
+    return weights
+
+
+def profile_weights(graph, profile):
+    """
+    Counts how many times every edge of the graph was taken in a profiled run (see cpq_exec_profiler.Profile)
+    The profile must be of the program the graph was built from
+
+    Returns a dictionary of (Block, successor Block) -> the count
+    """
+
+    blocks = graph.blocks
+    counts = profile.instruction_counts()
+
+    if len(counts) != sum(len(block.instructions) for block in blocks):
+        raise ValueError('the profile does not match the program')
+
+    weights = dict()
+    index = 0
+
+    for number, block in enumerate(blocks):
+        index += len(block.instructions)
+
+        if not block.instructions or block.terminator() == 'HALT':
+            continue
+
+        last = index - 1
+        terminator = block.terminator()
+        following = blocks[number + 1] if number + 1 < len(blocks) else None
+
+        if terminator == 'JUMP':
+            add_weight(weights, block, blocks[graph.label_blocks[block.instructions[-1].operands[0]]], counts[last])
+        elif terminator == 'JMPZ':
+            taken = profile.taken_counts[last]
+            add_weight(weights, block, blocks[graph.label_blocks[block.instructions[-1].operands[0]]], taken)
+
+            if following is not None:
+                add_weight(weights, block, following, counts[last] - taken)
+        elif following is not None:
+            add_weight(weights, block, following, counts[last])
+
+    return weights
+
+
+def move_weight(weights, block, old, new):
+    """
+    Moves the weight of the edge from the given block to the old successor, onto the edge to the new successor
+    """
+
+    add_weight(weights, block, new, weights.pop((block, old), 0))
+
+
+def label_of(block, names):
+    """
+    Returns the label of the given Block, anchoring a new one at the block if it has none
+    """
+
+    if not block.labels:
+        block.labels.append(names.fresh('L'))
+
+    return block.labels[0]
+
+
+def thread_jumps(graph, weights, names):
+    """
+    Jump threading
+    A jump into a block that only jumps on (or into an empty block, which falls through) is redirected to the block
+    It ends up at, every jump targets the first label of its block (collapsing chains of labels anchoring the same
+    Block), a jump to the end of the program or to a HALT becomes a HALT, and a conditional jump whose both
+    Successors end up at the same block is dropped. The blocks no longer reachable are then removed.
+
+    The weights of the redirected edges are moved along (see static_weights)
+    """
+
+    blocks = graph.blocks
+
+    def destination(number):
+        # Follows the jump only and empty blocks from the given block, stopping if they loop
+        seen = set()
+
+        while number not in seen:
+            seen.add(number)
+            block = blocks[number]
+
+            if not block.instructions and number + 1 < len(blocks):
+                number += 1
+            elif len(block.instructions) == 1 and block.terminator() == 'JUMP':
+                number = graph.label_blocks[block.instructions[0].operands[0]]
+            else:
+                break
+
+        return number
+
+    for number, block in enumerate(blocks):
+        terminator = block.terminator()
+
+        if terminator not in ('JUMP', 'JMPZ'):
+            continue
+
+        jump = block.instructions[-1]
+        target = blocks[graph.label_blocks[jump.operands[0]]]
+        destination_number = destination(graph.label_blocks[jump.operands[0]])
+        threaded = blocks[destination_number]
+
+        # Jumping to the end of the program, or to a HALT, ends the program
+        if terminator == 'JUMP' and (not threaded.instructions or
+                                     len(threaded.instructions) == 1 and threaded.terminator() == 'HALT'):
+            block.instructions[-1] = Instruction('HALT', [])
+            weights.pop((block, target), None)
+            continue
+
+        jump.operands[0] = label_of(threaded, names)
+        graph.label_blocks[jump.operands[0]] = destination_number
+        move_weight(weights, block, target, threaded)
+
+        if terminator == 'JMPZ' and number + 1 < len(blocks) and destination(number + 1) == destination_number:
+            block.instructions.pop()
+            move_weight(weights, block, threaded, blocks[number + 1])
+
+    graph.link()
+
+    reachable = set(graph.reverse_postorder())
+    graph.blocks = [ block for number, block in enumerate(blocks) if number in reachable ]
+    graph.link()
+
+
+def is_invertible(block, live_out):
+    """
+    Returns True if the conditional jump ending the given block may be inverted for free - it tests the result of
+    The comparison right before it (see INVERTED_COMPARISONS), which nothing else reads
+    """
+
+    if len(block.instructions) < 2 or block.terminator() != 'JMPZ':
+        return False
+
+    condition = block.instructions[-1].operands[1]
+    comparison = block.instructions[-2]
+
+    return comparison.opcode in INVERTED_COMPARISONS and comparison.defined() == condition and condition not in live_out
+
+
+def build_chains(graph, weights, invertible):
+    """
+    Links the blocks into chains of blocks laid out one after the other (as done by Pettis and Hansen)
+    The edges are visited from the most taken one, and an edge joins the chain ending at its block with the chain
+    Starting at its successor, if the block can fall through into the successor:
+        A block which falls through or jumps to the successor
+        A conditional jump, whose fall through block is the successor, or whose target is the successor
+        If it can be inverted (see is_invertible)
+    A conditional jump which can't be inverted is always laid out before its fall through block, as otherwise that
+    Path needs an additional jump. The entry block always starts the first chain.
+
+    Returns a dictionary of Block -> the Block laid out after it
+    """
+
+    blocks = graph.blocks
+    edges = list()
+
+    for number, block in enumerate(blocks):
+        for successor in block.successors:
+            if successor == 0:
+                continue
+
+            falls_through = successor == number + 1 and block.terminator() != 'JUMP'
+
+            # Inverting a conditional jump makes it jump to its fall through block, so there must be one
+            if not falls_through and block.terminator() == 'JMPZ' and (not invertible[number] or
+                                                                        number + 1 == len(blocks)):
+                continue
+
+            forced = falls_through and block.terminator() == 'JMPZ' and not invertible[number]
+            weight = weights.get((block, blocks[successor]), 0)
+
+            # Forced edges first, then the most taken edges, preferring the layout order on ties
+            edges.append(((not forced, -weight, not falls_through, number), number, successor))
+
+    edges.sort()
+
+    following = dict()
+    head_of_tail = { number: number for number in range(len(blocks)) }
+    tail_of_head = dict(head_of_tail)
+
+    for _, number, successor in edges:
+        if number not in head_of_tail or successor not in tail_of_head:
+            continue
+
+        head = head_of_tail.pop(number)
+        tail = tail_of_head.pop(successor)
+
+        # The successor already starts the chain of the block
+        if head == successor:
+            head_of_tail[number] = head
+            tail_of_head[successor] = tail
+            continue
+
+        following[blocks[number]] = blocks[successor]
+        head_of_tail[tail] = head
+        tail_of_head[head] = tail
+
+    return following
+
+
+def lay_out(graph, weights, names):
+    """
+    Lays the blocks of the graph out along their chains (see build_chains), every chain starting at the position
+    Of its first block, then fixes the ends of the blocks to the new layout:
+        A jump to the block laid out right after is dropped
+        A block that no longer falls through into its successor jumps to it (or halts, if it ended the program)
+        A conditional jump whose target is laid out right after is inverted
+    """
+
+    blocks = graph.blocks
+    live_out = graph.liveness()
+    invertible = [ is_invertible(block, live_out[number]) for number, block in enumerate(blocks) ]
+    following = build_chains(graph, weights, invertible)
+    chained = set(following.values())
+
+    falls_into = { block: blocks[number + 1] if number + 1 < len(blocks) else None
+                   for number, block in enumerate(blocks) }
+    targets = { block: blocks[graph.label_blocks[block.instructions[-1].operands[0]]]
+                for block in blocks if block.terminator() in ('JUMP', 'JMPZ') }
+    can_invert = { block: invertible[number] for number, block in enumerate(blocks) }
+
+    order = list()
+
+    for block in blocks:
+        if block in chained:
+            continue
+
+        while block is not None:
+            order.append(block)
+            block = following.get(block)
+
+    laid_out = list()
+
+    for position, block in enumerate(order):
+        after = order[position + 1] if position + 1 < len(order) else None
+        terminator = block.terminator()
+        successor = falls_into[block]
+        laid_out.append(block)
+
+        if terminator == 'HALT':
+            continue
+
+        if terminator == 'JUMP':
+            if targets[block] is after:
+                block.instructions.pop()
+            continue
+
+        if successor is after:
+            continue
+
+        if terminator == 'JMPZ' and targets[block] is after and can_invert[block] and successor is not None:
+            comparison = block.instructions[-2]
+            comparison.opcode = INVERTED_COMPARISONS[comparison.opcode]
+            block.instructions[-1].operands[0] = label_of(successor, names)
+            continue
+
+        ending = Instruction('JUMP', [label_of(successor, names)]) if successor is not None else Instruction('HALT', [])
+
+        if terminator == 'JMPZ':
+            laid_out.append(Block(instructions=[ending]))
+        else:
+            block.instructions.append(ending)
+
+    graph.blocks = laid_out
+    graph.link()
+
+
+def drop_unused_labels(graph):
+    """
+    Removes the labels no jump targets
+    """
+
+    targets = { block.instructions[-1].operands[0] for block in graph.blocks if block.terminator() in ('JUMP', 'JMPZ') }
+
+    for block in graph.blocks:
+        block.labels = [ label for label in block.labels if label in targets ]
+
+
+def lay_out_blocks(program, options):
+    """
+    Jump threading and basic block layout pass (see thread_jumps and lay_out)
+    The blocks are laid out by how many times every edge is taken - in a profiled run if a profile is given,
+    Or as estimated from the loops of the program otherwise (see static_weights)
+
+    profile - a cpq_exec_profiler.Profile of a run of the program the pass gets
+    """
+
+    graph = FlowGraph.from_program(program)
+    names = NameGenerator(graph)
+
+    if options.get('profile') is not None:
+        weights = profile_weights(graph, options['profile'])
+    else:
+        weights = static_weights(graph)
+
+    thread_jumps(graph, weights, names)
+    lay_out(graph, weights, names)
+    drop_unused_labels(graph)
+
+    return graph.to_program()
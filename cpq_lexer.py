@@ -1,11 +1,20 @@
+from sys import intern
 from sly import Lexer
-from common_functions import print_error
+from common_functions import ImmediateDiagnostics
 
 class CPQLexer(Lexer):
 
     # Instance variable for tracking whether the lexer encountered any errors during its run
     found_errors = False
 
+    def __init__(self, diagnostics=None):
+        """
+        Sets the Diagnostics object the lexer reports its errors to
+        If none is given, the errors are printed to the stderr as soon as they are found
+        """
+
+        self.diagnostics = diagnostics or ImmediateDiagnostics()
+
     # Set of token names
     tokens = { ELSE, FLOAT, IF, INPUT, INT, OUTPUT, WHILE, RELOP, ADDOP, MULOP, OR, AND, NOT, CAST, ID, NUM }
 
@@ -38,6 +47,24 @@ class CPQLexer(Lexer):
     ID['output']    = OUTPUT
     ID['while']     = WHILE
 
+    # Identifiers and numbers repeat throughout the source code, so their values are interned:
+    # Every occurrence of the same name or number shares a single string, instead of a new substring per token
+    def ID(self, t):
+        """
+        Intern the identifier (keywords are remapped before this, and keep their own values)
+        """
+
+        t.value = intern(t.value)
+        return t
+
+    def NUM(self, t):
+        """
+        Intern the number
+        """
+
+        t.value = intern(t.value)
+        return t
+
     # Line number tracking
     @_(r'\n+')
     def ignore_newline(self, t):
@@ -51,12 +78,12 @@ class CPQLexer(Lexer):
     def error(self, t):
         """
         Handle lexer errors by
-            Notifying the error using the print_error function
-            Skipping the problematic character
             Setting the found_errors variable to true, to prevent .qod file creation
+            Reporting the error to the diagnostics
+            Skipping the problematic character
         """
         
-        print_error(f'lexical error - bad character {t.value[0]}', line=self.lineno)
-        self.index += 1
         self.found_errors = True
+        self.diagnostics.report(f'lexical error - bad character {t.value[0]}', line=self.lineno, index=self.index)
+        self.index += 1
         return t
@@ -0,0 +1,669 @@
+import operator
+from cpq_quad import Instruction, JUMP_OPCODES, is_constant
+from cpq_cfg import Block, FlowGraph, NameGenerator
+from cpq_cost import CostModel
+
+# Relational opcodes of int comparisons, which stay true when both operands are multiplied by the same positive int
+INT_COMPARISONS = { 'IEQL', 'INQL', 'ILSS', 'IGRT' }
+
+# Python functions of the int instructions a loop header may consist of, for its trip count to be computed
+INT_OPERATIONS = {
+    'IASN': lambda value: value,
+    'IADD': operator.add,
+    'ISUB': operator.sub,
+    'IMLT': operator.mul,
+    'IEQL': lambda first, second: int(first == second),
+    'INQL': lambda first, second: int(first != second),
+    'ILSS': lambda first, second: int(first < second),
+    'IGRT': lambda first, second: int(first > second),
+}
+
+# Default number of copies of the body in every iteration of a partially unrolled loop
+UNROLL_FACTOR = 4
+
+# Default trip count up to which loops are fully unrolled
+UNROLL_FULL_LIMIT = 16
+
+# Default number of instructions unrolling may add to a program
+UNROLL_BUDGET = 256
+
+# Loops running more iterations than this are never unrolled (so computing the trip count stays cheap)
+MAX_TRIP_COUNT = 1 << 16
+
+
+def is_int_constant(operand):
+    """
+    Returns True if the given operand is an int literal
+    """
+
+    return is_constant(operand) and operand.isdigit()
+
+
+def count_uses(graph):
+    """
+    Returns a dictionary of symbol -> the number of instructions of the graph that read it
+    And a dictionary of symbol -> the number of instructions of the graph that assign it
+    """
+
+    uses = dict()
+    definitions = dict()
+
+    for block in graph.blocks:
+        for instruction in block.instructions:
+            for symbol in set(instruction.used()):
+                uses[symbol] = uses.get(symbol, 0) + 1
+
+            defined = instruction.defined()
+
+            if defined is not None:
+                definitions[defined] = definitions.get(defined, 0) + 1
+
+    return uses, definitions
+
+
+class LoopAnalysis():
+    """
+    The analyses of a FlowGraph the loop passes share - its loops, dominators and symbol use counts
+    Each one is computed when it is first needed, and again only after the graph changed (see invalidate),
+    So a pass doesn't redo them for every loop of the program
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.invalidate()
+
+
+    def invalidate(self):
+        """
+        Drops the analyses, once the blocks or the instructions of the graph changed
+        """
+
+        self.loops = None
+        self.immediate_dominators = None
+        self.counts = None
+
+
+    def header_loops(self):
+        """
+        Returns a dictionary of header Block -> Loop, of all the loops of the graph
+        """
+
+        if self.loops is None:
+            self.loops = { self.graph.blocks[loop.header]: loop for loop in self.graph.loops() }
+
+        return self.loops
+
+
+    def loop_of(self, header):
+        """
+        Returns the Loop whose header is the given Block, or None
+        """
+
+        return self.header_loops().get(header)
+
+
+    def inner_blocks(self, loop):
+        """
+        Returns the set of the numbers of the blocks of the loops nested in the given loop
+        """
+
+        return set().union(*(inner.blocks for inner in self.header_loops().values()
+                             if inner.header != loop.header and inner.header in loop.blocks))
+
+
+    def dominators(self):
+        """
+        Returns the immediate dominators of the blocks (see FlowGraph.dominators)
+        """
+
+        if self.immediate_dominators is None:
+            self.immediate_dominators = self.graph.dominators()
+
+        return self.immediate_dominators
+
+
+    def uses(self):
+        """
+        Returns the use and the assignment counts of the symbols (see count_uses)
+        """
+
+        if self.counts is None:
+            self.counts = count_uses(self.graph)
+
+        return self.counts
+
+
+class InductionVariable():
+    """
+    A basic induction variable of a loop - a variable whose only assignment in the loop adds a constant to it,
+    As generated for i = i + c (an IADD or ISUB into a temp, followed by an IASN of the temp)
+
+    block     - the Block of the assignment
+    increment - the IADD or ISUB instruction
+    copy      - the IASN instruction
+    step      - the constant added every iteration
+    """
+
+    def __init__(self, block, increment, copy, step):
+        self.block = block
+        self.increment = increment
+        self.copy = copy
+        self.step = step
+
+
+def find_induction_variables(graph, loop, uses, definitions):
+    """
+    Returns a dictionary of variable -> InductionVariable, of the basic induction variables of the given loop
+    """
+
+    loop_definitions = dict()
+
+    for number in loop.blocks:
+        for instruction in graph.blocks[number].instructions:
+            defined = instruction.defined()
+
+            if defined is not None:
+                loop_definitions[defined] = loop_definitions.get(defined, 0) + 1
+
+    variables = dict()
+
+    for number in loop.blocks:
+        block = graph.blocks[number]
+
+        for position, copy in enumerate(block.instructions):
+            if copy.opcode != 'IASN' or loop_definitions.get(copy.operands[0]) != 1:
+                continue
+
+            variable, temp = copy.operands
+
+            # The temp has to be assigned once, by the instruction right before, and only read by the copy
+            if position == 0 or definitions.get(temp) != 1 or uses.get(temp) != 1:
+                continue
+
+            increment = block.instructions[position - 1]
+
+            if increment.operands[0] != temp:
+                continue
+
+            if increment.opcode == 'IADD' and variable in increment.operands[1:]:
+                step = increment.operands[2] if increment.operands[1] == variable else increment.operands[1]
+                sign = 1
+            elif increment.opcode == 'ISUB' and increment.operands[1] == variable:
+                step = increment.operands[2]
+                sign = -1
+            else:
+                continue
+
+            if is_int_constant(step):
+                variables[variable] = InductionVariable(block, increment, copy, sign * int(step))
+
+    return variables, loop_definitions
+
+
+def is_invariant(operand, loop_definitions):
+    """
+    Returns True if the given operand is an int literal, or a symbol that the loop never assigns
+    """
+
+    return is_int_constant(operand) or (not is_constant(operand) and operand not in loop_definitions)
+
+
+def reduce_loop(analysis, loop, names):
+    """
+    Strength reduction of a single loop
+    Every multiplication of a basic induction variable by a loop invariant (an int constant, or a variable the loop
+    Never assigns) is a derived induction variable - it is replaced by a new variable, which is initialized in the
+    Loop preheader and incremented along with the basic induction variable.
+    Induction variables which are then only used by comparisons against loop invariants are replaced in the
+    Comparisons (linear function test replacement), and removed if nothing else reads them.
+
+    Returns True if the loop was changed
+    """
+
+    graph = analysis.graph
+    uses, definitions = analysis.uses()
+    variables, loop_definitions = find_induction_variables(graph, loop, uses, definitions)
+
+    # Multiplications of an induction variable by a loop invariant, as (block, instruction, variable, factor)
+    multiplications = list()
+
+    for number in sorted(loop.blocks):
+        block = graph.blocks[number]
+
+        for instruction in block.instructions:
+            if instruction.opcode != 'IMLT':
+                continue
+
+            first, second = instruction.operands[1:]
+
+            if first in variables and is_invariant(second, loop_definitions) and second != '0':
+                multiplications.append((block, instruction, first, second))
+            elif second in variables and is_invariant(first, loop_definitions) and first != '0':
+                multiplications.append((block, instruction, second, first))
+
+    if not multiplications:
+        return False
+
+    preheader = graph.insert_preheader(loop)
+
+    if preheader is None:
+        return False
+
+    # The header moved one block on
+    analysis.invalidate()
+    loop = analysis.loop_of(graph.blocks[loop.header + 1])
+
+    # Create a reduced variable for every induction variable and factor
+    reduced = dict()
+
+    for _, _, variable, factor in multiplications:
+        if (variable, factor) in reduced:
+            continue
+
+        name = reduced[(variable, factor)] = names.fresh('iv')
+        induction_variable = variables[variable]
+        step = induction_variable.step
+
+        preheader.instructions.append(Instruction('IMLT', [name, variable, factor]))
+
+        # The reduced variable changes by step * factor every iteration
+        if is_int_constant(factor):
+            change = str(abs(step) * int(factor))
+        elif abs(step) == 1:
+            change = factor
+        else:
+            change = names.fresh('step')
+            preheader.instructions.append(Instruction('IMLT', [change, factor, str(abs(step))]))
+
+        block = induction_variable.block
+        position = block.instructions.index(induction_variable.copy) + 1
+        block.instructions.insert(position, Instruction('IADD' if step >= 0 else 'ISUB', [name, name, change]))
+
+    # Replace the multiplications
+    for block, instruction, variable, factor in multiplications:
+        name = reduced[(variable, factor)]
+        temp = instruction.operands[0]
+        position = block.instructions.index(instruction)
+
+        # Forward the reduced variable into the single reader of the temp, if it is later in the same block
+        # And the induction variable (so the reduced variable too) isn't incremented in between
+        reader = None
+
+        if definitions.get(temp) == 1 and uses.get(temp) == 1:
+            for following in block.instructions[position + 1:]:
+                if temp in following.used():
+                    reader = following
+                    break
+                if following.defined() in (variable, name):
+                    break
+
+        if reader is not None:
+            reader.replace_used(temp, name)
+            del block.instructions[position]
+        else:
+            block.instructions[position] = Instruction('IASN', [temp, name])
+
+    replace_tests(graph, loop, variables, reduced, loop_definitions, preheader, names)
+
+    graph.link()
+    analysis.invalidate()
+    return True
+
+
+def live_after_loop(graph, loop, live_out):
+    """
+    Returns the set of the symbols that are live when the given loop exits - the symbols which some path from an exit
+    Of the loop reads before assigning them (including the preheader of the loop, if the path enters the loop again)
+    """
+
+    live = set()
+    exits = { successor for number in loop.blocks for successor in graph.blocks[number].successors
+              if successor not in loop.blocks }
+
+    for number in exits:
+        defined = set()
+
+        for instruction in graph.blocks[number].instructions:
+            live.update(symbol for symbol in instruction.used() if symbol not in defined)
+
+            if instruction.defined() is not None:
+                defined.add(instruction.defined())
+
+        live.update(live_out[number] - defined)
+
+    return live
+
+
+def replace_tests(graph, loop, variables, reduced, loop_definitions, preheader, names):
+    """
+    Linear function test replacement - an induction variable whose only readers in the loop are its own increment
+    And comparisons against loop invariants, which isn't live when the loop exits either, is replaced in the
+    Comparisons by one of its reduced variables (with a positive constant factor, so the comparisons keep their
+    Results), and then removed
+    A variable read by the preheader is live when the loop exits if the loop may be entered again (as an inner loop
+    That doesn't reset its counter), since the reduced variables are initialized from its value on every entry
+    """
+
+    loop_instructions = [ instruction for number in loop.blocks for instruction in graph.blocks[number].instructions ]
+    live = live_after_loop(graph, loop, graph.liveness())
+
+    for variable, induction_variable in variables.items():
+        factor = next((factor for reduced_variable, factor in reduced if reduced_variable == variable
+                       and is_int_constant(factor) and int(factor) > 0), None)
+
+        if factor is None or variable in live:
+            continue
+
+        tests = list()
+        removable = True
+
+        for instruction in loop_instructions:
+            if instruction is induction_variable.increment or variable not in instruction.used():
+                continue
+
+            if instruction.opcode not in INT_COMPARISONS:
+                removable = False
+                break
+
+            operands = instruction.operands[1:]
+            other = operands[1] if operands[0] == variable else operands[0]
+
+            if not is_int_constant(other) and (other == variable or other in loop_definitions):
+                removable = False
+                break
+
+            tests.append((instruction, other))
+
+        if not removable:
+            continue
+
+        name = reduced[(variable, factor)]
+
+        for instruction, other in tests:
+            if is_int_constant(other):
+                bound = str(int(other) * int(factor))
+            else:
+                bound = names.fresh('bound')
+                preheader.instructions.append(Instruction('IMLT', [bound, other, factor]))
+
+            instruction.operands = [instruction.operands[0]] + [ name if operand == variable else bound
+                                                                 for operand in instruction.operands[1:] ]
+
+        # The induction variable is dead now
+        induction_variable.block.instructions.remove(induction_variable.increment)
+        induction_variable.block.instructions.remove(induction_variable.copy)
+
+
+def reduce_strength(program, options):
+    """
+    Induction variable strength reduction pass (see reduce_loop), over all the loops of the program, inner loops first
+    """
+
+    graph = FlowGraph.from_program(program)
+    analysis = LoopAnalysis(graph)
+    names = NameGenerator(graph)
+
+    for header in [ graph.blocks[loop.header] for loop in graph.loops() ]:
+        loop = analysis.loop_of(header)
+
+        if loop is not None:
+            reduce_loop(analysis, loop, names)
+
+    return graph.to_program()
+
+
+def initial_value(graph, loop, variable):
+    """
+    Returns the int constant the given variable holds whenever the given loop is entered,
+    Or None if it isn't assigned a constant in the block that falls into the header
+    """
+
+    if not graph.entered_by_fall_through(loop):
+        return None
+
+    for instruction in reversed(graph.blocks[loop.header - 1].instructions):
+        if instruction.defined() == variable:
+            if instruction.opcode == 'IASN' and is_int_constant(instruction.operands[1]):
+                return int(instruction.operands[1])
+            return None
+
+    return None
+
+
+def evaluate_header(header, variable, value):
+    """
+    Runs the instructions of a loop header (the evaluation of the condition of a while loop),
+    Given the value of the variable it tests
+
+    Returns the condition the header ends with, or None if the header reads anything but the variable, int constants
+    And its own temps
+    """
+
+    values = { variable: value }
+
+    for instruction in header.instructions[:-1]:
+        operation = INT_OPERATIONS.get(instruction.opcode)
+
+        if operation is None:
+            return None
+
+        operands = list()
+
+        for operand in instruction.operands[1:]:
+            if is_int_constant(operand):
+                operands.append(int(operand))
+            elif operand in values:
+                operands.append(values[operand])
+            else:
+                return None
+
+        values[instruction.operands[0]] = operation(*operands)
+
+    condition = header.instructions[-1].operands[1]
+    return int(condition) if is_int_constant(condition) else values.get(condition)
+
+
+def trip_count(graph, loop, variable, induction_variable):
+    """
+    Returns the number of iterations the given loop runs, if its header only tests the given induction variable
+    And the variable starts at a constant, or None
+    """
+
+    value = initial_value(graph, loop, variable)
+
+    if value is None:
+        return None
+
+    header = graph.blocks[loop.header]
+
+    for count in range(MAX_TRIP_COUNT + 1):
+        condition = evaluate_header(header, variable, value)
+
+        if condition is None:
+            return None
+        if condition == 0:
+            return count
+
+        value += induction_variable.step
+
+    return None
+
+
+def get_loop_body(analysis, loop):
+    """
+    Returns the list of the numbers of the blocks of the body of the given while loop (the blocks between the header
+    And the exit), if the loop can be unrolled - it is entered by falling through into its header, only the header
+    Exits it (to the block right after the loop), and only its last block jumps back to the header.
+    Otherwise returns None
+    """
+
+    graph = analysis.graph
+    header = loop.header
+    latch = max(loop.blocks)
+    header_block = graph.blocks[header]
+
+    if loop.blocks != set(range(header, latch + 1)) or not graph.entered_by_fall_through(loop):
+        return None
+
+    if header_block.terminator() != 'JMPZ' or header_block.successors != [latch + 1, header + 1]:
+        return None
+
+    if graph.blocks[latch].terminator() != 'JUMP' or graph.blocks[latch].successors != [header]:
+        return None
+
+    if [ predecessor for predecessor in header_block.predecessors if predecessor in loop.blocks ] != [latch]:
+        return None
+
+    for number in range(header + 1, latch + 1):
+        if any(successor not in loop.blocks for successor in graph.blocks[number].successors):
+            return None
+
+    # The temps of the condition are dropped along with the header, so nothing else may read them
+    uses, _ = analysis.uses()
+    temps = { instruction.defined() for instruction in header_block.instructions } - { None }
+
+    for temp in temps:
+        if uses.get(temp, 0) != sum(1 for instruction in header_block.instructions if temp in instruction.used()):
+            return None
+
+    return list(range(header + 1, latch + 1))
+
+
+def copy_body(graph, body, names):
+    """
+    Returns a copy of the given blocks of a loop body, without the jump back to the header
+    The labels of the copied blocks are renamed, and the jumps between them follow the copies
+    """
+
+    blocks = [ graph.blocks[number] for number in body ]
+    renamed = { label: names.fresh('L') for block in blocks for label in block.labels }
+    copies = list()
+
+    for block in blocks:
+        instructions = list()
+
+        for instruction in block.instructions:
+            operands = list(instruction.operands)
+
+            if instruction.opcode in JUMP_OPCODES:
+                operands[0] = renamed.get(operands[0], operands[0])
+
+            instructions.append(Instruction(instruction.opcode, operands))
+
+        copies.append(Block([ renamed[label] for label in block.labels ], instructions))
+
+    copies[-1].instructions.pop()
+    return copies
+
+
+def unroll_loop(analysis, loop, names, options, budget):
+    """
+    Unrolls a single while loop, if its trip count is known at compile time (see trip_count)
+    Loops which run up to unroll_full iterations are fully unrolled - the body is repeated once per iteration,
+    And the header and the jumps are dropped.
+    Longer loops are partially unrolled - every iteration runs unroll_factor copies of the body, and the remaining
+    Iterations run as copies of the body before the loop, so the header is only evaluated once per iteration.
+    The number of instructions unrolling adds is limited by the given budget.
+
+    Returns the number of instructions added (negative if the loop got smaller), or None if the loop was not unrolled
+    """
+
+    graph = analysis.graph
+    body = get_loop_body(analysis, loop)
+
+    if body is None:
+        return None
+
+    uses, definitions = analysis.uses()
+    variables, _ = find_induction_variables(graph, loop, uses, definitions)
+
+    # The induction variable has to be updated exactly once per iteration - in a block that every iteration runs
+    # (dominates the jump back to the header), and not in an inner loop
+    inner_blocks = analysis.inner_blocks(loop)
+    count = None
+
+    for variable, induction_variable in variables.items():
+        number = next(number for number in loop.blocks if graph.blocks[number] is induction_variable.block)
+
+        if number in inner_blocks or not graph.dominates(analysis.dominators(), number, body[-1]):
+            continue
+
+        count = trip_count(graph, loop, variable, induction_variable)
+
+        if count is not None:
+            break
+
+    if count is None:
+        return None
+
+    factor = options.get('unroll_factor', UNROLL_FACTOR)
+    header = graph.blocks[loop.header]
+    body_size = sum(len(graph.blocks[number].instructions) for number in body) - 1
+    size = len(header.instructions) + body_size + 1
+
+    if count <= options.get('unroll_full', UNROLL_FULL_LIMIT) and count * body_size - size <= budget:
+        blocks = list()
+
+        for _ in range(count):
+            blocks.extend(copy_body(graph, body, names))
+
+        graph.blocks[loop.header:body[-1] + 1] = blocks
+        graph.link()
+        analysis.invalidate()
+        return count * body_size - size
+
+    remainder = count % factor
+
+    if factor < 2 or count < 2 * factor or (remainder + factor - 1) * body_size > budget:
+        return None
+
+    blocks = list()
+
+    for _ in range(remainder):
+        blocks.extend(copy_body(graph, body, names))
+
+    blocks.append(header)
+
+    for _ in range(factor - 1):
+        blocks.extend(copy_body(graph, body, names))
+
+    blocks.extend(graph.blocks[number] for number in body)
+
+    graph.blocks[loop.header:body[-1] + 1] = blocks
+    graph.link()
+    analysis.invalidate()
+    return (remainder + factor - 1) * body_size
+
+
+def unroll_loops(program, options):
+    """
+    Loop unrolling pass (see unroll_loop), over all the loops of the program
+
+    unroll_factor - the number of copies of the body in every iteration of a partially unrolled loop
+    unroll_full   - the trip count up to which loops are fully unrolled
+    unroll_budget - the number of instructions unrolling may add to the program
+    costs         - the opcode costs of the cost model the loops are ordered by (see cpq_cost.CostModel)
+
+    Unrolling saves evaluations of the loop headers, so the budget goes to the loops whose headers are estimated
+    To cost the most first (which are the inner loops, unless an outer header is much more expensive)
+    """
+
+    graph = FlowGraph.from_program(program)
+    analysis = LoopAnalysis(graph)
+    names = NameGenerator(graph)
+    budget = options.get('unroll_budget', UNROLL_BUDGET)
+    estimate = CostModel(options.get('costs')).estimate(graph)
+    loops = sorted(graph.loops(), key=lambda loop: estimate.costs[loop.header], reverse=True)
+
+    for header in [ graph.blocks[loop.header] for loop in loops ]:
+        loop = analysis.loop_of(header)
+
+        if loop is None:
+            continue
+
+        added = unroll_loop(analysis, loop, names, options, budget)
+
+        if added is not None:
+            budget -= added
+
+    return graph.to_program()
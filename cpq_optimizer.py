@@ -0,0 +1,52 @@
+from cpq_quad import Program
+from cpq_loops import reduce_strength, unroll_loops
+from cpq_expressions import reorder_expressions
+from cpq_layout import lay_out_blocks
+from cpq_ssa import propagate_constants
+
+# The optimization passes, by name
+# Every pass gets a Program and a dictionary of optimization options, and returns the optimized Program
+PASSES = {
+    'constants': propagate_constants,
+    'strength_reduction': reduce_strength,
+    'unrolling': unroll_loops,
+    'expressions': reorder_expressions,
+    'layout': lay_out_blocks,
+}
+
+# The passes of every optimization level, in the order they run
+LEVELS = {
+    0: [],
+    1: ['constants', 'strength_reduction', 'expressions', 'layout'],
+    2: ['constants', 'unrolling', 'strength_reduction', 'expressions', 'layout'],
+}
+
+# The highest optimization level
+MAX_LEVEL = max(LEVELS)
+
+
+def optimize(program, level=MAX_LEVEL, passes=None, **options):
+    """
+    Optimizes the given Program
+
+    level   - the optimization level, which selects the passes to run (see LEVELS)
+    passes  - list of the names of the passes to run, instead of the ones of the level
+    options - the options of the passes
+
+    Returns the optimized Program
+    """
+
+    for name in (LEVELS[level] if passes is None else passes):
+        program = PASSES[name](program, options)
+
+    return program
+
+
+def optimize_code(instructions, level=MAX_LEVEL, passes=None, **options):
+    """
+    Optimizes the given QUAD code lines (as generated by the compiler), see optimize
+
+    Returns the optimized QUAD code lines
+    """
+
+    return optimize(Program.from_lines(instructions), level, passes, **options).to_lines()
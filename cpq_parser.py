@@ -1,6 +1,6 @@
 from sly import Parser
 from cpq_lexer import CPQLexer
-from common_functions import print_error
+from common_functions import ImmediateDiagnostics
 
 # Constants representing float and int
 _FLOAT = 'float'
@@ -25,21 +25,40 @@ ops = {
     '=': 'EQL'
 }
 
+# Dictionary of the types named by type keywords and casts
+# The types are mapped to the type constants, so every Operand shares the same type strings
+type_tags = {
+    'int': _INT,
+    'float': _FLOAT,
+    'static_cast<int>': _INT,
+    'static_cast<float>': _FLOAT
+}
+
 
-# Generator of tX strings where X is a number starting from 1 and raising by 1 each time the generator is called
+# Generator of temp numbers starting from 1 and raising by 1 each time the generator is called
+# Temp number X stands for the temp tX, whose name is only rendered when it is written into a code line (see render)
 def temp_generator():
     count = 0
     while True:
         count += 1
-        yield f't{count}'
+        yield count
 
 
-# Generator of LX strings where X is a number starting from 1 and raising by 1 each time the generator is called
+# Generator of label numbers starting from 1 and raising by 1 each time the generator is called
+# Label number X stands for the label LX, whose name is only rendered when it is written into a code line
 def label_generator():
     count = 0
     while True:
         count += 1
-        yield f'L{count}'
+        yield count
+
+
+def render(value):
+    """
+    Returns the QUAD code of an Operand value - the name of the temp for a temp number, the value itself otherwise
+    """
+
+    return f't{value}' if type(value) is int else value
 
 
 class CPQParser(Parser):
@@ -53,17 +72,60 @@ class CPQParser(Parser):
     # Instance variable for tracking whether the lexer encountered any errors during its run
     found_errors = False
 
-    # Set symbol table to be an empty dictionary
-    symbol_table = dict()
+    def __init__(self, diagnostics=None, emit_code=True):
+        """
+        Initiates the state of a single compilation
+        The state is kept per instance, so that several parsers can run in the same process
+
+        If emit_code is False, only the grammar and the semantics (symbol table and types) are checked:
+            The code generation functions are replaced with ones that do nothing for this instance,
+            So no QUAD code is formatted and no temps or labels are allocated.
+        """
+
+        # Set the Diagnostics object errors and warnings are reported to (printed as soon as they are found by default)
+        self.diagnostics = diagnostics or ImmediateDiagnostics()
+
+        # The token on which the last syntax error was encountered, used for the error column
+        self.error_token = None
+
+        # Set symbol table to be an empty dictionary
+        self.symbol_table = dict()
+
+        # Set the generated code to be an empty list
+        self.quad_code = list()
+
+        # Set the source line numbers of the generated code to be an empty list (a line number per generated code line)
+        self.source_lines = list()
+
+        # The line number of the current grammer rule, which the generated code is attributed to
+        self.lineno = None
 
-    # Set the generated code to be an empty list
-    quad_code = list()
+        # The numbers of the temps whose names are declared as variables, which are skipped by get_temp
+        self.declared_temps = set()
+
+        # The temps holding the conversions generated since the last label, by the converted value
+        # Code between two labels runs straight through, so a value converted again can reuse the earlier temp
+        self.conversions = dict()
+
+        # Initiate label generator and temp generator
+        self._label_generator = label_generator()
+        self._temp_generator = temp_generator()
+
+        # Disable code generation, if requested
+        if not emit_code:
+            self.gen = self.generate_three_adress_code = self.gen_label = self.discard_code
+            self.gen_jump_to_label = self.gen_cond_jump = self.discard_code
+            self.get_temp = self.get_label = self.get_placeholder
 
     class Operand():
         """
         An operand object which has a value and a type
+        The value is a variable name or a number, or a temp number (see render)
         """
 
+        # An Operand is created for every reduced factor, term and expression, so it is kept to its two fields
+        __slots__ = ('val', 'type')
+
         def __init__(self, value=None, type_=_FLOAT):
             self.val = value
             self.type = type_
@@ -78,48 +140,71 @@ class CPQParser(Parser):
     def gen(self, code):
         """
         Generate code bit - adds the given code to the quad_code generated so far
+        The current line number is kept alongside, to map the code back to the source line it originates from
         """
         self.quad_code.append(code)
+        self.source_lines.append(self.lineno)
+
+
+    def discard_code(self, *args):
+        """
+        Replaces the code generation functions when code emission is disabled
+        """
+
+        pass
+
+
+    def get_placeholder(self):
+        """
+        Replaces the temp and label generation when code emission is disabled
+
+        Returns a placeholder name, as the names are never used
+        """
+
+        return '_'
 
 
     def error(self, token):
         """
         Error handling is done in the lexer and the error handling grammer rules
         This function is to avoid to default sly error handling, while ensuring the found_errors variable is adjusted
+        The erroneous token is kept so the error handling grammer rules can report its column
         """
 
         self.found_errors = True
+        self.error_token = token
 
 
     def raise_semantic_error(self, error):
         """
         Handle a semantic error by
-            Notifying the error using the print_error function
             Setting the found_errors variable to true, to prevent .qod file creation
+            Reporting the error to the diagnostics
         """
 
-        print_error(f'semantic error - {error}', line=self.lineno)
         self.found_errors = True
+        self.diagnostics.report(f'semantic error - {error}', line=self.lineno)
 
 
     def raise_syntax_error(self, error):
         """
         Handle a syntax error by
-            Notifying the error using the print_error function
             Setting the found_errors variable to true, to prevent .qod file creation
+            Reporting the error (with the column of the erroneous token, if known) to the diagnostics
         """
 
-        print_error(f'syntax error in {error}', line=self.lineno)
         self.found_errors = True
+        index = getattr(self.error_token, 'index', None)
+        self.diagnostics.report(f'syntax error in {error}', line=self.lineno, index=index)
 
 
     def raise_warning(self, error):
         """
-        Handles a warning by using the print_error function with WARNING severity
+        Handles a warning by reporting it to the diagnostics with WARNING severity
         Does not adjust the found_errors variable, as this is only a warning and does not prevent compilation.
         """
 
-        print_error(error, line=self.lineno, severity="WARNING")
+        self.diagnostics.report(error, line=self.lineno, severity="WARNING")
 
 
     def get_from_symbol_table(self, symbol):
@@ -158,10 +243,9 @@ class CPQParser(Parser):
 
         self.symbol_table[symbol] = type_
 
-
-    # Initiate label generator and temp generator
-    _label_generator = label_generator()
-    _temp_generator = temp_generator()
+        # Keep the numbers of the declared names that are also temp names (such as t1, but not t01)
+        if symbol[0] == 't' and symbol[1:].isdigit() and symbol[1] != '0':
+            self.declared_temps.add(int(symbol[1:]))
 
 
     def get_temp(self):
@@ -170,14 +254,15 @@ class CPQParser(Parser):
         Ensures the temp is not already in the symbol table.
             If it is, generates a new temp instead (until an unused temp is found)
             
-        Returns the name of the unused temp.
+        Returns the number of the unused temp (see render).
         """
 
         # Get the next item in the temp generator
         temp = next(self._temp_generator)
 
         # While the current temp is in the symbol table, keep generating new temps
-        while self.is_in_symbol_table(temp):
+        # The declarations all come before the statements, so every declared temp name is known by now
+        while temp in self.declared_temps:
             temp = next(self._temp_generator)
 
         # Return the first temp that is not in the symbol table
@@ -188,7 +273,7 @@ class CPQParser(Parser):
         """
         Generates a new label every time the function is called
         
-        Returns the name of the new label
+        Returns the number of the new label
         """
 
         # Get the next item in the label generator and return it
@@ -198,9 +283,11 @@ class CPQParser(Parser):
     def gen_label(self, label):
         """
         Generate the code for a given label
+        The code after a label can be reached by a jump, so the conversions generated before it can't be reused
         """
 
-        self.gen(f'{label}: ')        
+        self.conversions.clear()
+        self.gen(f'L{label}: ')        
 
 
     def gen_jump_to_label(self, label):
@@ -208,7 +295,7 @@ class CPQParser(Parser):
         Generate the code for a JUMP command to the given label
         """
 
-        self.gen(f'JUMP {label}')
+        self.gen(f'JUMP L{label}')
 
 
     def gen_cond_jump(self, label, cond):
@@ -216,7 +303,7 @@ class CPQParser(Parser):
         Generate the code for a conditional jump to the given label based on a given condition
         """
 
-        self.gen(f'JMPZ {label} {cond}')
+        self.gen(f'JMPZ L{label} {render(cond)}')
 
 
     def get_type(self, first, second):
@@ -232,14 +319,43 @@ class CPQParser(Parser):
         Gets a value and a type, converts the given value to the given type assuming it was the opposite type.
         The conversion includes generating the required QUAD code for conversion
         Returns an Operand object with the value of the created temp where the converted value is stored
+
+        No code is generated when the conversion is known at compile time:
+            Numbers are converted into the matching number of the target type
+            A value that was already converted since the last label (see gen_label) reuses the temp of that conversion
         """
 
+        # Convert numbers at compile time
+        if type(val) is str and val[:1].isdigit():
+            number = self.convert_number(type_, val)
+            if number is not None:
+                return self.Operand(number, type_)
+
+        # Reuse an earlier conversion of the same value
+        if val in self.conversions:
+            return self.Operand(self.conversions[val], type_)
+
         temp = self.get_temp()
         opcode = 'ITOR' if type_ == _FLOAT else 'RTOI'
-        self.gen(' '.join([opcode, temp, val]))
+        self.gen(f'{opcode} t{temp} {render(val)}')
+        self.conversions[val] = temp
         return self.Operand(temp, type_)
 
 
+    def convert_number(self, type_, number):
+        """
+        Converts the given number to the given type, the same way the ITOR and RTOI operations do
+        Returns the converted number, or None if it has no representation in the given type
+        """
+
+        try:
+            if type_ == _FLOAT:
+                return repr(float(int(number)))
+            return str(int(float(number)))
+        except (OverflowError, ValueError):
+            return None
+
+
     def get_converted_operands(self, type_, operands_list):
         """
         Gets a list of Operand objects and a target type
@@ -267,7 +383,7 @@ class CPQParser(Parser):
         Generates the relevant QUAD code based on the types dict and the ops dict
         """
 
-        self.gen(f'{types.get(type_)}{ops.get(op)} {" ".join(operands)}')
+        self.gen(f'{types.get(type_)}{ops.get(op)} {" ".join(map(render, operands))}')
 
 
     def three_address_code(self, opcode, operands):
@@ -377,8 +493,8 @@ class CPQParser(Parser):
         # Sets the current line number
         self.lineno = p.lineno
 
-        # Returns the first item in the rule, which in this case is the terminal for the type used
-        return p[0]
+        # Returns the type of the first item in the rule, which in this case is the terminal for the type used
+        return type_tags[p[0]]
     
 
     @_('idlist "," ID')
@@ -457,7 +573,7 @@ class CPQParser(Parser):
         
         # Ensure the given ID and given expression are of compatible type
         if id_type != p.expression.type and id_type != _FLOAT:
-            err = f"can't assign {p.expression.val} of type {p.expression.type} into {p.ID} of type {id_type}"
+            err = f"can't assign {render(p.expression.val)} of type {p.expression.type} into {p.ID} of type {id_type}"
             self.raise_semantic_error(err)
 
         # Get an Operand object of the expression with the required type
@@ -469,7 +585,10 @@ class CPQParser(Parser):
         converted_expression = self.get_converted_operands(id_type, [p.expression])[0]
 
         # Generate the code for assigning the (converted) expression to the given ID.
-        self.gen(f'{types.get(id_type)}ASN {p.ID} {converted_expression.val}')
+        self.gen(f'{types.get(id_type)}ASN {p.ID} {render(converted_expression.val)}')
+
+        # The earlier conversions of the ID no longer hold its value
+        self.conversions.pop(p.ID, None)
     
 
     @_('INPUT "(" ID ")" ";"')
@@ -493,6 +612,9 @@ class CPQParser(Parser):
 
         # Generate the code for reading the input into the given ID
         self.gen(f'{types.get(type_)}INP {p.ID}')
+
+        # The earlier conversions of the ID no longer hold its value
+        self.conversions.pop(p.ID, None)
     
 
     @_('OUTPUT "(" expression ")" ";"')
@@ -508,7 +630,7 @@ class CPQParser(Parser):
         self.lineno = p.lineno
 
         # Generates the code for printing the given expression
-        self.gen(f'{types.get(p.expression.type)}PRT {p.expression.val}')
+        self.gen(f'{types.get(p.expression.type)}PRT {render(p.expression.val)}')
     
 
     @_('IF "(" boolexpr ")" jump_if_false stmt jump_to_end ELSE false_label stmt')
@@ -683,20 +805,15 @@ class CPQParser(Parser):
         # Create a new temp to store the result of the bool expression in
         temp = self.get_temp()
 
-        # Check for the type of the boolean expression
-        type_ = self.get_type(p.boolexpr.type, p.boolterm.type)
-
-        # Convert the operands, if needed
-        converted_operands = self.get_converted_operands(type_, [p.boolexpr, p.boolterm])
-
+        # Boolean values are always ints (0 or 1), so the operands are combined with int operations, with no conversions
         # Generates the three address code for adding both operands
-        self.generate_three_adress_code(type_, '+', [temp] + [ operand.val for operand in converted_operands ])
+        self.generate_three_adress_code(_INT, '+', [temp, p.boolexpr.val, p.boolterm.val])
 
         # Generates the three address code for comparing the result of the operands' addition to the constant zero
-        self.generate_three_adress_code(type_, '>', [temp, temp, self._ZERO.val])
+        self.generate_three_adress_code(_INT, '>', [temp, temp, self._ZERO.val])
 
         # Returns an Operand object of the temp in which the result of the boolean expression is stored
-        return self.Operand(temp, type_)
+        return self.Operand(temp, _INT)
        
 
     @_('boolterm')
@@ -731,20 +848,15 @@ class CPQParser(Parser):
         # Create a new temp to store the result of the bool term in
         temp = self.get_temp()
 
-        # Check for the type of the boolean term
-        type_ = self.get_type(p.boolterm.type, p.boolfactor.type)
-
-        # Convert the operands, if needed
-        converted_operands = self.get_converted_operands(type_, [p.boolterm, p.boolfactor])
-
+        # Boolean values are always ints (0 or 1), so the operands are combined with int operations, with no conversions
         # Generates the three address code for adding both operands
-        self.generate_three_adress_code(type_, '+', [temp] + [ operand.val for operand in converted_operands ])
+        self.generate_three_adress_code(_INT, '+', [temp, p.boolterm.val, p.boolfactor.val])
 
         # Generates the three address code for comparing the result of the operands' addition to the constant two
-        self.generate_three_adress_code(type_, '==', [temp, temp, self._TWO.val])
+        self.generate_three_adress_code(_INT, '==', [temp, temp, self._TWO.val])
 
         # Returns an Operand object of the temp in which the result of the boolean term is stored
-        return self.Operand(temp, type_)
+        return self.Operand(temp, _INT)
 
 
     @_('boolfactor')
@@ -916,11 +1028,11 @@ class CPQParser(Parser):
         # Sets the current line number
         self.lineno = p.lineno
         
-        target_type = p.CAST.split('<')[1][:-1]
+        target_type = type_tags[p.CAST]
         
         # Check if a conversion is requried
         if target_type == p.expression.type:
-            self.raise_warning(f"{target_type} casting of {p.expression.type} operand ({p.expression.val})")
+            self.raise_warning(f"{target_type} casting of {p.expression.type} operand ({render(p.expression.val)})")
             return p.expression
         else:
             # Generate the code for converting the expression and return the temp in which the coversion is stored
@@ -1120,7 +1232,7 @@ class CPQParser(Parser):
         self.raise_syntax_error('boolean term')
 
         # Return defaultive value for this grammer rule
-        return self.Operand()
+        return self.Operand(type_=_INT)
 
 
     @_('NOT error boolexpr ")"',
@@ -1140,7 +1252,7 @@ class CPQParser(Parser):
         self.raise_syntax_error('boolean factor')
 
         # Return defaultive value for this grammer rule
-        return self.Operand()
+        return self.Operand(type_=_INT)
 
 
     @_('"(" error ")"',
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import platform
+import subprocess
+import statistics
+from cpq_benchmark import run_suite, flatten, get_commit, get_samples, SIZES, DEFAULT_REPEAT
+
+# Default file of the benchmark history, holding the results of every recorded commit
+HISTORY_FILE = 'benchmark-history.json'
+
+# Version of the benchmark history format
+VERSION = 1
+
+# Compile time benchmarks the gate runs on the workloads - lexing, parsing, parsing with code generation and the
+# Optimization passes. They are timed, so they run several times (see DEFAULT_RUNS)
+TIMED_BENCHMARKS = ['tokenize', 'check', 'parse', 'passes']
+
+# Runtime benchmarks the gate runs on the sample programs - their results are instruction counts, which don't change
+# Between runs, so they run once
+COUNTED_BENCHMARKS = ['executed']
+
+# Default workload sizes of the compile time benchmarks
+DEFAULT_SIZES = ['small', 'medium']
+
+# Default number of runs of the timed benchmarks, the median of the runs being compared
+DEFAULT_RUNS = 5
+
+# The metrics the gate checks, as patterns of benchmark/workload/metric -> True if higher values are better
+GATED_METRICS = {
+    'tokenize/*/tokens_per_second': True,
+    'check/*/tokens_per_second': True,
+    'parse/*/instructions_per_second': True,
+    'passes/*/*_seconds': False,
+    'executed/*/level*_executed': False,
+    'executed/*/level*_instructions': False,
+}
+
+# Default regressions (relative to the baseline) the gate tolerates - of timings and of instruction counts
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_COUNT_THRESHOLD = 0.0
+
+# A timing regression must also be more than this many times the spread of the runs (the sum of the median absolute
+# Deviations of the baseline and the current runs), so noisy timings don't fail the gate
+NOISE_FACTOR = 2
+
+
+def get_revision():
+    """
+    Returns the key of the current commit in the history - its hash, suffixed with -dirty if the tracked files have
+    Uncommitted changes (so they don't replace the results of the commit itself)
+    """
+
+    commit = get_commit()
+
+    try:
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                 text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return commit
+
+    return f'{commit}-dirty' if commit and changes else commit
+
+
+def is_timing(metric):
+    """
+    Returns True if the given metric is a timing (in seconds or per second), rather than a count
+    """
+
+    return metric.endswith('seconds') or metric.endswith('per_second')
+
+
+def is_gated(metric):
+    """
+    Returns whether higher values of the given metric are better, or None if the gate doesn't check the metric
+    """
+
+    for pattern, higher_is_better in GATED_METRICS.items():
+        if fnmatch.fnmatchcase(metric, pattern):
+            return higher_is_better
+
+    return None
+
+
+def summarize(values):
+    """
+    Returns the summary of the values a metric had in several runs - their median and median absolute deviation
+    """
+
+    median = statistics.median(values)
+
+    return {
+        'median': median,
+        'deviation': statistics.median(abs(value - median) for value in values),
+        'runs': len(values),
+    }
+
+
+def measure(sizes, samples, runs, repeat):
+    """
+    Runs the timed benchmarks the given number of times on the workloads of the given sizes,
+    And the counted benchmarks once on the given sample programs
+
+    Returns a dictionary of benchmark/workload/metric -> the summary of its values (see summarize)
+    """
+
+    values = dict()
+
+    for _ in range(runs):
+        for metric, value in flatten(run_suite(TIMED_BENCHMARKS, sizes, repeat)).items():
+            values.setdefault(metric, list()).append(value)
+
+    for metric, value in flatten(run_suite(COUNTED_BENCHMARKS, [], 1, samples)).items():
+        values.setdefault(metric, list()).append(value)
+
+    return { metric: summarize(metric_values) for metric, metric_values in values.items() }
+
+
+def load_history(file_name):
+    """
+    Loads the benchmark history file, or returns an empty history if it doesn't exist
+
+    The history is a dictionary of the format version and the entries - a dictionary of revision (see get_revision)
+    -> the results recorded for it
+    """
+
+    if not os.path.exists(file_name):
+        return { 'version': VERSION, 'entries': dict() }
+
+    with open(file_name, 'r') as file:
+        try:
+            history = json.load(file)
+        except ValueError:
+            raise ValueError(f'{file_name} is not a benchmark history')
+
+    if not isinstance(history, dict) or 'entries' not in history:
+        raise ValueError(f'{file_name} is not a benchmark history')
+
+    if history.get('version') != VERSION:
+        raise ValueError(f'unsupported benchmark history version {history.get("version")}')
+
+    return history
+
+
+def save_history(history, file_name):
+    """
+    Writes the benchmark history file
+    The history is written to a temporary file which then replaces the file, so an interrupted run can't corrupt it
+    """
+
+    temporary_file_name = f'{file_name}.{os.getpid()}.tmp'
+
+    try:
+        with open(temporary_file_name, 'w') as file:
+            json.dump(history, file, indent=1, sort_keys=True)
+
+        os.replace(temporary_file_name, file_name)
+    finally:
+        if os.path.exists(temporary_file_name):
+            os.unlink(temporary_file_name)
+
+
+def find_baseline(history, revision, baseline=None):
+    """
+    Returns the revision in the history to compare the given revision against -
+    The revision starting with the given baseline (a commit hash or its prefix), or if no baseline is given,
+    The most recently recorded revision other than the given one, or None if there is no such revision.
+    Raises a ValueError if the given baseline matches no recorded revision, or several of them
+    """
+
+    entries = history['entries']
+
+    if baseline is not None:
+        matches = [ key for key in entries if key.startswith(baseline) ]
+
+        if not matches:
+            raise ValueError(f'the baseline {baseline} matches no recorded commit')
+
+        if len(matches) > 1:
+            raise ValueError(f'the baseline {baseline} matches several recorded commits')
+
+        return matches[0]
+
+    candidates = [ key for key in entries if key != revision ]
+
+    return max(candidates, key=lambda key: entries[key]['timestamp']) if candidates else None
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, count_threshold=DEFAULT_COUNT_THRESHOLD):
+    """
+    Compares the gated metrics (see GATED_METRICS) of two recorded results
+
+    A metric regressed if its median got worse by more than the threshold (count_threshold for counts), and for
+    Timings, also by more than the spread of the runs (see NOISE_FACTOR)
+
+    Returns a list of (metric, baseline median, current median, relative change, regressed) tuples
+    """
+
+    rows = list()
+
+    for metric, summary in sorted(current['metrics'].items()):
+        higher_is_better = is_gated(metric)
+        old = baseline['metrics'].get(metric)
+
+        if higher_is_better is None or old is None:
+            continue
+
+        old_value, new_value = old['median'], summary['median']
+        change = (new_value - old_value) / old_value if old_value else 0
+        worse = -change if higher_is_better else change
+
+        if is_timing(metric):
+            noise = NOISE_FACTOR * (old['deviation'] + summary['deviation'])
+            regressed = worse > threshold and abs(new_value - old_value) > noise
+        else:
+            regressed = worse > count_threshold
+
+        rows.append((metric, old_value, new_value, change, regressed))
+
+    return rows
+
+
+def find_missing(baseline, current, workloads):
+    """
+    Finds the gated metrics of the baseline that the current results don't have
+
+    Returns a list of (metric, baseline median, failed) tuples - a missing metric fails the gate if its workload
+    (size or sample) is one of the given workloads the current results were measured on, as its benchmark no longer
+    Produces it, while the metrics of workloads that weren't measured are only reported
+    """
+
+    missing = list()
+
+    for metric, summary in sorted(baseline['metrics'].items()):
+        if is_gated(metric) is not None and metric not in current['metrics']:
+            missing.append((metric, summary['median'], metric.split('/')[1] in workloads))
+
+    return missing
+
+
+def format_comparison(rows, baseline_revision, revision, verbose=False, missing=()):
+    """
+    Returns the lines of a readable comparison (as returned by compare) - the regressed metrics first,
+    Then the other metrics that changed (all the gated metrics if verbose), and then the gated metrics of the baseline
+    That are missing (as returned by find_missing, the ones that fail the gate are marked)
+    """
+
+    regressions = [ row for row in rows if row[4] ]
+    others = [ row for row in rows if not row[4] and (verbose or row[3]) ]
+
+    lines = [f'comparing {baseline_revision} -> {revision}']
+
+    for title, section in (('regressions', regressions), ('changes', others)):
+        if not section:
+            continue
+
+        lines.append(f'{title}:')
+
+        for metric, old_value, new_value, change, regressed in section:
+            lines.append(f'  {"!" if regressed else " "} {metric:<45} {old_value:>14.6g} -> {new_value:>14.6g} '
+                         f'({change * 100:+.1f}%)')
+
+    if missing:
+        lines.append('missing:')
+
+        for metric, old_value, failed in missing:
+            lines.append(f'  {"!" if failed else " "} {metric:<45} {old_value:>14.6g} -> {"missing":>14}')
+
+    lines.append(f'{len(regressions)} of {len(rows)} gated metrics regressed, '
+                 f'{sum(1 for _, _, failed in missing if failed)} missing')
+
+    if not rows:
+        lines.append('no gated metric was compared - the baseline and this run have no workloads in common')
+
+    return lines
+
+
+def main():
+    """
+    Runs the gated benchmarks, records the results in the benchmark history and compares them against a baseline
+
+    Returns the exit status - 1 if a gated metric regressed or is missing (see find_missing), or if no gated metric
+    Was compared, and 0 otherwise
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Benchmark the CPQ compiler and fail on regressions')
+    argument_parser.add_argument('--history', default=HISTORY_FILE, help=f'benchmark history file '
+                                                                         f'(default {HISTORY_FILE})')
+    argument_parser.add_argument('--baseline', metavar='COMMIT',
+                                 help='recorded commit to compare against (default: the last recorded one)')
+    argument_parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                                 help=f'number of runs of the timed benchmarks (default {DEFAULT_RUNS})')
+    argument_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                                 help=f'repetitions within every run, the best one being taken '
+                                      f'(default {DEFAULT_REPEAT})')
+    argument_parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=DEFAULT_SIZES)
+    argument_parser.add_argument('--samples', nargs='+', choices=get_samples(), default=get_samples())
+    argument_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                 help=f'tolerated relative timing regression (default {DEFAULT_THRESHOLD})')
+    argument_parser.add_argument('--count-threshold', type=float, default=DEFAULT_COUNT_THRESHOLD,
+                                 help=f'tolerated relative instruction count regression '
+                                      f'(default {DEFAULT_COUNT_THRESHOLD})')
+    argument_parser.add_argument('--no-record', action='store_true',
+                                 help="compare against the baseline without recording the results in the history")
+    argument_parser.add_argument('--verbose', action='store_true', help='list all the gated metrics')
+    arguments = argument_parser.parse_args()
+
+    try:
+        history = load_history(arguments.history)
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    revision = get_revision()
+
+    if revision is None and not arguments.no_record:
+        print('the current commit can not be determined (not in a git repository?), '
+              'results can only be compared using --no-record', file=sys.stderr)
+        return 1
+
+    # The baseline is found (and taken) before running the benchmarks, as it may be an earlier run of the current
+    # Revision, which recording replaces
+    try:
+        baseline_revision = find_baseline(history, revision, arguments.baseline)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    baseline = history['entries'].get(baseline_revision)
+    current = {
+        'commit': revision,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'runs': arguments.runs,
+        'repeat': arguments.repeat,
+        'metrics': measure(arguments.sizes, arguments.samples, arguments.runs, arguments.repeat),
+    }
+
+    if not arguments.no_record:
+        history['entries'][revision] = current
+        save_history(history, arguments.history)
+
+    if baseline is None:
+        print(f'no baseline to compare against, recorded {revision}' if not arguments.no_record else
+              'no baseline to compare against', file=sys.stderr)
+        return 0
+
+    if baseline.get('python') != current['python']:
+        print(f'warning - the baseline ran on python {baseline.get("python")}, and this run on {current["python"]}',
+              file=sys.stderr)
+
+    rows = compare(baseline, current, arguments.threshold, arguments.count_threshold)
+    missing = find_missing(baseline, current, set(arguments.sizes) | set(arguments.samples))
+    print('\n'.join(format_comparison(rows, baseline_revision, revision or 'the current tree', arguments.verbose,
+                                      missing)))
+
+    # Nothing compared is a failure too, as it would pass any change
+    return 1 if not rows or any(row[4] for row in rows) or any(failed for _, _, failed in missing) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+from array import array
+
+# The signature line at the end of the generated QUAD code
+SIGNATURE = 'Efrat Elisha :)'
+
+# All the QUAD opcodes
+# The position of an opcode in this list is its number in linked programs and binary files, so only append to it
+OPCODES = [
+    'IASN', 'IPRT', 'IINP', 'IEQL', 'INQL', 'ILSS', 'IGRT', 'IADD', 'ISUB', 'IMLT', 'IDIV',
+    'RASN', 'RPRT', 'RINP', 'REQL', 'RNQL', 'RLSS', 'RGRT', 'RADD', 'RSUB', 'RMLT', 'RDIV',
+    'ITOR', 'RTOI', 'JUMP', 'JMPZ', 'HALT',
+]
+
+# Dictionary of opcode -> opcode number
+OPCODE_NUMBERS = { opcode: number for number, opcode in enumerate(OPCODES) }
+
+# Opcodes whose first operand is a label
+JUMP_OPCODES = { 'JUMP', 'JMPZ' }
+
+# Opcodes that don't assign their first operand
+NON_ASSIGNING_OPCODES = { 'IPRT', 'RPRT', 'JUMP', 'JMPZ', 'HALT' }
+
+# Opcodes whose first operand is assigned a real number (every other assigning opcode assigns an int)
+REAL_TARGET_OPCODES = { 'RASN', 'RINP', 'RADD', 'RSUB', 'RMLT', 'RDIV', 'ITOR' }
+
+# Opcodes whose operands that are read are real numbers (every other opcode reads ints)
+REAL_SOURCE_OPCODES = { 'RASN', 'RPRT', 'REQL', 'RNQL', 'RLSS', 'RGRT', 'RADD', 'RSUB', 'RMLT', 'RDIV', 'RTOI' }
+
+# Kinds of operands in linked programs
+NO_OPERAND = 0
+SYMBOL = 1
+CONSTANT = 2
+TARGET = 3
+
+# Maximal number of operands of a single instruction
+MAX_OPERANDS = 3
+
+
+class QuadError(Exception):
+    """
+    Raised when QUAD code can not be parsed or linked
+    """
+
+    pass
+
+
+class Instruction():
+    """
+    A single QUAD instruction - an opcode and a list of operands (as they appear in the QUAD code)
+    """
+
+    __slots__ = ('opcode', 'operands')
+
+    def __init__(self, opcode, operands):
+        self.opcode = opcode
+        self.operands = operands
+
+
+    def __str__(self):
+        return ' '.join([self.opcode] + self.operands)
+
+
+    def defined(self):
+        """
+        Returns the symbol the instruction assigns, or None
+        """
+
+        return None if self.opcode in NON_ASSIGNING_OPCODES else self.operands[0]
+
+
+    def used(self):
+        """
+        Returns the list of the symbols the instruction reads
+        """
+
+        if self.opcode in ('JUMP', 'HALT'):
+            return []
+
+        if self.opcode in NON_ASSIGNING_OPCODES:
+            operands = self.operands[1:] if self.opcode == 'JMPZ' else self.operands
+        else:
+            operands = self.operands[1:]
+
+        return [ operand for operand in operands if not is_constant(operand) ]
+
+
+    def replace_used(self, symbol, operand):
+        """
+        Replaces the given symbol with the given operand, wherever the instruction reads it
+        """
+
+        first = 0 if self.opcode in ('IPRT', 'RPRT') else 1
+        self.operands = self.operands[:first] + [ operand if current == symbol else current
+                                                  for current in self.operands[first:] ]
+
+
+    def __repr__(self):
+        return f'Instruction({self})'
+
+
+def is_constant(operand):
+    """
+    Returns True if the given operand is a numeric literal
+    """
+
+    return operand[0].isdigit()
+
+
+def parse_constant(operand):
+    """
+    Returns the value of the given numeric literal (a float if it has a decimal point or an exponent, an int otherwise)
+    """
+
+    return float(operand) if '.' in operand or 'e' in operand else int(operand)
+
+
+def infer_real_symbols(executable):
+    """
+    Returns a list of booleans, one per symbol of the given Executable, which is True if the symbol holds real numbers
+    The compiler only assigns a variable or a temp with instructions of its own type, so the type of a symbol is
+    The type of the instructions that assign it
+    """
+
+    real = [False] * len(executable.symbols)
+
+    for index, number in enumerate(executable.opcodes):
+        if OPCODES[number] in REAL_TARGET_OPCODES:
+            real[executable.operands[0][index]] = True
+
+    return real
+
+
+class Program():
+    """
+    A QUAD program, as a list of instructions and a dictionary of labels
+
+    labels - dictionary of label name -> index of the instruction the label anchors
+    """
+
+    def __init__(self, instructions=None, labels=None):
+        self.instructions = instructions or list()
+        self.labels = labels or dict()
+
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        Parses QUAD code lines (as generated by the compiler) into a Program
+        The signature line and empty lines are skipped
+        """
+
+        program = cls()
+
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+
+            if not line or line == SIGNATURE:
+                continue
+
+            if line.endswith(':'):
+                program.labels[line[:-1]] = len(program.instructions)
+                continue
+
+            opcode, *operands = line.split()
+
+            if opcode not in OPCODE_NUMBERS:
+                raise QuadError(f'unknown opcode {opcode} at line {line_number}')
+
+            program.instructions.append(Instruction(opcode, operands))
+
+        return program
+
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Parses QUAD code text into a Program
+        """
+
+        return cls.from_lines(text.splitlines())
+
+
+    def to_lines(self):
+        """
+        Returns the QUAD code lines of the program, in the same format the compiler generates them
+        """
+
+        labels_at = dict()
+        for label, index in self.labels.items():
+            labels_at.setdefault(index, list()).append(label)
+
+        lines = list()
+
+        for index, instruction in enumerate(self.instructions):
+            lines.extend(f'{label}: ' for label in labels_at.get(index, []))
+            lines.append(str(instruction))
+
+        lines.extend(f'{label}: ' for label in labels_at.get(len(self.instructions), []))
+
+        return lines
+
+
+    def link(self):
+        """
+        Links the program into an Executable - opcodes and operands are numbered,
+        Numeric literals are converted into a constant pool and labels are resolved into instruction indexes
+
+        Returns the Executable
+        """
+
+        executable = Executable()
+        constants = dict()
+        symbols = dict()
+
+        for instruction in self.instructions:
+            kinds = 0
+            indexes = [0] * MAX_OPERANDS
+
+            for position, operand in enumerate(instruction.operands):
+                if position == 0 and instruction.opcode in JUMP_OPCODES:
+                    kind = TARGET
+                    index = self.labels.get(operand)
+
+                    if index is None:
+                        raise QuadError(f'undefined label {operand}')
+                elif is_constant(operand):
+                    kind = CONSTANT
+                    value = parse_constant(operand)
+                    index = constants.setdefault((type(value), value), len(constants))
+                else:
+                    kind = SYMBOL
+                    index = symbols.setdefault(operand, len(symbols))
+
+                kinds |= kind << (2 * position)
+                indexes[position] = index
+
+            executable.opcodes.append(OPCODE_NUMBERS[instruction.opcode])
+            executable.kinds.append(kinds)
+
+            for position in range(MAX_OPERANDS):
+                executable.operands[position].append(indexes[position])
+
+        executable.constants = [ value for _, value in constants ]
+        executable.symbols = list(symbols)
+
+        return executable
+
+
+class Executable():
+    """
+    A linked QUAD program, stored as flat arrays
+
+    opcodes   - array of opcode numbers (see OPCODES)
+    kinds     - array of the kinds of the operands of every instruction, 2 bits per operand (see SYMBOL etc.)
+    operands  - MAX_OPERANDS arrays, the n-th array holds the n-th operand of every instruction:
+                    An index into symbols for SYMBOL operands
+                    An index into constants for CONSTANT operands
+                    The index of the target instruction for TARGET operands
+    constants - list of the values of the numeric literals
+    symbols   - list of the names of the variables and temps
+    """
+
+    def __init__(self):
+        self.opcodes = array('B')
+        self.kinds = array('B')
+        self.operands = [ array('I') for _ in range(MAX_OPERANDS) ]
+        self.constants = list()
+        self.symbols = list()
+
+
+    def __len__(self):
+        return len(self.opcodes)
+
+
+    def decode(self, index):
+        """
+        Returns the opcode and the list of (kind, value) operands of the instruction at the given index
+        The value is a symbol name, a constant value or a target instruction index, based on the kind
+        """
+
+        kinds = self.kinds[index]
+        operands = list()
+
+        for position in range(MAX_OPERANDS):
+            kind = (kinds >> (2 * position)) & 3
+
+            if kind == NO_OPERAND:
+                break
+
+            index_ = self.operands[position][index]
+
+            if kind == SYMBOL:
+                operands.append((kind, self.symbols[index_]))
+            elif kind == CONSTANT:
+                operands.append((kind, self.constants[index_]))
+            else:
+                operands.append((kind, index_))
+
+        return OPCODES[self.opcodes[index]], operands
+
+
+    def to_program(self):
+        """
+        Converts the executable back into a Program, with a label named Lx for every jump target x
+        """
+
+        program = Program()
+
+        for index in range(len(self)):
+            opcode, operands = self.decode(index)
+            texts = list()
+
+            for kind, value in operands:
+                if kind == TARGET:
+                    label = f'L{value}'
+                    program.labels[label] = value
+                    texts.append(label)
+                else:
+                    texts.append(str(value))
+
+            program.instructions.append(Instruction(opcode, texts))
+
+        return program
+
+
+    def equals(self, other):
+        """
+        Returns True if the two executables run the same instructions on the same operands
+        """
+
+        def typed(decoded):
+            opcode, operands = decoded
+            return opcode, [ (kind, type(value), value) for kind, value in operands ]
+
+        return (len(self) == len(other) and
+                all(typed(self.decode(index)) == typed(other.decode(index)) for index in range(len(self))))
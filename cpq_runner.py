@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import argparse
+from time import perf_counter, process_time
+from concurrent.futures import ProcessPoolExecutor
+from cpq_vm import Machine, VMError, ClosureCompiler, interpret, format_real, load_executable
+
+# Suffix of the input stream files searched for in input directories
+INPUT_SUFFIX = '.in'
+
+# Suffix of the files holding the outputs of a run (written to the output directory)
+OUTPUT_SUFFIX = '.out'
+
+# Suffix of the files holding the expected outputs of a run (next to its input file)
+EXPECTED_SUFFIX = '.expected'
+
+# Number of runs sent to a worker at once
+CHUNK_SIZE = 4
+
+# The program of the current worker process, loaded once by load_worker
+_run = None
+
+
+class StreamingMachine(Machine):
+    """
+    A Machine which writes the outputs of the program straight to a file, instead of keeping them in memory
+    """
+
+    def __init__(self, inputs, file):
+        super().__init__(inputs)
+        self.file = file
+        self.written = 0
+
+
+    def write_int(self, value):
+        self.file.write(f'{value}\n')
+        self.written += 1
+
+
+    def write_real(self, value):
+        self.file.write(f'{format_real(float(value))}\n')
+        self.written += 1
+
+
+def load_worker(program_file_name, engine):
+    """
+    Initializes a worker process - loads the program and decodes it (for the given engine) once,
+    So every run in the worker starts executing right away
+    """
+
+    global _run
+
+    executable = load_executable(program_file_name)
+
+    if engine == 'closure':
+        _run = ClosureCompiler(executable).compile()
+    else:
+        _run = lambda machine: interpret(executable, machine)
+
+
+def same_lines(first_file_name, second_file_name):
+    """
+    Returns True if the two files hold the same lines (ignoring trailing whitespace), reading them line by line
+    """
+
+    with open(first_file_name, 'r') as first, open(second_file_name, 'r') as second:
+        for first_line, second_line in zip(first, second):
+            if first_line.rstrip() != second_line.rstrip():
+                return False
+
+        # Both files have to end together
+        return first.readline() == '' and second.readline() == ''
+
+
+def run_input(input_file_name, output_file_name):
+    """
+    Runs the program of the worker on a single input file, writing its outputs to the given output file
+    A run passes if the program ended without a runtime error, and its outputs match the expected outputs file
+    (if there is one next to the input file)
+
+    Returns a summary dictionary of the run
+    """
+
+    expected_file_name = os.path.splitext(input_file_name)[0] + EXPECTED_SUFFIX
+
+    # An input file that can't be read fails its own run, instead of the whole batch
+    try:
+        with open(input_file_name, 'r') as file:
+            inputs = file.read().split()
+    except (OSError, UnicodeDecodeError) as read_error:
+        return {
+            'input': input_file_name,
+            'output': None,
+            'passed': False,
+            'error': f"can't read the input file ({read_error})",
+            'outputs': 0,
+            'seconds': 0.0,
+            'cpu_seconds': 0.0,
+        }
+
+    error = None
+    start = perf_counter()
+    cpu_start = process_time()
+
+    with open(output_file_name, 'w') as file:
+        machine = StreamingMachine(inputs, file)
+
+        try:
+            _run(machine)
+        except VMError as vm_error:
+            error = f'runtime error - {vm_error}'
+
+    seconds = perf_counter() - start
+    cpu_seconds = process_time() - cpu_start
+
+    if error is None and os.path.exists(expected_file_name) and not same_lines(output_file_name, expected_file_name):
+        error = f'outputs differ from {expected_file_name}'
+
+    return {
+        'input': input_file_name,
+        'output': output_file_name,
+        'passed': error is None,
+        'error': error,
+        'outputs': machine.written,
+        'seconds': seconds,
+        'cpu_seconds': cpu_seconds,
+    }
+
+
+def find_inputs(paths):
+    """
+    Finds the input files in the given paths (input files, or directories searched recursively)
+
+    Returns the sorted list of the input files, and the list of their output names - the path of every input file
+    Relative to the directory it was found in (or its base name, for input files given directly), without its suffix
+    """
+
+    inputs = list()
+
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, file_names in os.walk(path):
+                for file_name in file_names:
+                    if file_name.endswith(INPUT_SUFFIX):
+                        input_file_name = os.path.join(directory, file_name)
+                        inputs.append((input_file_name, os.path.relpath(input_file_name, path)))
+        else:
+            inputs.append((path, os.path.basename(path)))
+
+    inputs.sort()
+
+    return [ input_file_name for input_file_name, _ in inputs ], \
+           [ os.path.splitext(output_name)[0] for _, output_name in inputs ]
+
+
+def get_output_file_names(input_file_names, output_directory, output_names=None):
+    """
+    Returns the output file of every input file in the output directory, by the output names of the input files
+    (see find_inputs, the base names of the input files by default)
+    Raises a ValueError if several input files have the same output file
+    """
+
+    if output_names is None:
+        output_names = [ os.path.splitext(os.path.basename(file_name))[0] for file_name in input_file_names ]
+
+    output_file_names = list()
+    inputs = dict()
+
+    for input_file_name, output_name in zip(input_file_names, output_names):
+        output_file_name = os.path.join(output_directory, output_name + OUTPUT_SUFFIX)
+        key = os.path.normcase(os.path.normpath(output_file_name))
+
+        if key in inputs:
+            raise ValueError(f'{inputs[key]} and {input_file_name} would both write their outputs to '
+                             f'{output_file_name}')
+
+        inputs[key] = input_file_name
+        output_file_names.append(output_file_name)
+
+    return output_file_names
+
+
+def run_batch(program_file_name, input_file_names, output_directory, workers=None, engine='closure', report=None,
+              output_names=None):
+    """
+    Runs the given compiled program on every one of the given input files, across a pool of worker processes
+    The outputs of every run are written to a file in the output directory, only the summaries are sent back
+
+    report       - optional function called with the summary of every run, as soon as it is done
+    output_names - optional output name of every input file (see find_inputs), its base name by default
+                   The outputs of every run are written to its output name (with the OUTPUT_SUFFIX) in the output
+                   Directory, and a ValueError is raised if several input files have the same output name
+
+    Returns a summary dictionary of the whole batch
+    """
+
+    output_file_names = get_output_file_names(input_file_names, output_directory, output_names)
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    for directory in { os.path.dirname(output_file_name) for output_file_name in output_file_names }:
+        os.makedirs(directory, exist_ok=True)
+
+    workers = workers or os.cpu_count()
+    runs = list()
+    start = perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_worker,
+                             initargs=(program_file_name, engine)) as pool:
+        for run in pool.map(run_input, input_file_names, output_file_names, chunksize=CHUNK_SIZE):
+            runs.append({ key: run[key] for key in ('input', 'passed', 'error', 'seconds', 'cpu_seconds') })
+
+            if report is not None:
+                report(run)
+
+    wall_seconds = perf_counter() - start
+    times = sorted(run['seconds'] for run in runs)
+
+    return {
+        'program': program_file_name,
+        'workers': workers,
+        'runs': len(runs),
+        'passed': sum(1 for run in runs if run['passed']),
+        'failed': [ { 'input': run['input'], 'error': run['error'] } for run in runs if not run['passed'] ],
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': sum(run['cpu_seconds'] for run in runs),
+        'p50_ms': times[len(times) // 2] * 1e3 if times else 0.0,
+        'max_ms': times[-1] * 1e3 if times else 0.0,
+        'runs_per_second': len(runs) / wall_seconds if wall_seconds else 0.0,
+    }
+
+
+def main():
+    """
+    Runs a compiled program on many input files in parallel, and summarizes the results
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Run a compiled QUAD program on many input files '
+                                                          'in parallel')
+    argument_parser.add_argument('program', help='compiled program (.qud or .qbin)')
+    argument_parser.add_argument('inputs', nargs='+', help=f'input files, or directories of {INPUT_SUFFIX} files')
+    argument_parser.add_argument('--output-directory', default='outputs',
+                                 help=f'directory to write the {OUTPUT_SUFFIX} file of every run to')
+    argument_parser.add_argument('--workers', type=int, help='number of worker processes (default: number of cores)')
+    argument_parser.add_argument('--engine', choices=['closure', 'interpret'], default='closure')
+    argument_parser.add_argument('--summary', help='JSON file to write the summary to')
+    argument_parser.add_argument('--verbose', action='store_true', help='print the result of every run')
+    arguments = argument_parser.parse_args()
+
+    input_file_names, output_names = find_inputs(arguments.inputs)
+
+    def report(run):
+        if arguments.verbose or not run['passed']:
+            print(f'{"PASS" if run["passed"] else "FAIL"} {run["input"]} ({run["seconds"] * 1e3:.1f} ms)'
+                  + (f' - {run["error"]}' if run['error'] else ''), flush=True)
+
+    try:
+        summary = run_batch(arguments.program, input_file_names, arguments.output_directory, arguments.workers,
+                            arguments.engine, report, output_names)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    print(f'{summary["passed"]}/{summary["runs"]} runs passed in {summary["wall_seconds"]:.2f} s '
+          f'({summary["runs_per_second"]:.1f} runs/s on {summary["workers"]} workers, '
+          f'p50 {summary["p50_ms"]:.1f} ms, max {summary["max_ms"]:.1f} ms)')
+
+    if arguments.summary:
+        with open(arguments.summary, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+    return 0 if summary['passed'] == summary['runs'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import signal
+import socket
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from cpq_compiler import compile_source
+
+# Default address of the compile server
+DEFAULT_ADDRESS = '127.0.0.1:7364'
+
+# Maximal size of a single request line (the source code is sent inside the request)
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+# A tiny program compiled by every worker when it starts, so its compiler is warm before the first request
+WARM_UP_SOURCE = 'a: int; { a = 1; output(a); }'
+
+
+def parse_address(address):
+    """
+    Parses an address of the form unix:/path/to/socket, host:port or port
+
+    Returns a tuple of (socket path, None, None) for unix sockets or (None, host, port) for TCP sockets
+    """
+
+    if address.startswith('unix:'):
+        return address[len('unix:'):], None, None
+
+    host, _, port = address.rpartition(':')
+    return None, host or '127.0.0.1', int(port)
+
+
+def warm_up_worker():
+    """
+    Initializer of the worker processes - imports and warms up the compiler
+    """
+
+    compile_source(WARM_UP_SOURCE)
+
+
+def compile_request(request):
+    """
+    Handles a single compile request (running in a worker process)
+
+    The request is a dictionary holding either the source code ('source') or a path of a file to compile ('path'),
+    And optionally the 'check', 'max_errors', 'optimize', 'fast_math' and 'costs' options of compile_source.
+
+    Returns the response dictionary
+    """
+
+    source = request.get('source')
+
+    if source is None:
+        try:
+            with open(request['path'], 'r') as file:
+                source = file.read()
+        except (KeyError, OSError) as error:
+            return {'error': f"can't read the input file ({error})"}
+
+    result = compile_source(source, check=request.get('check', False), max_errors=request.get('max_errors'),
+                            optimize=request.get('optimize', 0), fast_math=request.get('fast_math', False),
+                            costs=request.get('costs'))
+
+    return {
+        'instructions': result.instructions,
+        'diagnostics': result.diagnostics,
+        'statistics': result.statistics,
+        'aborted': result.aborted,
+        'source_lines': result.source_lines,
+    }
+
+
+class CompileServer():
+    """
+    A long running compile server
+
+    An asyncio front end accepts connections on a unix socket or a TCP port.
+    Every line sent over a connection is a JSON compile request, which is dispatched to a pool of warm worker
+    processes, and answered with a single line JSON response (see compile_request).
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, workers=None):
+        self.address = address
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+        self.requests = 0
+
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers the compile requests of a single connection, until it is closed
+        """
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    response = {'error': f'bad request ({error})'}
+                else:
+                    try:
+                        response = await loop.run_in_executor(self.pool, compile_request, request)
+                    except Exception as error:
+                        response = {'error': f'internal compiler error ({error!r})'}
+
+                self.requests += 1
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def serve(self):
+        """
+        Starts the worker pool and serves requests forever
+        """
+
+        path, host, port = parse_address(self.address)
+
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_worker)
+
+        # Start all the workers in advance, so the first requests don't pay for the warm up
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[ loop.run_in_executor(self.pool, compile_request, {'source': WARM_UP_SOURCE})
+                                for _ in range(self.workers) ])
+
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(self.handle_connection, path, limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_SIZE)
+
+        print(f'cpq server listening on {self.address} with {self.workers} workers', file=sys.stderr, flush=True)
+
+        # Stop serving gracefully on SIGINT and SIGTERM, where signal handlers are supported
+        serving = asyncio.ensure_future(server.serve_forever())
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, serving.cancel)
+            except NotImplementedError:
+                pass
+
+        try:
+            async with server:
+                await serving
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+
+class CompileClient():
+    """
+    A thin client of the compile server, which keeps its connection open between requests
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        path, host, port = parse_address(address)
+
+        if path:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port), timeout=timeout)
+
+        self.file = self.socket.makefile('rwb')
+
+
+    def compile(self, source=None, path=None, **options):
+        """
+        Sends a compile request of the given source code (or file path) and options
+
+        Returns the response dictionary (see compile_request)
+        """
+
+        request = dict(options)
+
+        if source is not None:
+            request['source'] = source
+        else:
+            request['path'] = os.path.abspath(path)
+
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+
+        line = self.file.readline()
+
+        if not line:
+            raise ConnectionError('the compile server closed the connection')
+
+        return json.loads(line)
+
+
+    def close(self):
+        """
+        Closes the connection to the compile server
+        """
+
+        self.file.close()
+        self.socket.close()
+
+
+def main():
+    """
+    Runs the compile server
+    """
+
+    argument_parser = argparse.ArgumentParser(description='CPL to QUAD compile server')
+    argument_parser.add_argument('--listen', default=DEFAULT_ADDRESS,
+                                 help=f'unix:/path/to/socket, host:port or port (default {DEFAULT_ADDRESS})')
+    argument_parser.add_argument('--workers', type=int, help='number of worker processes (default: cpu count)')
+    arguments = argument_parser.parse_args()
+
+    try:
+        asyncio.run(CompileServer(arguments.listen, arguments.workers).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
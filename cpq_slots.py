@@ -0,0 +1,223 @@
+import sys
+import json
+import argparse
+from cpq_compiler import compile_source
+from cpq_quad import Program, Instruction, QuadError, REAL_TARGET_OPCODES, REAL_SOURCE_OPCODES
+from cpq_cfg import FlowGraph
+from cpq_optimizer import LEVELS
+
+# Suffix of slot layout files, written next to the QUAD files
+SLOTS_SUFFIX = '.qslt'
+
+# Version of the slot layout format
+VERSION = 1
+
+# Types of the slots - every type has its own dense numbering, so an executor can keep a flat array per type
+INT_SLOT = 'int'
+REAL_SLOT = 'real'
+
+
+def symbol_types(program):
+    """
+    Returns a dictionary of every symbol of the given Program -> the type of its slot
+    A symbol is real if it is assigned or read by instructions of the real type, so a float variable which is only
+    Read (and always holds 0) gets a real slot as well, where the instructions reading it look for it
+    """
+
+    types = dict()
+
+    for instruction in program.instructions:
+        for symbol in instruction.used():
+            if instruction.opcode in REAL_SOURCE_OPCODES:
+                types[symbol] = REAL_SLOT
+            else:
+                types.setdefault(symbol, INT_SLOT)
+
+        symbol = instruction.defined()
+
+        if symbol is not None:
+            if instruction.opcode in REAL_TARGET_OPCODES:
+                types[symbol] = REAL_SLOT
+            else:
+                types.setdefault(symbol, INT_SLOT)
+
+    return types
+
+
+def interference(program):
+    """
+    Builds the interference graph of the symbols of the given Program - two symbols interfere if one of them is
+    Assigned while the other is live, so they can't share a slot
+    A symbol read before it is ever assigned is live from the start of the program, so it interferes with everything
+    Assigned before that read, and keeps reading 0 from its slot
+
+    Returns a dictionary of symbol -> the set of the symbols it interferes with
+    """
+
+    graph = FlowGraph.from_program(program)
+    live_out = graph.liveness()
+    edges = dict()
+
+    for number, block in enumerate(graph.blocks):
+        live = set(live_out[number])
+
+        # Walk the block backwards, keeping the symbols live after every instruction
+        for instruction in reversed(block.instructions):
+            symbol = instruction.defined()
+
+            if symbol is not None:
+                live.discard(symbol)
+                edges.setdefault(symbol, set()).update(live)
+
+                for other in live:
+                    edges.setdefault(other, set()).add(symbol)
+
+            live.update(instruction.used())
+
+    return edges
+
+
+class SlotLayout():
+    """
+    Assigns every variable and temp of a program a dense slot number of its type, so an executor can keep the
+    Values in a flat array per type and access them by index instead of by name
+
+    slots  - dictionary of symbol -> (type, slot number)
+    counts - dictionary of type -> the number of slots of that type
+    """
+
+    def __init__(self, slots=None, counts=None):
+        self.slots = slots or dict()
+        self.counts = counts or { INT_SLOT: 0, REAL_SLOT: 0 }
+
+
+    @classmethod
+    def from_program(cls, program):
+        """
+        Creates the slot layout of the given Program
+        Symbols whose live ranges don't overlap share a slot (see interference), the symbols being given the lowest
+        Slot of their type that no interfering symbol holds, by order of their first appearance in the program
+        """
+
+        types = symbol_types(program)
+        edges = interference(program)
+        slots = dict()
+        counts = { INT_SLOT: 0, REAL_SLOT: 0 }
+
+        # The symbols given a slot so far, by type
+        assigned = { INT_SLOT: set(), REAL_SLOT: set() }
+
+        for symbol, type_ in types.items():
+            taken = { slots[other][1] for other in edges.get(symbol, set()) & assigned[type_] }
+            slot = 0
+
+            while slot in taken:
+                slot += 1
+
+            slots[symbol] = (type_, slot)
+            assigned[type_].add(symbol)
+            counts[type_] = max(counts[type_], slot + 1)
+
+        return cls(slots, counts)
+
+
+    def rename(self, program):
+        """
+        Returns a copy of the given Program, where every symbol is replaced with the name of its slot
+        (_iN for int slot N and _rN for real slot N), such as an executor working on the slots would run it
+        """
+
+        names = { symbol: f'_{type_[0]}{slot}' for symbol, (type_, slot) in self.slots.items() }
+        instructions = list()
+
+        for instruction in program.instructions:
+            operands = list(instruction.operands)
+            first = 1 if instruction.opcode in ('JUMP', 'JMPZ') else 0
+
+            for position in range(first, len(operands)):
+                operands[position] = names.get(operands[position], operands[position])
+
+            instructions.append(Instruction(instruction.opcode, operands))
+
+        return Program(instructions, dict(program.labels))
+
+
+    def dumps(self):
+        """
+        Returns the slot layout as JSON text
+        """
+
+        return json.dumps({'version': VERSION, 'counts': self.counts,
+                           'slots': { symbol: list(slot) for symbol, slot in self.slots.items() }})
+
+
+    @classmethod
+    def loads(cls, text):
+        """
+        Loads a slot layout from JSON text
+        """
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            raise QuadError('not a slot layout')
+
+        if not isinstance(data, dict) or 'slots' not in data or 'counts' not in data:
+            raise QuadError('not a slot layout')
+
+        if data.get('version') != VERSION:
+            raise QuadError(f'unsupported slot layout version {data.get("version")}')
+
+        return cls({ symbol: tuple(slot) for symbol, slot in data['slots'].items() }, data['counts'])
+
+
+    def write_file(self, file_name):
+        """
+        Writes the slot layout to the given file
+        """
+
+        with open(file_name, 'w') as file:
+            file.write(self.dumps())
+
+
+    @classmethod
+    def load_file(cls, file_name):
+        """
+        Loads a slot layout file
+        """
+
+        with open(file_name, 'r') as file:
+            return cls.loads(file.read())
+
+
+def main():
+    """
+    Compiles a CPL program and prints the slot of every variable and temp
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Print the slot layout of a CPL program')
+    argument_parser.add_argument('input_file', metavar='input-file.ou')
+    argument_parser.add_argument('-O', '--optimize', type=int, choices=sorted(LEVELS), default=0, metavar='LEVEL',
+                                 help=f'optimization level of the generated code (0 - {max(LEVELS)}, default 0)')
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.input_file, 'r') as file:
+        result = compile_source(file.read(), optimize=arguments.optimize)
+
+    if not result.succeeded:
+        print(f'{arguments.input_file} has compilation errors', file=sys.stderr)
+        return 1
+
+    layout = SlotLayout.from_program(Program.from_lines(result.instructions))
+
+    for symbol, (type_, slot) in layout.slots.items():
+        print(f'{symbol:<12} {type_:<5} {slot}')
+
+    print(f'{len(layout.slots)} symbols in {layout.counts[INT_SLOT]} int slots '
+          f'and {layout.counts[REAL_SLOT]} real slots')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import sys
+import json
+import argparse
+from cpq_compiler import compile_source
+from cpq_quad import Program, QuadError, SIGNATURE
+from cpq_vm import Machine, VMError, interpret
+
+# Suffix of source map files, written next to the QUAD files
+SOURCE_MAP_SUFFIX = '.qmap'
+
+# Version of the source map format
+VERSION = 1
+
+
+class SourceMap():
+    """
+    Maps the instructions of a compiled program back to the lines of its CPL source
+
+    lines  - list of the source line number of every instruction, by its index in the linked program (labels excluded),
+             None for instructions that can't be attributed to a line
+    source - name of the source file, or None
+    """
+
+    def __init__(self, lines=None, source=None):
+        self.lines = lines or list()
+        self.source = source
+
+
+    @classmethod
+    def from_code(cls, quad_code, source_lines, source=None):
+        """
+        Creates the source map of the given QUAD code lines, given the source line number of every code line
+        (as the source_lines of a CompileResult)
+        Labels are skipped the same way Program.from_lines skips them, so the map is indexed like the linked program
+        """
+
+        lines = list()
+
+        for code, line in zip(quad_code, source_lines):
+            code = code.strip()
+
+            if code and code != SIGNATURE and not code.endswith(':'):
+                lines.append(line)
+
+        return cls(lines, source)
+
+
+    def dumps(self):
+        """
+        Returns the source map as JSON text
+        """
+
+        return json.dumps({'version': VERSION, 'source': self.source, 'lines': self.lines})
+
+
+    @classmethod
+    def loads(cls, text):
+        """
+        Loads a source map from JSON text
+        """
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            raise QuadError('not a source map')
+
+        if not isinstance(data, dict) or 'lines' not in data:
+            raise QuadError('not a source map')
+
+        if data.get('version') != VERSION:
+            raise QuadError(f'unsupported source map version {data.get("version")}')
+
+        return cls(data['lines'], data.get('source'))
+
+
+    def write_file(self, file_name):
+        """
+        Writes the source map to the given file
+        """
+
+        with open(file_name, 'w') as file:
+            file.write(self.dumps())
+
+
+    @classmethod
+    def load_file(cls, file_name):
+        """
+        Loads a source map file
+        """
+
+        with open(file_name, 'r') as file:
+            return cls.loads(file.read())
+
+
+    def line_costs(self, counters):
+        """
+        Gets a list of counters per instruction (such as the execution counts interpret collects)
+
+        Returns a dictionary of source line number -> the sum of the counters of the instructions of that line
+        """
+
+        costs = dict()
+
+        for line, count in zip(self.lines, counters):
+            if line is not None and count:
+                costs[line] = costs.get(line, 0) + count
+
+        return costs
+
+
+def annotate(source, costs):
+    """
+    Returns the lines of the given source code, each one prefixed with its cost (as returned by line_costs)
+    And the percentage of the total cost it amounts to
+    """
+
+    total = sum(costs.values()) or 1
+    annotated = list()
+
+    for line_number, line in enumerate(source.splitlines(), 1):
+        cost = costs.get(line_number)
+
+        if cost:
+            annotated.append(f'{cost:>12} {100 * cost / total:6.2f}% | {line_number:>4} | {line}')
+        else:
+            annotated.append(f'{"":>20} | {line_number:>4} | {line}')
+
+    return annotated
+
+
+def count_instructions(executable, inputs):
+    """
+    Runs the given Executable on the given input tokens, counting the executions of every instruction
+
+    Returns the list of counters, the Machine the program ran on and the VMError that stopped it (or None)
+    """
+
+    counters = [0] * len(executable)
+    machine = Machine(inputs)
+
+    try:
+        interpret(executable, machine, counters)
+    except VMError as error:
+        return counters, machine, error
+
+    return counters, machine, None
+
+
+def main():
+    """
+    Compiles a CPL program, runs it and prints its source annotated with the instructions executed per line
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Print a CPL program annotated with its execution cost')
+    argument_parser.add_argument('input_file', metavar='input-file.ou')
+    argument_parser.add_argument('--input', help='file to read the program input from (default: stdin)')
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.input_file, 'r') as file:
+        source = file.read()
+
+    result = compile_source(source)
+
+    if not result.succeeded:
+        print(f'{arguments.input_file} has compilation errors', file=sys.stderr)
+        return 1
+
+    if arguments.input:
+        with open(arguments.input, 'r') as file:
+            inputs = file.read().split()
+    else:
+        inputs = sys.stdin.read().split()
+
+    source_map = SourceMap.from_code(result.instructions, result.source_lines, arguments.input_file)
+    counters, _, error = count_instructions(Program.from_lines(result.instructions).link(), inputs)
+
+    print('\n'.join(annotate(source, source_map.line_costs(counters))))
+
+    if error is not None:
+        print(f'runtime error - {error}', file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,595 @@
+import operator
+from cpq_quad import Instruction, REAL_TARGET_OPCODES, is_constant, parse_constant
+from cpq_cfg import Block, FlowGraph
+from cpq_vm import VMError, int_division, real_division
+
+# Separates a variable from its version number in the names of the SSA form (QUAD symbols never contain it)
+VERSION_SEPARATOR = '.'
+
+# The lattice values of constant propagation besides the constants themselves -
+# A value no executed definition reached yet, and a value which isn't a constant
+UNKNOWN = object()
+VARYING = object()
+
+# Python functions of the operations with two operands (the division is handled on its own, as it may fail)
+OPERATIONS = {
+    'ADD': operator.add,
+    'SUB': operator.sub,
+    'MLT': operator.mul,
+    'EQL': lambda first, second: 1 if first == second else 0,
+    'NQL': lambda first, second: 1 if first != second else 0,
+    'LSS': lambda first, second: 1 if first < second else 0,
+    'GRT': lambda first, second: 1 if first > second else 0,
+}
+
+
+def is_same(first, second):
+    """
+    Returns True if the given lattice values are the same (constants of the same type and value)
+    """
+
+    if first is UNKNOWN or first is VARYING or second is UNKNOWN or second is VARYING:
+        return first is second
+
+    return type(first) is type(second) and repr(first) == repr(second)
+
+
+def meet(first, second):
+    """
+    Returns the lattice value of a variable that holds either of the given values
+    """
+
+    if first is UNKNOWN:
+        return second
+    if second is UNKNOWN:
+        return first
+
+    return first if is_same(first, second) else VARYING
+
+
+def evaluate(opcode, values):
+    """
+    Computes the value an instruction assigns given the lattice values of the operands it reads,
+    The same way the VM does (see cpq_vm.interpret)
+
+    Returns the lattice value - VARYING for inputs, and for operations which fail (they are left to fail at runtime)
+    """
+
+    if opcode in ('IINP', 'RINP') or any(value is VARYING for value in values):
+        return VARYING
+
+    if any(value is UNKNOWN for value in values):
+        return UNKNOWN
+
+    operation = opcode[1:]
+
+    try:
+        if operation == 'ASN':
+            return values[0]
+        if opcode == 'ITOR':
+            return float(values[0])
+        if opcode == 'RTOI':
+            return int(values[0])
+        if operation == 'DIV':
+            return (int_division if opcode[0] == 'I' else real_division)(*values)
+        return OPERATIONS[operation](*values)
+    except (VMError, OverflowError, ValueError):
+        return VARYING
+
+
+def literal(value):
+    """
+    Returns the QUAD literal of the given constant, or None if it has none - negative numbers, infinities and nans,
+    And ints beyond 64 bit (which the C backend can't hold)
+    """
+
+    if isinstance(value, float):
+        text = repr(value)
+        return text if text[0].isdigit() else None
+
+    return str(value) if 0 <= value < 1 << 63 else None
+
+
+class Phi():
+    """
+    A phi function of the SSA form - selects the version of a variable by the block the control came from
+
+    variable - the variable the phi merges the versions of
+    target   - the version the phi assigns
+    operands - dictionary of predecessor block number -> the version reaching from that block
+               (None stands for the start of the program, for the phis of the entry)
+    """
+
+    def __init__(self, variable):
+        self.variable = variable
+        self.target = None
+        self.operands = dict()
+
+
+class SSAForm():
+    """
+    The static single assignment form of a FlowGraph (as built by Cytron et al.)
+    Every variable is split into versions, named variable.n and assigned once, and phi functions at the dominance
+    Frontiers of the assignments merge the versions reaching a block. Version 0 of a variable is the value it starts
+    With (0). Phis are only placed for the variables some block reads before assigning (semi-pruned SSA), which
+    Leaves out the temps of the compiler, so their number follows the variables that live across blocks.
+
+    The transformations done on the form never make the versions of a variable overlap (they only replace reads with
+    Constants and drop code), so coming out of SSA maps every version back to its variable and drops the phis.
+
+    graph     - the FlowGraph the form was built from (its blocks are left as they are)
+    blocks    - list with the instructions of every block, reading and assigning versions (None if unreachable)
+    phis      - list with the list of the Phis at the start of every block
+    variables - dictionary of version -> the variable it is a version of
+    initial   - set of the versions holding the values the variables start with
+    counts    - dictionary of variable -> the number of versions assigned
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.dominators = graph.dominators()
+        self.blocks = [ [ Instruction(instruction.opcode, list(instruction.operands))
+                          for instruction in block.instructions ] if self.dominators[number] is not None else None
+                        for number, block in enumerate(graph.blocks) ]
+        self.phis = [ list() for _ in graph.blocks ]
+        self.variables = dict()
+        self.initial = set()
+        self.counts = dict()
+
+        self.place_phis()
+        self.rename()
+
+
+    def place_phis(self):
+        """
+        Places a phi for every variable at the iterated dominance frontier of the blocks assigning it,
+        For the variables read in some block before being assigned in it
+        """
+
+        frontiers = self.graph.dominance_frontiers(self.dominators)
+        assigned = dict()
+        read_across = set()
+
+        for number, instructions in enumerate(self.blocks):
+            if instructions is None:
+                continue
+
+            defined = set()
+
+            for instruction in instructions:
+                read_across.update(symbol for symbol in instruction.used() if symbol not in defined)
+                symbol = instruction.defined()
+
+                if symbol is not None:
+                    defined.add(symbol)
+                    assigned.setdefault(symbol, set()).add(number)
+
+        for variable in sorted(read_across):
+            queued = set(assigned.get(variable, ()))
+            worklist = list(queued)
+            placed = set()
+
+            while worklist:
+                for frontier in frontiers[worklist.pop()]:
+                    if frontier in placed:
+                        continue
+
+                    placed.add(frontier)
+                    self.phis[frontier].append(Phi(variable))
+
+                    if frontier not in queued:
+                        queued.add(frontier)
+                        worklist.append(frontier)
+
+
+    def version(self, variable, number):
+        """
+        Returns the name of the given version of the given variable
+        """
+
+        name = f'{variable}{VERSION_SEPARATOR}{number}'
+        self.variables[name] = variable
+
+        if number == 0:
+            self.initial.add(name)
+
+        return name
+
+
+    def rename(self):
+        """
+        Renames the variables into their versions, walking the dominator tree from the entry
+        Every read gets the version of the closest assignment dominating it
+        """
+
+        if self.dominators[0] is None:
+            return
+
+        children = [ list() for _ in self.blocks ]
+        for number, dominator in enumerate(self.dominators):
+            if dominator is not None and dominator != number:
+                children[dominator].append(number)
+
+        stacks = dict()
+
+        def current(variable):
+            stack = stacks.get(variable)
+            return stack[-1] if stack else self.version(variable, 0)
+
+        def assign(variable):
+            self.counts[variable] = self.counts.get(variable, 0) + 1
+            name = self.version(variable, self.counts[variable])
+            stacks.setdefault(variable, list()).append(name)
+            return name
+
+        for phi in self.phis[0]:
+            phi.operands[None] = current(phi.variable)
+
+        # Iterative walk, as programs may be too deep for recursion - a block is pushed again to pop its versions
+        work = [(0, None)]
+
+        while work:
+            number, assigned = work.pop()
+
+            if assigned is not None:
+                for variable in assigned:
+                    stacks[variable].pop()
+                continue
+
+            assigned = list()
+
+            for phi in self.phis[number]:
+                phi.target = assign(phi.variable)
+                assigned.append(phi.variable)
+
+            for instruction in self.blocks[number]:
+                for symbol in set(instruction.used()):
+                    instruction.replace_used(symbol, current(symbol))
+
+                symbol = instruction.defined()
+
+                if symbol is not None:
+                    instruction.operands[0] = assign(symbol)
+                    assigned.append(symbol)
+
+            for successor in self.graph.blocks[number].successors:
+                for phi in self.phis[successor]:
+                    phi.operands[number] = current(phi.variable)
+
+            work.append((number, assigned))
+            work.extend((child, None) for child in children[number])
+
+
+    def to_program(self):
+        """
+        Comes out of SSA - maps every version back to its variable and drops the phis and the unreachable blocks
+
+        Returns the Program
+        """
+
+        blocks = list()
+
+        for block, instructions in zip(self.graph.blocks, self.blocks):
+            if instructions is None:
+                continue
+
+            blocks.append(Block(list(block.labels), [ Instruction(instruction.opcode, [
+                self.variables.get(operand, operand) for operand in instruction.operands ])
+                for instruction in instructions ]))
+
+        return FlowGraph(blocks).to_program()
+
+
+class ConstantPropagation():
+    """
+    Sparse conditional constant propagation over an SSAForm (as done by Wegman and Zadeck)
+    Only the blocks reached by an edge found executable are evaluated, and a conditional jump on a constant only
+    Makes the edge it takes executable, so the assignments in branches that never run don't reach the phis after
+    Them - finding constants (and unreachable code) that propagation along every edge misses.
+    Every version gets a lattice value, and a version is only evaluated again when a value it reads changes,
+    So the work follows the reads of the program instead of the blocks times the variables.
+
+    values     - dictionary of version -> its lattice value (see UNKNOWN and VARYING)
+    executable - set of the numbers of the blocks found reachable
+    """
+
+    def __init__(self, form):
+        self.form = form
+        self.values = { version: 0 for version in form.initial }
+        self.executable = set()
+        self.edges = set()
+        self.uses = dict()
+
+        for number, instructions in enumerate(form.blocks):
+            if instructions is None:
+                continue
+
+            for phi in form.phis[number]:
+                for operand in phi.operands.values():
+                    self.uses.setdefault(operand, list()).append((number, phi))
+
+            for index, instruction in enumerate(instructions):
+                for symbol in set(instruction.used()):
+                    self.uses.setdefault(symbol, list()).append((number, index))
+
+
+    def value(self, operand):
+        """
+        Returns the lattice value of the given operand (a version or a literal)
+        """
+
+        if is_constant(operand):
+            return parse_constant(operand)
+
+        return self.values.get(operand, UNKNOWN)
+
+
+    def run(self):
+        """
+        Propagates the values from the entry, until no value and no executable edge changes
+        """
+
+        blocks = self.form.blocks
+        flow = [(None, 0)]
+        changed = list()
+
+        while flow or changed:
+            while flow:
+                edge = flow.pop()
+
+                if edge in self.edges:
+                    continue
+
+                self.edges.add(edge)
+                number = edge[1]
+
+                for phi in self.form.phis[number]:
+                    self.visit_phi(number, phi, changed)
+
+                if number not in self.executable:
+                    self.executable.add(number)
+
+                    for index in range(len(blocks[number])):
+                        self.visit(number, index, changed, flow)
+
+                    if self.form.graph.blocks[number].terminator() is None and number + 1 < len(blocks):
+                        flow.append((number, number + 1))
+
+            while changed and not flow:
+                for number, use in self.uses.get(changed.pop(), ()):
+                    if number not in self.executable:
+                        continue
+
+                    if isinstance(use, Phi):
+                        self.visit_phi(number, use, changed)
+                    else:
+                        self.visit(number, use, changed, flow)
+
+
+    def update(self, version, value, changed):
+        """
+        Sets the lattice value of the given version, queueing its reads if it changed
+        """
+
+        if not is_same(self.values.get(version, UNKNOWN), value):
+            self.values[version] = value
+            changed.append(version)
+
+
+    def visit_phi(self, number, phi, changed):
+        """
+        Evaluates a phi - the meet of the versions reaching it along the executable edges
+        """
+
+        value = UNKNOWN
+
+        for predecessor, operand in phi.operands.items():
+            if (predecessor, number) in self.edges:
+                value = meet(value, self.value(operand))
+
+        self.update(phi.target, value, changed)
+
+
+    def visit(self, number, index, changed, flow):
+        """
+        Evaluates an instruction - the value it assigns, or the edges a jump ending the block takes
+        """
+
+        instruction = self.form.blocks[number][index]
+        opcode = instruction.opcode
+        block = self.form.graph.blocks[number]
+
+        if opcode in ('JUMP', 'JMPZ'):
+            target = self.form.graph.label_blocks[instruction.operands[0]]
+            condition = 0 if opcode == 'JUMP' else self.value(instruction.operands[1])
+
+            if condition is UNKNOWN:
+                return
+
+            if condition is VARYING or condition == 0:
+                flow.append((number, target))
+
+            if condition is VARYING or (opcode == 'JMPZ' and condition != 0):
+                if number + 1 < len(self.form.blocks):
+                    flow.append((number, number + 1))
+
+            return
+
+        symbol = instruction.defined()
+
+        if symbol is not None:
+            operands = instruction.operands[1:]
+            self.update(symbol, evaluate(opcode, [ self.value(operand) for operand in operands ]), changed)
+
+
+    def constant_uses(self):
+        """
+        Returns the number of reads of the executable blocks which read a constant version
+        """
+
+        return sum(1 for number in self.executable for instruction in self.form.blocks[number]
+                   for symbol in instruction.used() if self.values.get(symbol, VARYING) not in (UNKNOWN, VARYING))
+
+
+    def rewrite(self):
+        """
+        Rewrites the SSA form with the constants found:
+            Instructions assigning a constant become assignments of the constant (other than inputs)
+            Reads of constants become literals
+            Conditional jumps on constants become jumps, or are dropped if they never jump
+            The blocks never found executable are dropped
+        Constants with no QUAD literal (see literal) are left as they are
+        """
+
+        form = self.form
+
+        for number, instructions in enumerate(form.blocks):
+            if instructions is None:
+                continue
+
+            if number not in self.executable:
+                form.blocks[number] = None
+                form.phis[number] = list()
+                continue
+
+            rewritten = list()
+
+            for instruction in instructions:
+                opcode = instruction.opcode
+
+                if opcode == 'JMPZ':
+                    condition = self.value(instruction.operands[1])
+
+                    if condition is not VARYING and condition is not UNKNOWN:
+                        if condition == 0:
+                            rewritten.append(Instruction('JUMP', [instruction.operands[0]]))
+                        continue
+
+                symbol = instruction.defined()
+
+                if symbol is not None and opcode not in ('IINP', 'RINP'):
+                    value = self.values.get(symbol, VARYING)
+                    text = literal(value) if value is not UNKNOWN and value is not VARYING else None
+
+                    if text is not None:
+                        prefix = 'R' if opcode in REAL_TARGET_OPCODES else 'I'
+                        rewritten.append(Instruction(f'{prefix}ASN', [symbol, text]))
+                        continue
+
+                for symbol in set(instruction.used()):
+                    value = self.values.get(symbol, VARYING)
+                    text = literal(value) if value is not UNKNOWN and value is not VARYING else None
+
+                    if text is not None:
+                        instruction.replace_used(symbol, text)
+
+                rewritten.append(instruction)
+
+            form.blocks[number] = rewritten
+
+
+class DenseConstantPropagation():
+    """
+    Constant propagation as an iterative dataflow analysis over the blocks, the baseline of ConstantPropagation
+    Every block is assumed reachable and every conditional jump may go either way. The state of a block holds a
+    Lattice value per variable assigned on the way to it, so every pass over the blocks costs the blocks times the
+    Variables, until no state changes.
+
+    states - list with the state at the start of every block, a dictionary of variable -> lattice value
+             (the variables missing from a state hold the value they start with, 0)
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.states = [ None for _ in graph.blocks ]
+
+
+    def transfer(self, number, state, visit=None):
+        """
+        Returns the state at the end of the given block, given the state at its start
+        Calls visit with every instruction and the state it runs in, if given
+        """
+
+        state = dict(state)
+
+        for instruction in self.graph.blocks[number].instructions:
+            if visit is not None:
+                visit(instruction, state)
+
+            symbol = instruction.defined()
+
+            if symbol is not None:
+                state[symbol] = evaluate(instruction.opcode, [ parse_constant(operand) if is_constant(operand)
+                                                               else state.get(operand, 0)
+                                                               for operand in instruction.operands[1:] ])
+
+        return state
+
+
+    def run(self):
+        """
+        Iterates over the blocks in reverse postorder until the states no longer change
+        """
+
+        blocks = self.graph.blocks
+        order = self.graph.reverse_postorder()
+        ends = [ None for _ in blocks ]
+        changed = True
+
+        while changed:
+            changed = False
+
+            for number in order:
+                incoming = [ ends[predecessor] for predecessor in blocks[number].predecessors
+                             if ends[predecessor] is not None ]
+
+                # The start of the program reaches the entry with every variable holding its first value
+                if number == 0:
+                    incoming.append(dict())
+
+                state = dict()
+                for variable in set().union(*incoming):
+                    value = UNKNOWN
+                    for end in incoming:
+                        value = meet(value, end.get(variable, 0))
+                    state[variable] = value
+
+                previous = self.states[number]
+
+                if previous is None or len(previous) != len(state) or not all(
+                        is_same(previous.get(variable, UNKNOWN), value) for variable, value in state.items()):
+                    self.states[number] = state
+                    ends[number] = self.transfer(number, state)
+                    changed = True
+
+
+    def constant_uses(self, blocks=None):
+        """
+        Returns the number of reads which read a constant, in the given block numbers (by default, the reachable blocks)
+        """
+
+        count = 0
+
+        def visit(instruction, state):
+            nonlocal count
+            count += sum(1 for symbol in instruction.used() if state.get(symbol, 0) not in (UNKNOWN, VARYING))
+
+        for number, state in enumerate(self.states):
+            if state is not None and (blocks is None or number in blocks):
+                self.transfer(number, state, visit)
+
+        return count
+
+
+def propagate_constants(program, options):
+    """
+    Sparse conditional constant propagation pass - the program is converted into SSA form, constants are propagated
+    (see ConstantPropagation) and the program is converted back out of SSA
+    """
+
+    form = SSAForm(FlowGraph.from_program(program))
+    propagation = ConstantPropagation(form)
+    propagation.run()
+    propagation.rewrite()
+
+    return form.to_program()
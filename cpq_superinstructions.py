@@ -0,0 +1,254 @@
+import sys
+import argparse
+from collections import Counter
+from cpq_quad import OPCODES, SYMBOL, CONSTANT, MAX_OPERANDS
+from cpq_cfg import split_blocks
+from cpq_vm import ARITHMETIC_OPERATORS, RELATIONAL_OPERATORS, int_division, real_division, load_executable
+
+# Lengths of the instruction sequences that are mined and fused
+SEQUENCE_LENGTHS = (2, 3)
+
+# Default number of superinstructions selected from the mined sequences
+DEFAULT_LIMIT = 16
+
+# Names of the values every handler factory gets, before the operands of the instructions it runs
+RUNTIME = ('values', 'read_int', 'read_real', 'write_int', 'write_real', 'int_division', 'real_division')
+
+
+def mine(executables, counts=None, lengths=SEQUENCE_LENGTHS):
+    """
+    Counts the adjacent instruction sequences (by opcode) of the given executables
+    Sequences never cross a basic block boundary, as only the instructions of a single block always run together
+
+    counts  - optional list with a list of instruction execution counts per executable (such as the counters
+              interpret collects), to weigh every sequence by the number of times it ran instead of counting it once
+    lengths - the lengths of the counted sequences
+
+    Returns a Counter of opcode tuple -> number of occurrences
+    """
+
+    sequences = Counter()
+
+    for number, executable in enumerate(executables):
+        weights = counts[number] if counts is not None else None
+        opcodes = [ OPCODES[opcode] for opcode in executable.opcodes ]
+
+        for start, end in split_blocks(executable):
+            for index in range(start, end):
+                weight = weights[index] if weights is not None else 1
+
+                if not weight:
+                    continue
+
+                for length in lengths:
+                    if index + length <= end:
+                        sequences[tuple(opcodes[index:index + length])] += weight
+
+    return sequences
+
+
+def select(sequences, limit=DEFAULT_LIMIT):
+    """
+    Returns the set of the given number of most frequent sequences (as returned by mine), to run as superinstructions
+    """
+
+    return { sequence for sequence, _ in sequences.most_common(limit) }
+
+
+def template_source(template):
+    """
+    Returns the Python source of the handler factory of the given template
+    A template is a tuple of (opcode number, operand kinds) pairs, one per fused instruction
+
+    The factory gets the runtime values, the operands of the instructions (o<instruction>_<position>, symbol numbers,
+    constant values or jump targets) and the index of the next instruction, and returns the handler.
+    The handler runs all the instructions of the template, and returns the index of the instruction to run next.
+    """
+
+    slots = list()
+    body = list()
+
+    for number, (opcode_number, kinds) in enumerate(template):
+        opcode = OPCODES[opcode_number]
+        operands = list()
+
+        for position in range(MAX_OPERANDS):
+            kind = (kinds >> (2 * position)) & 3
+
+            if not kind:
+                break
+
+            slot = f'o{number}_{position}'
+            slots.append(slot)
+            operands.append(f'values[{slot}]' if kind == SYMBOL else slot)
+
+        operation = opcode[1:]
+
+        if opcode == 'HALT':
+            body.append('return nxt')
+        elif opcode == 'JUMP':
+            body.append(f'return {operands[0]}')
+        elif opcode == 'JMPZ':
+            body.append(f'return {operands[0]} if {operands[1]} == 0 else nxt')
+        elif operation == 'ASN':
+            body.append(f'{operands[0]} = {operands[1]}')
+        elif operation == 'PRT':
+            body.append(f'write_{"int" if opcode[0] == "I" else "real"}({operands[0]})')
+        elif operation == 'INP':
+            body.append(f'{operands[0]} = read_{"int" if opcode[0] == "I" else "real"}()')
+        elif opcode == 'ITOR':
+            body.append(f'{operands[0]} = float({operands[1]})')
+        elif opcode == 'RTOI':
+            body.append(f'{operands[0]} = int({operands[1]})')
+        elif operation == 'DIV':
+            division = 'int_division' if opcode[0] == 'I' else 'real_division'
+            body.append(f'{operands[0]} = {division}({operands[1]}, {operands[2]})')
+        elif operation in ARITHMETIC_OPERATORS:
+            body.append(f'{operands[0]} = {operands[1]} {ARITHMETIC_OPERATORS[operation]} {operands[2]}')
+        else:
+            body.append(f'{operands[0]} = 1 if {operands[1]} {RELATIONAL_OPERATORS[operation]} {operands[2]} else 0')
+
+    if not body[-1].startswith('return'):
+        body.append('return nxt')
+
+    lines = [f'def make({", ".join(RUNTIME + tuple(slots))}, nxt):', '    def handler():']
+    lines.extend(f'        {statement}' for statement in body)
+    lines.append('    return handler')
+
+    return '\n'.join(lines) + '\n'
+
+
+class ThreadedEngine():
+    """
+    An interpreter which decodes every instruction once, into a handler which runs it and returns the next index
+    So running the program is a dispatch loop calling one handler after the other.
+
+    Handlers are made from a fixed set of templates - one per opcode and operand kinds, shared by all programs -
+    Rather than generated per program. Adjacent instructions of a block which form one of the given
+    Superinstructions (opcode tuples) are fused into a single handler, which saves their dispatches.
+    """
+
+    # Dictionary of template -> handler factory, shared by all engines
+    factories = dict()
+
+    def __init__(self, executable, superinstructions=()):
+        self.executable = executable
+        self.superinstructions = set(superinstructions)
+        self.groups = self.fuse()
+
+
+    def fuse(self):
+        """
+        Splits the instructions into groups run by a single handler, fusing the longest superinstruction possible
+        At every instruction of a block
+
+        Returns a list of (start, length) tuples
+        """
+
+        opcodes = [ OPCODES[opcode] for opcode in self.executable.opcodes ]
+        longest = max((len(sequence) for sequence in self.superinstructions), default=1)
+        groups = list()
+
+        for start, end in split_blocks(self.executable):
+            index = start
+
+            while index < end:
+                length = next((length for length in range(min(longest, end - index), 1, -1)
+                               if tuple(opcodes[index:index + length]) in self.superinstructions), 1)
+                groups.append((index, length))
+                index += length
+
+        return groups
+
+
+    def factory(self, template):
+        """
+        Returns the handler factory of the given template, creating it the first time it is needed
+        """
+
+        factory = self.factories.get(template)
+
+        if factory is None:
+            namespace = dict()
+            exec(compile(template_source(template), '<superinstruction>', 'exec'), namespace)
+            factory = self.factories[template] = namespace['make']
+
+        return factory
+
+
+    def compile(self):
+        """
+        Decodes the program into handlers
+
+        Returns a function that runs the program on a given Machine, and returns the number of dispatched handlers
+        """
+
+        executable = self.executable
+        templates = list()
+
+        for start, length in self.groups:
+            template = list()
+            operands = list()
+
+            for index in range(start, start + length):
+                kinds = executable.kinds[index]
+                template.append((executable.opcodes[index], kinds))
+
+                for position in range(MAX_OPERANDS):
+                    kind = (kinds >> (2 * position)) & 3
+
+                    if not kind:
+                        break
+
+                    value = executable.operands[position][index]
+                    operands.append(executable.constants[value] if kind == CONSTANT else value)
+
+            # A HALT handler returns the end of the program as its next index
+            following = len(executable) if OPCODES[template[-1][0]] == 'HALT' else start + length
+            templates.append((start, self.factory(tuple(template)), operands, following))
+
+        end = len(executable)
+
+        def run(machine):
+            values = [0] * len(executable.symbols)
+            runtime = (values, machine.read_int, machine.read_real, machine.write_int, machine.write_real,
+                       int_division, real_division)
+
+            handlers = [None] * end
+            for start, factory, operands, following in templates:
+                handlers[start] = factory(*runtime, *operands, following)
+
+            pc = 0
+            dispatches = 0
+
+            while pc < end:
+                pc = handlers[pc]()
+                dispatches += 1
+
+            return dispatches
+
+        return run
+
+
+def main():
+    """
+    Mines the most frequent adjacent instruction sequences of compiled programs
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Mine the most frequent QUAD instruction sequences')
+    argument_parser.add_argument('programs', nargs='+', help='compiled programs (.qud or .qbin)')
+    argument_parser.add_argument('--top', type=int, default=DEFAULT_LIMIT, help='number of sequences to report')
+    arguments = argument_parser.parse_args()
+
+    sequences = mine([ load_executable(file_name) for file_name in arguments.programs ])
+    total = { length: sum(count for sequence, count in sequences.items() if len(sequence) == length)
+              for length in SEQUENCE_LENGTHS }
+
+    for sequence, count in sequences.most_common(arguments.top):
+        print(f'{count:>10} {100 * count / total[len(sequence)]:6.2f}%  {" ".join(sequence)}')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+import sys
+import argparse
+from cpq_quad import OPCODES, SYMBOL, NON_ASSIGNING_OPCODES, infer_real_symbols
+from cpq_cfg import split_blocks
+from cpq_vm import Machine, VMError, load_executable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# NumPy functions of the binary arithmetic and relational operations (without their type prefix)
+if np is not None:
+    ARRAY_OPERATIONS = {
+        'ADD': np.add,
+        'SUB': np.subtract,
+        'MLT': np.multiply,
+        'EQL': np.equal,
+        'NQL': np.not_equal,
+        'LSS': np.less,
+        'GRT': np.greater,
+    }
+
+
+def require_numpy():
+    """
+    Raises an ImportError if NumPy, which batch execution depends on, is not installed
+    """
+
+    if np is None:
+        raise ImportError('vectorized batch execution requires NumPy (pip install numpy)')
+
+
+def int_division(first, second):
+    """
+    Integer division of arrays, truncated towards zero (like the int_division of the VM)
+    """
+
+    quotient = np.abs(first) // np.abs(second)
+    return np.where((first < 0) == (second < 0), quotient, -quotient)
+
+
+class BatchExecutor():
+    """
+    Runs an Executable over many input sets at once
+
+    Every input set is a lane, and every variable and temp is a NumPy array with an element per lane.
+    Each lane has its own program counter - the lanes that wait at the lowest block are run together, so lanes
+    That take the same path through the program share every instruction, and lanes that branch apart are
+    Masked and join again when their paths meet.
+    Input and output instructions are executed lane by lane, on a Machine per lane.
+
+    Ints are 64 bit, so unlike the scalar engines, int arithmetic overflows (wraps around) past 2 ** 63
+    """
+
+    def __init__(self, executable):
+        require_numpy()
+
+        self.executable = executable
+        self.blocks = split_blocks(executable)
+        self.real_symbols = infer_real_symbols(executable)
+
+
+    def run(self, input_sets):
+        """
+        Runs the program once per input set (an iterable of input tokens)
+
+        Returns a list with a (outputs, error) tuple per input set, where outputs is the list of the output lines
+        And error is the VMError that stopped the lane, or None if the lane ran to its end
+        """
+
+        machines = [ Machine(inputs) for inputs in input_sets ]
+        lanes = len(machines)
+
+        if not lanes:
+            return list()
+
+        self.machines = machines
+        self.errors = [None] * lanes
+        self.lane_numbers = np.arange(lanes)
+        self.values = [ np.zeros(lanes, dtype=np.float64 if real else np.int64) for real in self.real_symbols ]
+
+        # A lane whose program counter is the length of the program has ended
+        self.end = len(self.executable)
+        self.pc = np.zeros(lanes, dtype=np.intp)
+
+        blocks = { start: self.block(start, end) for start, end in self.blocks }
+
+        while True:
+            current = self.pc.min()
+
+            if current >= self.end:
+                break
+
+            waiting = self.pc == current
+            blocks[current](slice(None) if waiting.all() else np.nonzero(waiting)[0])
+
+        results = [ (machine.outputs, error) for machine, error in zip(machines, self.errors) ]
+
+        del self.machines, self.errors, self.values, self.pc
+        return results
+
+
+    def fail(self, lanes, error):
+        """
+        Ends the given lanes (an array of lane numbers) with the given error
+        """
+
+        for lane in lanes:
+            self.errors[lane] = error
+
+        self.pc[lanes] = self.end
+
+
+    def fetch(self, kind, value):
+        """
+        Returns a function that gets a lane selection and returns the values of an operand in the selected lanes
+        """
+
+        if kind == SYMBOL:
+            values = self.values[value]
+            return lambda lanes: values[lanes]
+
+        constant = self.executable.constants[value]
+        return lambda lanes: constant
+
+
+    def operands(self, index):
+        """
+        Returns the operands of the instruction at the given index, as fetch functions
+        The first operand is returned as the array it assigns
+        """
+
+        executable = self.executable
+        kinds = executable.kinds[index]
+        operands = list()
+
+        for position in range(3):
+            kind = (kinds >> (2 * position)) & 3
+
+            if not kind:
+                break
+
+            value = executable.operands[position][index]
+
+            if position == 0 and OPCODES[executable.opcodes[index]] not in NON_ASSIGNING_OPCODES:
+                operands.append(self.values[value])
+            else:
+                operands.append(self.fetch(kind, value))
+
+        return operands
+
+
+    def step(self, index):
+        """
+        Returns the function of a single (non jump) instruction
+        The function gets the selection of the lanes to run, and returns the selection of the lanes that go on
+        """
+
+        opcode = OPCODES[self.executable.opcodes[index]]
+        operation = opcode[1:]
+        operands = self.operands(index)
+
+        if operation == 'PRT':
+            return self.write_step(opcode, operands[0])
+        if operation == 'INP':
+            return self.read_step(opcode, operands[0])
+        if operation == 'DIV':
+            return self.division_step(opcode, *operands)
+
+        target = operands[0]
+
+        if operation == 'ASN' or opcode == 'ITOR':
+            source = operands[1]
+
+            def assign(lanes):
+                target[lanes] = source(lanes)
+                return lanes
+
+            return assign
+
+        if opcode == 'RTOI':
+            source = operands[1]
+
+            def truncate(lanes):
+                target[lanes] = np.trunc(source(lanes))
+                return lanes
+
+            return truncate
+
+        function = ARRAY_OPERATIONS[operation]
+        first, second = operands[1], operands[2]
+
+        def compute(lanes):
+            target[lanes] = function(first(lanes), second(lanes))
+            return lanes
+
+        return compute
+
+
+    def division_step(self, opcode, target, first, second):
+        """
+        Returns the function of a division instruction
+        Lanes that divide by zero end with an error, and the rest go on
+        """
+
+        divide = int_division if opcode[0] == 'I' else np.true_divide
+
+        def division(lanes):
+            divisors = second(lanes)
+            zero = divisors == 0
+
+            if np.any(zero):
+                selected = self.lane_numbers[lanes]
+                zero = np.broadcast_to(zero, selected.shape)
+                self.fail(selected[zero], VMError('division by zero'))
+
+                lanes = selected[~zero]
+                divisors = second(lanes)
+
+            target[lanes] = divide(first(lanes), divisors)
+            return lanes
+
+        return division
+
+
+    def read_step(self, opcode, target):
+        """
+        Returns the function of an input instruction, which reads the input of every lane from its own Machine
+        Lanes whose input is missing or bad end with an error
+        """
+
+        real = opcode[0] == 'R'
+
+        def read(lanes):
+            selected = self.lane_numbers[lanes]
+            inputs = list()
+            remaining = list()
+
+            for lane in selected:
+                machine = self.machines[lane]
+
+                try:
+                    inputs.append(machine.read_real() if real else machine.read_int())
+                    remaining.append(lane)
+                except VMError as error:
+                    self.fail([lane], error)
+
+            if len(remaining) != len(selected):
+                lanes = np.array(remaining, dtype=np.intp)
+
+            target[lanes] = inputs
+            return lanes
+
+        return read
+
+
+    def write_step(self, opcode, source):
+        """
+        Returns the function of an output instruction, which writes the output of every lane to its own Machine
+        """
+
+        real = opcode[0] == 'R'
+
+        def write(lanes):
+            selected = self.lane_numbers[lanes]
+            outputs = np.broadcast_to(source(lanes), selected.shape)
+
+            for lane, value in zip(selected, outputs):
+                if real:
+                    self.machines[lane].write_real(float(value))
+                else:
+                    self.machines[lane].write_int(int(value))
+
+            return lanes
+
+        return write
+
+
+    def block(self, start, end):
+        """
+        Returns the function of the basic block between the given indexes
+        The function runs the block on the given selection of lanes, and moves their program counters on
+        """
+
+        executable = self.executable
+        last = OPCODES[executable.opcodes[end - 1]]
+        jumps = last in ('JUMP', 'JMPZ', 'HALT')
+        steps = [ self.step(index) for index in range(start, end - 1 if jumps else end) ]
+
+        if last == 'HALT':
+            successor = self.end
+        elif last == 'JUMP':
+            successor = executable.operands[0][end - 1]
+        else:
+            successor = end
+
+        if last == 'JMPZ':
+            target = executable.operands[0][end - 1]
+            condition = self.fetch((executable.kinds[end - 1] >> 2) & 3, executable.operands[1][end - 1])
+
+        def run(lanes):
+            for step in steps:
+                lanes = step(lanes)
+
+            if last == 'JMPZ':
+                self.pc[lanes] = np.where(condition(lanes) == 0, target, successor)
+            else:
+                self.pc[lanes] = successor
+
+        return run
+
+
+def main():
+    """
+    Runs a compiled QUAD program once per input file, and prints the outputs of every run
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Run a compiled QUAD program over many inputs at once')
+    argument_parser.add_argument('program', help='compiled program (.qud or .qbin)')
+    argument_parser.add_argument('inputs', nargs='+', help='input files, the program runs once per file')
+    arguments = argument_parser.parse_args()
+
+    executable = load_executable(arguments.program)
+    input_sets = list()
+
+    for input_file_name in arguments.inputs:
+        with open(input_file_name, 'r') as file:
+            input_sets.append(file.read().split())
+
+    results = BatchExecutor(executable).run(input_sets)
+    status = 0
+
+    for input_file_name, (outputs, error) in zip(arguments.inputs, results):
+        print(f'==> {input_file_name} <==')
+        print('\n'.join(outputs))
+
+        if error is not None:
+            print(f'runtime error - {error}', file=sys.stderr)
+            status = 1
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,433 @@
+import sys
+import argparse
+from cpq_quad import Program, OPCODES, SYMBOL, CONSTANT, MAX_OPERANDS
+from cpq_binary import load_file, BINARY_FILE_SUFFIX
+from cpq_cfg import split_blocks
+
+# Python operators of the binary arithmetic and relational opcodes (without their type prefix)
+ARITHMETIC_OPERATORS = {
+    'ADD': '+',
+    'SUB': '-',
+    'MLT': '*',
+    'DIV': '/',
+}
+
+RELATIONAL_OPERATORS = {
+    'EQL': '==',
+    'NQL': '!=',
+    'LSS': '<',
+    'GRT': '>',
+}
+
+
+class VMError(Exception):
+    """
+    Raised when a QUAD program fails at runtime (division by zero, missing or bad input)
+    """
+
+    pass
+
+
+def format_real(value):
+    """
+    Formats a real number for output
+    The shortest of 15, 16 or 17 significant digits which represents the value exactly is used,
+    So the format can be reproduced by any printf implementation
+    """
+
+    for precision in (15, 16):
+        text = '%.*g' % (precision, value)
+        if float(text) == value:
+            return text
+
+    return '%.17g' % value
+
+
+def int_division(first, second):
+    """
+    Integer division, truncated towards zero
+    """
+
+    if second == 0:
+        raise VMError('division by zero')
+
+    quotient = abs(first) // abs(second)
+    return quotient if (first < 0) == (second < 0) else -quotient
+
+
+def real_division(first, second):
+    """
+    Real division
+    """
+
+    if second == 0:
+        raise VMError('division by zero')
+
+    return first / second
+
+
+class Machine():
+    """
+    The runtime environment of a QUAD program - its input stream and its outputs
+
+    inputs - iterable of input tokens (strings), read by IINP and RINP
+    """
+
+    def __init__(self, inputs=()):
+        self.inputs = iter(inputs)
+        self.outputs = list()
+
+
+    def read_int(self):
+        """
+        Reads an int from the input stream
+        """
+
+        token = self.read_token()
+
+        try:
+            return int(token)
+        except ValueError:
+            raise VMError(f'bad int input {token}')
+
+
+    def read_real(self):
+        """
+        Reads a real number from the input stream
+        """
+
+        token = self.read_token()
+
+        try:
+            return float(token)
+        except ValueError:
+            raise VMError(f'bad real input {token}')
+
+
+    def read_token(self):
+        """
+        Returns the next token of the input stream
+        """
+
+        token = next(self.inputs, None)
+
+        if token is None:
+            raise VMError('end of input')
+
+        return token
+
+
+    def write_int(self, value):
+        """
+        Writes an int to the outputs
+        """
+
+        self.outputs.append(str(value))
+
+
+    def write_real(self, value):
+        """
+        Writes a real number to the outputs
+        """
+
+        self.outputs.append(format_real(float(value)))
+
+
+def interpret(executable, machine, counters=None):
+    """
+    Runs the given Executable instruction by instruction, decoding every instruction as it is executed
+    This is the reference semantics of QUAD programs
+
+    counters - optional list with an element per instruction, every executed instruction increments its element
+
+    Returns the number of executed instructions
+    """
+
+    values = dict()
+    pc = 0
+    executed = 0
+
+    def fetch(kind, value):
+        if kind == SYMBOL:
+            return values.get(value, 0)
+        return value
+
+    while pc < len(executable):
+        opcode, operands = executable.decode(pc)
+        executed += 1
+
+        if counters is not None:
+            counters[pc] += 1
+
+        pc += 1
+
+        if opcode == 'HALT':
+            break
+
+        if opcode == 'JUMP':
+            pc = operands[0][1]
+            continue
+
+        if opcode == 'JMPZ':
+            if fetch(*operands[1]) == 0:
+                pc = operands[0][1]
+            continue
+
+        target = operands[0][1]
+        operation = opcode[1:]
+
+        if operation == 'ASN':
+            values[target] = fetch(*operands[1])
+        elif operation == 'PRT':
+            (machine.write_int if opcode[0] == 'I' else machine.write_real)(fetch(*operands[0]))
+        elif operation == 'INP':
+            values[target] = machine.read_int() if opcode[0] == 'I' else machine.read_real()
+        elif opcode == 'ITOR':
+            values[target] = float(fetch(*operands[1]))
+        elif opcode == 'RTOI':
+            values[target] = int(fetch(*operands[1]))
+        else:
+            first, second = fetch(*operands[1]), fetch(*operands[2])
+
+            if operation == 'ADD':
+                values[target] = first + second
+            elif operation == 'SUB':
+                values[target] = first - second
+            elif operation == 'MLT':
+                values[target] = first * second
+            elif operation == 'DIV':
+                values[target] = int_division(first, second) if opcode[0] == 'I' else real_division(first, second)
+            elif operation == 'EQL':
+                values[target] = 1 if first == second else 0
+            elif operation == 'NQL':
+                values[target] = 1 if first != second else 0
+            elif operation == 'LSS':
+                values[target] = 1 if first < second else 0
+            elif operation == 'GRT':
+                values[target] = 1 if first > second else 0
+
+    return executed
+
+
+class ClosureCompiler():
+    """
+    Translates an Executable, block by block, into generated Python code
+
+    Every basic block becomes a nested function, and every variable and temp becomes a local of the enclosing
+    function (shared by the blocks as a closure cell), so no operand is decoded or looked up by name at runtime.
+    A block returns the function of the block that runs next, so jumps are direct transfers between blocks.
+    """
+
+    # Names of the runtime functions the generated code gets (see runtime_values)
+    runtime = ('read_int', 'read_real', 'write_int', 'write_real', 'int_division', 'real_division')
+
+    def __init__(self, executable):
+        self.executable = executable
+
+
+    def runtime_values(self, machine):
+        """
+        Returns the values of the runtime names for a run on the given Machine
+        """
+
+        return machine.read_int, machine.read_real, machine.write_int, machine.write_real, int_division, real_division
+
+
+    def operand(self, kind, value):
+        """
+        Returns the Python expression of an operand
+        """
+
+        if kind == SYMBOL:
+            return f'v{value}'
+        if kind == CONSTANT:
+            return repr(self.executable.constants[value])
+        return f'b{value}'
+
+
+    def statement(self, index):
+        """
+        Returns the Python statement of a single (non jump) instruction
+        """
+
+        executable = self.executable
+        opcode = OPCODES[executable.opcodes[index]]
+        kinds = executable.kinds[index]
+
+        operands = [ self.operand((kinds >> (2 * position)) & 3, executable.operands[position][index])
+                     for position in range(MAX_OPERANDS) if (kinds >> (2 * position)) & 3 ]
+
+        operation = opcode[1:]
+
+        if operation == 'ASN':
+            return f'{operands[0]} = {operands[1]}'
+        if operation == 'PRT':
+            return f'write_{"int" if opcode[0] == "I" else "real"}({operands[0]})'
+        if operation == 'INP':
+            return f'{operands[0]} = read_{"int" if opcode[0] == "I" else "real"}()'
+        if opcode == 'ITOR':
+            return f'{operands[0]} = float({operands[1]})'
+        if opcode == 'RTOI':
+            return f'{operands[0]} = int({operands[1]})'
+        if operation == 'DIV':
+            division = 'int_division' if opcode[0] == 'I' else 'real_division'
+            return f'{operands[0]} = {division}({operands[1]}, {operands[2]})'
+        if operation in ARITHMETIC_OPERATORS:
+            return f'{operands[0]} = {operands[1]} {ARITHMETIC_OPERATORS[operation]} {operands[2]}'
+        return f'{operands[0]} = 1 if {operands[1]} {RELATIONAL_OPERATORS[operation]} {operands[2]} else 0'
+
+
+    def block(self, start, end):
+        """
+        Returns the lines of the Python function of the basic block between the given indexes
+        """
+
+        executable = self.executable
+        last = OPCODES[executable.opcodes[end - 1]]
+        statements = list()
+        assigned = set()
+
+        for index in range(start, end - 1 if last in ('JUMP', 'JMPZ', 'HALT') else end):
+            statements.append(f'        {self.statement(index)}')
+
+            # Every instruction but the print instructions assigns its first operand
+            if not OPCODES[executable.opcodes[index]].endswith('PRT'):
+                assigned.add(f'v{executable.operands[0][index]}')
+
+        lines = [f'    def b{start}():']
+
+        if assigned:
+            lines.append(f'        nonlocal {", ".join(sorted(assigned))}')
+
+        lines.extend(self.block_entry(start))
+        lines.extend(statements)
+
+        if last == 'HALT':
+            lines.append('        return None')
+        elif last == 'JUMP':
+            lines.append(f'        return b{executable.operands[0][end - 1]}')
+        elif last == 'JMPZ':
+            condition = self.operand((executable.kinds[end - 1] >> 2) & 3, executable.operands[1][end - 1])
+            lines.extend(self.conditional_exit(end - 1, condition))
+        else:
+            lines.append(f'        return b{end}')
+
+        return lines
+
+
+    def block_entry(self, start):
+        """
+        Returns the lines that run when the block starting at the given index is entered (none by default)
+        """
+
+        return []
+
+
+    def conditional_exit(self, index, condition):
+        """
+        Returns the lines that end a block with the JMPZ instruction at the given index, given its condition expression
+        """
+
+        return [f'        return b{self.executable.operands[0][index]} if {condition} == 0 else b{index + 1}']
+
+
+    def source(self):
+        """
+        Returns the Python source code of the translated program
+        The source defines a function which gets the runtime functions and returns the function of the first block
+        """
+
+        executable = self.executable
+
+        lines = [f'def load({", ".join(self.runtime)}):']
+        lines.extend(f'    v{index} = 0' for index in range(len(executable.symbols)))
+
+        # Jumps and fall through past the last instruction end the program
+        lines.append(f'    b{len(executable)} = None')
+
+        for start, end in split_blocks(executable):
+            lines.extend(self.block(start, end))
+
+        lines.append(f'    return b0' if len(executable) else '    return None')
+        return '\n'.join(lines) + '\n'
+
+
+    def compile(self):
+        """
+        Compiles the translated program
+
+        Returns a function that runs the program on a given Machine, and returns the number of executed blocks
+        """
+
+        namespace = dict()
+        exec(compile(self.source(), '<quad>', 'exec'), namespace)
+        load = namespace['load']
+
+        def run(machine):
+            block = load(*self.runtime_values(machine))
+            executed = 0
+
+            while block is not None:
+                block = block()
+                executed += 1
+
+            return executed
+
+        return run
+
+
+def load_executable(file_name):
+    """
+    Loads a compiled program from a text (.qud) or binary (.qbin) QUAD file
+
+    Returns the Executable
+    """
+
+    if file_name.endswith(BINARY_FILE_SUFFIX):
+        return load_file(file_name)
+
+    with open(file_name, 'r') as file:
+        return Program.from_text(file.read()).link()
+
+
+# Dictionary of the available execution engines, each one gets an Executable and a Machine to run it on
+ENGINES = {
+    'interpret': interpret,
+    'closure': lambda executable, machine: ClosureCompiler(executable).compile()(machine),
+}
+
+
+def main():
+    """
+    Runs a compiled QUAD program, reading its input from a file or from the stdin
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Run a compiled QUAD program')
+    argument_parser.add_argument('program', help='compiled program (.qud or .qbin)')
+    argument_parser.add_argument('--engine', choices=list(ENGINES), default='closure')
+    argument_parser.add_argument('--input', help='file to read the program input from (default: stdin)')
+    arguments = argument_parser.parse_args()
+
+    executable = load_executable(arguments.program)
+
+    if arguments.input:
+        with open(arguments.input, 'r') as file:
+            inputs = file.read().split()
+    else:
+        inputs = sys.stdin.read().split()
+
+    machine = Machine(inputs)
+
+    try:
+        ENGINES[arguments.engine](executable, machine)
+    except VMError as error:
+        print('\n'.join(machine.outputs))
+        print(f'runtime error - {error}', file=sys.stderr)
+        return 1
+
+    print('\n'.join(machine.outputs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
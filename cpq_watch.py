@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import hashlib
+from time import perf_counter
+
+# Default polling interval in seconds
+DEFAULT_INTERVAL = 0.5
+
+
+class Watcher():
+    """
+    Watches a set of source files and directories by polling, and rebuilds the sources that changed
+
+    Polling only stats the files - the content of a file is hashed only when its size or modification time changed,
+    And the file is rebuilt only if its content hash changed.
+
+    paths     - list of source files and directories (which are searched recursively for files with the suffix)
+    build     - function that gets a source file name, builds it, and returns True if the build succeeded
+    suffix    - suffix of the source files in the watched directories
+    interval  - polling interval in seconds
+    """
+
+    def __init__(self, paths, build, suffix, interval=DEFAULT_INTERVAL):
+        self.paths = paths
+        self.build = build
+        self.suffix = suffix
+        self.interval = interval
+
+        # Dictionary of file name -> (stat signature, content hash) of the last build
+        self.state = dict()
+
+
+    def find_sources(self):
+        """
+        Returns the list of the watched source files that currently exist
+        """
+
+        sources = list()
+
+        for path in self.paths:
+            if os.path.isdir(path):
+                for directory, _, file_names in os.walk(path):
+                    sources.extend(os.path.join(directory, file_name)
+                                   for file_name in sorted(file_names) if file_name.endswith(self.suffix))
+            elif os.path.exists(path):
+                sources.append(path)
+
+        return sources
+
+
+    def get_hash(self, file_name):
+        """
+        Returns the hash of the content of the given file
+        """
+
+        with open(file_name, 'rb') as file:
+            return hashlib.blake2b(file.read(), digest_size=16).digest()
+
+
+    def poll(self):
+        """
+        Returns the list of source files whose content changed since they were last built (including new files)
+        """
+
+        changed = list()
+        sources = self.find_sources()
+
+        for file_name in sources:
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                continue
+
+            signature = (stat.st_mtime_ns, stat.st_size)
+            previous = self.state.get(file_name)
+
+            if previous and previous[0] == signature:
+                continue
+
+            try:
+                content_hash = self.get_hash(file_name)
+            except OSError:
+                continue
+
+            self.state[file_name] = (signature, content_hash)
+
+            if not previous or previous[1] != content_hash:
+                changed.append(file_name)
+
+        # Forget files that were removed, so they are rebuilt if they come back
+        for file_name in set(self.state) - set(sources):
+            del self.state[file_name]
+
+        return changed
+
+
+    def rebuild(self, file_names):
+        """
+        Rebuilds the given source files, reporting the rebuild latency of each one to the stderr
+        """
+
+        for file_name in file_names:
+            start = perf_counter()
+            succeeded = self.build(file_name)
+            elapsed = perf_counter() - start
+
+            status = 'rebuilt' if succeeded else 'failed to build'
+            print(f'{status} {file_name} in {elapsed * 1e3:.1f} ms', file=sys.stderr, flush=True)
+
+
+    def run(self):
+        """
+        Builds all the sources, then keeps rebuilding the changed sources until interrupted
+        """
+
+        try:
+            while True:
+                self.rebuild(self.poll())
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
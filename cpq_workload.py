@@ -0,0 +1,230 @@
+import random
+import argparse
+
+# Relational operators that can be used in generated conditions
+RELOPS = ['==', '!=', '<', '>', '<=', '>=']
+
+
+class WorkloadGenerator():
+    """
+    Generator of synthetic (and valid) CPL programs, used for benchmarking the compiler
+
+    The generated programs consist of:
+        Many declarations, of both int and float variables
+        Long arithmetic chains
+        Mixed int/float expressions, which require ITOR conversions
+        Deeply nested if/while blocks
+        Heavy boolean logic in the conditions
+
+    Every arithmetic chain is divided by the sum of its coefficients, so the values stay bounded when executed,
+    And every while loop is bounded by its own counter, so the generated programs always terminate.
+    """
+
+    def __init__(self, variables=50, statements=100, chain_length=8, nesting_depth=3, bool_terms=4,
+                 loop_limit=4, inputs=0, seed=0):
+        self.variables = variables
+        self.statements = statements
+        self.chain_length = chain_length
+        self.nesting_depth = nesting_depth
+        self.bool_terms = bool_terms
+        self.loop_limit = loop_limit
+        self.inputs = inputs
+        self.random = random.Random(seed)
+
+        # Names of the generated variables
+        self.int_vars = [ f'i{index}' for index in range(variables) ]
+        self.float_vars = [ f'f{index}' for index in range(variables) ]
+        self.counters = [ f'c{index}' for index in range(nesting_depth) ]
+
+        # The generated lines of the program
+        self.lines = list()
+
+
+    def emit(self, depth, line):
+        """
+        Adds a line of code, indented by the given depth
+        """
+
+        self.lines.append('    ' * (depth + 1) + line)
+
+
+    def int_literal(self):
+        """
+        Returns a random int literal
+        """
+
+        return str(self.random.randint(0, 9))
+
+
+    def float_literal(self):
+        """
+        Returns a random float literal
+        """
+
+        return f'{self.random.randint(0, 9)}.{self.random.randint(0, 9)}'
+
+
+    def chain(self, operands, float_chain):
+        """
+        Returns a long arithmetic chain of the given operands, divided by the sum of its coefficients
+        """
+
+        terms = list()
+        total = 1
+
+        for index in range(self.chain_length):
+            operand = self.random.choice(operands)
+            coefficient = self.random.randint(1, 3)
+            total += coefficient
+            term = operand if coefficient == 1 else f'{operand} * {coefficient}'
+            terms.append(term if index == 0 else f'{self.random.choice("+-")} {term}')
+
+        literal = self.float_literal() if float_chain else self.int_literal()
+        total += int(float(literal)) + 1
+        return f'({" ".join(terms)} + {literal}) / {total}'
+
+
+    def int_expression(self):
+        """
+        Returns an arithmetic chain of int variables only, so it can be assigned into an int variable
+        """
+
+        return self.chain(self.int_vars, float_chain=False)
+
+
+    def float_expression(self):
+        """
+        Returns an arithmetic chain of both int and float variables, which forces ITOR conversions
+        """
+
+        return self.chain(self.int_vars + self.float_vars, float_chain=True)
+
+
+    def condition(self):
+        """
+        Returns a boolean expression consisting of bool_terms relations combined with ||, && and !
+        """
+
+        condition = None
+
+        for _ in range(self.bool_terms):
+            operands = self.int_vars + self.float_vars
+            relation = f'{self.random.choice(operands)} {self.random.choice(RELOPS)} {self.random.choice(operands)}'
+
+            if self.random.random() < 0.25:
+                relation = f'!({relation})'
+
+            if condition is None:
+                condition = relation
+            else:
+                condition = f'{condition} {self.random.choice(["||", "&&"])} {relation}'
+
+        return condition
+
+
+    def assignment(self, depth):
+        """
+        Generates an assignment of an arithmetic chain into a random variable
+        """
+
+        if self.random.random() < 0.5:
+            self.emit(depth, f'{self.random.choice(self.int_vars)} = {self.int_expression()};')
+        else:
+            self.emit(depth, f'{self.random.choice(self.float_vars)} = {self.float_expression()};')
+
+
+    def block(self, depth, level):
+        """
+        Generates a nested block, whose nesting continues until the configured nesting depth is reached
+        """
+
+        if level >= self.nesting_depth:
+            self.assignment(depth)
+            return
+
+        if self.random.random() < 0.5:
+            self.emit(depth, f'if ({self.condition()}) {{')
+            self.assignment(depth + 1)
+            self.block(depth + 1, level + 1)
+            self.emit(depth, '} else {')
+            self.assignment(depth + 1)
+            self.block(depth + 1, level + 1)
+            self.emit(depth, '}')
+        else:
+            counter = self.counters[level]
+            self.emit(depth, f'{counter} = 0;')
+            self.emit(depth, f'while ({counter} < {self.loop_limit} && !({self.condition()})) {{')
+            self.assignment(depth + 1)
+            self.block(depth + 1, level + 1)
+            self.emit(depth + 1, f'{counter} = {counter} + 1;')
+            self.emit(depth, '}')
+
+
+    def generate(self):
+        """
+        Generates the program
+
+        Returns the source code of the program
+        """
+
+        self.lines = list()
+
+        # Declarations, split into several idlists
+        for names, type_ in [(self.int_vars + self.counters, 'int'), (self.float_vars, 'float')]:
+            for start in range(0, len(names), 10):
+                self.lines.append(f'{", ".join(names[start:start + 10])}: {type_};')
+
+        self.lines.append('{')
+
+        # Read inputs, if requested
+        for index in range(self.inputs):
+            self.emit(0, f'input({(self.int_vars + self.float_vars)[index % (2 * self.variables)]});')
+
+        for statement in range(self.statements):
+            choice = self.random.random()
+
+            if choice < 0.4:
+                self.assignment(0)
+            elif choice < 0.8:
+                self.block(0, 0)
+            else:
+                self.emit(0, f'output({self.random.choice(self.int_vars + self.float_vars)});')
+
+        self.lines.append('}')
+
+        return '\n'.join(self.lines) + '\n'
+
+
+def generate_program(**options):
+    """
+    Returns the source code of a synthetic CPL program, generated with the given WorkloadGenerator options
+    """
+
+    return WorkloadGenerator(**options).generate()
+
+
+def main():
+    """
+    Writes a generated CPL program to the given file
+    """
+
+    argument_parser = argparse.ArgumentParser(description='Generate a synthetic CPL program')
+    argument_parser.add_argument('output_file')
+    argument_parser.add_argument('--variables', type=int, default=50)
+    argument_parser.add_argument('--statements', type=int, default=100)
+    argument_parser.add_argument('--chain-length', type=int, default=8)
+    argument_parser.add_argument('--nesting-depth', type=int, default=3)
+    argument_parser.add_argument('--bool-terms', type=int, default=4)
+    argument_parser.add_argument('--loop-limit', type=int, default=4)
+    argument_parser.add_argument('--inputs', type=int, default=0)
+    argument_parser.add_argument('--seed', type=int, default=0)
+    arguments = vars(argument_parser.parse_args())
+
+    output_file_name = arguments.pop('output_file')
+
+    with open(output_file_name, 'w') as file:
+        file.write(generate_program(**arguments))
+
+
+if __name__ == "__main__":
+    main()
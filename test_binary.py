@@ -0,0 +1,106 @@
+import os
+import sys
+import subprocess
+import pytest
+from cpq_compiler import compile_source
+from cpq_quad import Program, QuadError
+from cpq_binary import dump, load, write_file, load_file
+
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+CPQ = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cpq.py')
+
+# Real and int constants (including ones that only differ by type), and labels jumped to backwards and forwards
+HAND_WRITTEN = '''RINP x
+IASN n 3
+L1:
+IGRT t1 n 0
+JMPZ L2 t1
+RMLT x x 2.5
+RADD x x 0.1
+RASN y 2.0
+IASN z 2
+RPRT 1e-07
+ISUB n n 1
+JUMP L1
+L2:
+RPRT x
+IPRT 9223372036854775807
+IPRT 0
+HALT'''
+
+
+def assert_round_trip(executable):
+    loaded = load(dump(executable))
+
+    assert loaded.equals(executable)
+    assert loaded.opcodes == executable.opcodes
+    assert loaded.kinds == executable.kinds
+    assert loaded.operands == executable.operands
+    assert loaded.symbols == executable.symbols
+    assert [ (type(value), value) for value in loaded.constants ] == \
+           [ (type(value), value) for value in executable.constants ]
+
+
+def get_samples():
+    return sorted(file_name[:-len('.ou')] for file_name in os.listdir(SAMPLES_DIRECTORY) if file_name.endswith('.ou'))
+
+
+@pytest.mark.parametrize('level', [0, 1, 2])
+@pytest.mark.parametrize('name', get_samples())
+def test_samples_round_trip(name, level):
+    with open(os.path.join(SAMPLES_DIRECTORY, f'{name}.ou'), 'r') as file:
+        text = '\n'.join(compile_source(file.read(), optimize=level).instructions)
+
+    assert_round_trip(Program.from_text(text).link())
+
+
+def test_real_constants_and_labels_round_trip():
+    executable = Program.from_text(HAND_WRITTEN).link()
+
+    assert any(isinstance(value, float) for value in executable.constants)
+    assert_round_trip(executable)
+    assert load(dump(executable)).to_program().to_lines() == executable.to_program().to_lines()
+
+
+def test_program_without_symbols_round_trips():
+    assert_round_trip(Program.from_text('IPRT 5\nHALT').link())
+
+
+def test_file_round_trip(tmp_path):
+    executable = Program.from_text(HAND_WRITTEN).link()
+    file_name = str(tmp_path / 'program.qbin')
+    write_file(file_name, executable)
+
+    assert load_file(file_name).equals(executable)
+
+
+def test_truncated_data_is_rejected():
+    data = dump(Program.from_text(HAND_WRITTEN).link())
+
+    with pytest.raises(QuadError):
+        load(data[:-1])
+
+    with pytest.raises(QuadError):
+        load(b'XXXX' + data[4:])
+
+
+def test_out_of_range_int_constants_are_rejected():
+    for value in (1 << 63, 99999999999999999999):
+        with pytest.raises(QuadError):
+            dump(Program.from_text(f'IPRT {value}\nHALT').link())
+
+    executable = Program.from_text(f'IPRT {(1 << 63) - 1}\nHALT').link()
+    assert load(dump(executable)).constants == [(1 << 63) - 1]
+
+
+def test_out_of_range_literal_leaves_no_partial_outputs(tmp_path):
+    input_file_name = str(tmp_path / 'lit.ou')
+
+    with open(input_file_name, 'w') as file:
+        file.write('a: int;\n{ a = 99999999999999999999; output(a); }\n')
+
+    result = subprocess.run([sys.executable, CPQ, '--format', 'both', input_file_name], capture_output=True, text=True)
+
+    assert result.returncode == 1
+    assert 'CRITICAL' in result.stderr and 'Traceback' not in result.stderr
+    assert sorted(os.listdir(tmp_path)) == ['lit.ou']
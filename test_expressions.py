@@ -0,0 +1,37 @@
+import re
+import pytest
+from cpq_compiler import compile_source
+from cpq_quad import Program, is_constant
+from cpq_binary import dump, load
+from cpq_cbackend import CTranslator
+from cpq_vm import Machine, interpret
+
+# A product of constants which doesn't fit in 64 bit
+OVERFLOWING_PRODUCT = '''
+a: int;
+{
+    a = 100000 * 100000 * 100000 * 100000;
+    output(a);
+}
+'''
+
+
+def run(executable):
+    machine = Machine()
+    interpret(executable, machine)
+    return machine.outputs
+
+
+@pytest.mark.parametrize('level', [1, 2])
+def test_overflowing_constants_are_not_folded(level):
+    lines = compile_source(OVERFLOWING_PRODUCT, optimize=level).instructions
+    executable = Program.from_lines(lines).link()
+
+    literals = [ operand for line in lines for operand in line.split()[1:] if is_constant(operand) ]
+    assert all(int(literal) < 1 << 63 for literal in literals)
+
+    # The binary format and the C backend can hold all the constants
+    assert load(dump(executable)).equals(executable)
+    assert all(int(literal) < 1 << 63 for literal in re.findall(r'\b(\d+)LL\b', CTranslator(executable).source()))
+
+    assert run(executable) == run(Program.from_lines(compile_source(OVERFLOWING_PRODUCT).instructions).link())
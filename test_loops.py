@@ -0,0 +1,66 @@
+from cpq_compiler import compile_source
+from cpq_optimizer import optimize_code
+from cpq_quad import Program
+from cpq_vm import Machine, interpret
+
+# An inner loop whose counter isn't reset, so it runs only on the first entry - strength reduction initializes the
+# Reduced variables from the counter in the preheader on every entry, so the counter must not be removed
+REENTERED_LOOP = '''
+i, k, s: int;
+{
+    i = 0;
+    k = 0;
+    while (k < 3) {
+        while (i < 10) {
+            s = s + i * 4;
+            i = i + 1;
+        }
+        output(s);
+        k = k + 1;
+    }
+    output(s);
+}
+'''
+
+# A loop whose counter is dead once it exits, so strength reduction replaces its test and removes it
+SINGLE_LOOP = '''
+i, s: int;
+{
+    i = 0;
+    while (i < 10) {
+        s = s + i * 4;
+        i = i + 1;
+    }
+    output(s);
+}
+'''
+
+
+def run(lines):
+    """
+    Runs the given QUAD code lines and returns their outputs
+    """
+
+    machine = Machine()
+    interpret(Program.from_lines(lines).link(), machine)
+    return machine.outputs
+
+
+def test_reentered_loop_keeps_counter():
+    lines = compile_source(REENTERED_LOOP).instructions
+    expected = ['180', '180', '180', '180']
+
+    assert run(lines) == expected
+    assert run(optimize_code(lines, 1)) == expected
+    assert run(optimize_code(lines, 1, passes=['strength_reduction'])) == expected
+
+
+def test_dead_counter_is_removed():
+    lines = compile_source(SINGLE_LOOP).instructions
+    optimized = optimize_code(lines, 1, passes=['strength_reduction'])
+
+    assert run(optimized) == ['180']
+
+    # Only the preheader reads the counter
+    loop = optimized[optimized.index('L1: '):]
+    assert not any(' i ' in f'{line} ' or line.startswith('IMLT') for line in loop)
@@ -0,0 +1,46 @@
+import os
+import pytest
+from cpq_quad import Program
+from cpq_binary import write_file
+from cpq_runner import find_inputs, get_output_file_names, run_batch
+
+
+def test_nested_inputs_mirror_their_paths(tmp_path):
+    for directory in ('a', 'b'):
+        os.makedirs(tmp_path / directory)
+        (tmp_path / directory / 'case.in').write_text('3')
+
+    input_file_names, output_names = find_inputs([str(tmp_path)])
+    output_file_names = get_output_file_names(input_file_names, 'outputs', output_names)
+
+    assert output_file_names == [os.path.join('outputs', 'a', 'case.out'), os.path.join('outputs', 'b', 'case.out')]
+
+
+def test_colliding_output_names_are_rejected(tmp_path):
+    for directory in ('a', 'b'):
+        os.makedirs(tmp_path / directory)
+        (tmp_path / directory / 'case.in').write_text('3')
+
+    input_file_names, output_names = find_inputs([str(tmp_path / 'a'), str(tmp_path / 'b')])
+
+    with pytest.raises(ValueError):
+        get_output_file_names(input_file_names, 'outputs', output_names)
+
+
+def test_unreadable_input_fails_only_its_run(tmp_path):
+    program_file_name = str(tmp_path / 'square.qbin')
+    write_file(program_file_name, Program.from_text('IINP i\nIMLT t1 i i\nIPRT t1\nHALT').link())
+
+    inputs = tmp_path / 'inputs'
+    os.makedirs(inputs)
+    (inputs / 'a.in').write_text('2')
+    (inputs / 'b.in').write_bytes(b'\xff\xfe')
+    (inputs / 'c.in').write_text('4')
+
+    input_file_names, output_names = find_inputs([str(inputs)])
+    summary = run_batch(program_file_name, input_file_names, str(tmp_path / 'outputs'), workers=1,
+                        output_names=output_names)
+
+    assert summary['runs'] == 3 and summary['passed'] == 2
+    assert [ failed['input'] for failed in summary['failed'] ] == [str(inputs / 'b.in')]
+    assert (tmp_path / 'outputs' / 'c.out').read_text().split() == ['16']
@@ -0,0 +1,97 @@
+import os
+import pytest
+from cpq_compiler import compile_source
+from cpq_quad import Program, Instruction, REAL_TARGET_OPCODES, REAL_SOURCE_OPCODES, NON_ASSIGNING_OPCODES
+from cpq_vm import Machine, ClosureCompiler
+from cpq_slots import SlotLayout, INT_SLOT, REAL_SLOT
+
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+
+# Float and int variables which are read before (or without) ever being assigned
+UNASSIGNED_READS = '''
+a, b, c: int;
+x, y, z: float;
+{
+    y = 5.0;
+    output(z + y);
+    output(x + y);
+    output(a);
+    c = 5;
+    while (c > 0) {
+        output(b);
+        b = c;
+        c = c - 1;
+    }
+    x = 1.5;
+    output(x * y);
+}
+'''
+
+
+def typed_arrays(program, layout):
+    """
+    Returns a copy of the given Program as an executor keeping the values in a flat array per type would run it -
+    Every operand is replaced by the slot of its symbol in the array of the type its instruction reads or assigns
+    (_iN for int slot N and _rN for real slot N), regardless of the type of the slot in the layout
+    """
+
+    instructions = list()
+
+    for instruction in program.instructions:
+        operands = list(instruction.operands)
+        first = 1 if instruction.opcode in ('JUMP', 'JMPZ') else 0
+
+        for position in range(first, len(operands)):
+            if operands[position] not in layout.slots:
+                continue
+
+            if position == 0 and instruction.opcode not in NON_ASSIGNING_OPCODES:
+                real = instruction.opcode in REAL_TARGET_OPCODES
+            else:
+                real = instruction.opcode in REAL_SOURCE_OPCODES
+
+            operands[position] = f'_{"r" if real else "i"}{layout.slots[operands[position]][1]}'
+
+        instructions.append(Instruction(instruction.opcode, operands))
+
+    return Program(instructions, dict(program.labels))
+
+
+def run(program, inputs):
+    machine = Machine(inputs)
+    ClosureCompiler(program.link()).compile()(machine)
+    return machine.outputs
+
+
+def get_cases():
+    cases = [('unassigned_reads', UNASSIGNED_READS, [])]
+
+    for file_name in sorted(os.listdir(SAMPLES_DIRECTORY)):
+        if file_name.endswith('.ou'):
+            with open(os.path.join(SAMPLES_DIRECTORY, file_name), 'r') as file:
+                source = file.read()
+
+            with open(os.path.join(SAMPLES_DIRECTORY, file_name[:-len('.ou')] + '.in'), 'r') as file:
+                inputs = file.read().split()
+
+            cases.append((file_name, source, inputs))
+
+    return cases
+
+
+@pytest.mark.parametrize('level', [0, 1, 2])
+@pytest.mark.parametrize('name, source, inputs', [ pytest.param(*case, id=case[0]) for case in get_cases() ])
+def test_typed_arrays_run_like_the_program(name, source, inputs, level):
+    program = Program.from_lines(compile_source(source, optimize=level).instructions)
+    layout = SlotLayout.loads(SlotLayout.from_program(program).dumps())
+
+    assert run(typed_arrays(program, layout), inputs) == run(program, inputs)
+
+
+def test_read_only_float_gets_a_real_slot():
+    program = Program.from_lines(compile_source(UNASSIGNED_READS).instructions)
+    layout = SlotLayout.from_program(program)
+
+    assert layout.slots['z'][0] == REAL_SLOT
+    assert layout.slots['a'][0] == INT_SLOT
+    assert layout.slots['z'] != layout.slots['y']